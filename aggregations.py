@@ -0,0 +1,137 @@
+import argparse
+
+import pandas as pd
+
+from build_indices import build_indices
+from es_pipeline import connect_es
+
+# Spend analytics computed by the cluster with aggregations on the typed "articles" index
+# (see ARTICLES_SETTINGS in index_settings.py). Each function sends one search with "size": 0,
+# so only the aggregated numbers come back, and returns them as a small DataFrame.
+
+DEFAULT_INDEX = "articles"
+DEFAULT_GROUP_SIZE = 100
+METRICS = ("avg", "sum", "min", "max", "stats")
+
+def search_aggregations(es, index_name, aggs, query=None):
+    """
+    Runs the aggregations over the documents matching query (all documents by default) without fetching hits.
+    """
+    body = {"size": 0, "aggs": aggs}
+    if query is not None:
+        body["query"] = query
+    return es.search(index=index_name, body=body)["aggregations"]
+
+def facet_counts(es, index_name, fields, query=None, size=10):
+    """
+    Returns the most frequent values of each field and their document counts, all in one request,
+    as {field: DataFrame with columns value and doc_count}.
+    """
+    aggs = {field: {"terms": {"field": field, "size": size}} for field in fields}
+    result = search_aggregations(es, index_name, aggs, query)
+    return {
+        field: pd.DataFrame([(bucket["key"], bucket["doc_count"]) for bucket in result[field]["buckets"]],
+                            columns=["value", "doc_count"])
+        for field in fields
+    }
+
+def _metric_agg(field, metric, weight_field):
+    if weight_field is not None:
+        return {"weighted_avg": {"value": {"field": field}, "weight": {"field": weight_field}}}
+    if metric not in METRICS:
+        raise ValueError(f"Unsupported metric: {metric} (expected one of {METRICS})")
+    return {metric: {"field": field}}
+
+def metric_by_group(es, index_name, field, group_by, metric="avg", query=None, size=DEFAULT_GROUP_SIZE,
+                    weight_field=None):
+    """
+    Computes a metric of a numeric field for every combination of the group_by fields, e.g. the average
+    totexp_$ by Country_residence and Purpose_grp, with nested terms aggregations in one request.
+    metric is avg, sum, min, max or stats; with weight_field (e.g. Weights_QTR) a weighted average is
+    computed instead. Returns one row per group with the group values, doc_count and the metric.
+    """
+    aggs = {"metric": _metric_agg(field, metric, weight_field)}
+    for group_field in reversed(group_by):
+        aggs = {"group": {"terms": {"field": group_field, "size": size}, "aggs": aggs}}
+    result = search_aggregations(es, index_name, aggs, query)
+
+    rows = []
+
+    def collect(agg, keys):
+        if len(keys) == len(group_by):
+            row = dict(zip(group_by, keys), doc_count=agg["doc_count"])
+            values = agg["metric"]
+            if "value" in values:
+                row["weighted_avg" if weight_field else metric] = values["value"]
+            else:
+                row.update(values)
+            rows.append(row)
+            return
+        if agg["group"]["sum_other_doc_count"]:
+            print(f"Warning: {agg['group']['sum_other_doc_count']} documents fall outside the top {size} "
+                  f"values of {group_by[len(keys)]}; raise size to include them.")
+        for bucket in agg["group"]["buckets"]:
+            collect(bucket, keys + [bucket["key"]])
+
+    collect({"doc_count": None, **result}, [])
+    return pd.DataFrame(rows)
+
+def percentiles(es, index_name, fields, percents=(25, 50, 75, 90, 99), query=None):
+    """
+    Returns the percentiles of each numeric field (one row per field, one column per percent), in one request.
+    """
+    aggs = {field: {"percentiles": {"field": field, "percents": list(percents)}} for field in fields}
+    result = search_aggregations(es, index_name, aggs, query)
+    return pd.DataFrame(
+        [[result[field]["values"][str(float(percent))] for percent in percents] for field in fields],
+        index=fields, columns=[f"p{percent:g}" for percent in percents]
+    )
+
+def date_histogram(es, index_name, field="date", interval="month", sum_fields=(), query=None):
+    """
+    Returns the document count per calendar interval (day, week, month, quarter or year) of a date field,
+    with the sum of each of sum_fields per interval.
+    """
+    aggs = {"histogram": {
+        "date_histogram": {"field": field, "calendar_interval": interval},
+        "aggs": {sum_field: {"sum": {"field": sum_field}} for sum_field in sum_fields},
+    }}
+    result = search_aggregations(es, index_name, aggs, query)
+    rows = []
+    for bucket in result["histogram"]["buckets"]:
+        row = {field: pd.Timestamp(bucket["key"], unit="ms"), "doc_count": bucket["doc_count"]}
+        row.update({sum_field: bucket[sum_field]["value"] for sum_field in sum_fields})
+        rows.append(row)
+    return pd.DataFrame(rows, columns=[field, "doc_count", *sum_fields])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Spend analytics with server-side aggregations.")
+    parser.add_argument("--index", default=DEFAULT_INDEX, help="index with the typed survey mapping")
+    parser.add_argument("--embedded", action="store_true",
+                        help="load --source into the in-process search engine first")
+    parser.add_argument("--source", default="sample_data.csv", help="data loaded with --embedded")
+    args = parser.parse_args(argv)
+
+    es = connect_es(embedded=args.embedded)
+    if args.embedded:
+        build_indices(es, args.source, [args.index], limit=None)
+
+    for field, counts in facet_counts(es, args.index, ["Country_residence", "Purpose_grp", "MainAccomm"]).items():
+        print(f"\nTop values of {field}:")
+        print(counts.to_string(index=False))
+
+    print("\nAverage totexp_$ by Country_residence and Purpose_grp:")
+    print(metric_by_group(es, args.index, "totexp_$", ["Country_residence", "Purpose_grp"]).to_string(index=False))
+
+    print("\nWeighted average totexp_$ by Purpose_grp (Weights_QTR):")
+    print(metric_by_group(es, args.index, "totexp_$", ["Purpose_grp"], weight_field="Weights_QTR")
+          .to_string(index=False))
+
+    print("\nSpend percentiles:")
+    print(percentiles(es, args.index, ["totexp_$", "totshopping_$", "totacc_$"]).to_string())
+
+    print("\nMonthly respondents and spend:")
+    print(date_histogram(es, args.index, "date", "month", ["totexp_$", "totshopping_$"]).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
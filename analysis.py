@@ -0,0 +1,513 @@
+import argparse
+import json
+import re
+from functools import lru_cache
+
+from index_settings import KEYWORDS_SETTINGS, PIPELINE_SETTINGS, STEMMING_SETTINGS, TOKEN_SETTINGS
+
+# Local equivalents of the analysis chains configured in index_settings.py:
+# the standard tokenizer and the lowercase, stop, porter_stem and shingle token filters.
+# Tokens are (term, position, start_offset, end_offset) tuples, like the Analyze API output.
+
+MAX_TOKEN_LENGTH = 255
+STEM_CACHE_SIZE = 65536
+
+# Lucene's default English stop words (the "_english_" set used by the "stop" filter).
+ENGLISH_STOP_WORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it",
+    "no", "not", "of", "on", "or", "such", "that", "the", "their", "then", "there", "these",
+    "they", "this", "to", "was", "will", "with",
+])
+
+# -------------------------------------------
+# Standard tokenizer
+# -------------------------------------------
+# An approximation of the Unicode word break rules (UAX #29) used by the standard tokenizer:
+# letters stay joined across ' . : and digits across , . ; (e.g. "don't", "U.S.A", "1,000.50"),
+# letters, digits and underscores form one token, and each Han/Hiragana character is its own token.
+_IDEOGRAPHIC = "぀-ゟ㐀-䶿一-鿿豈-﫿"
+_WORD_CHAR = rf"(?:(?![{_IDEOGRAPHIC}])\w)"
+_TOKEN_RE = re.compile(
+    rf"[{_IDEOGRAPHIC}]"
+    rf"|{_WORD_CHAR}+"
+    rf"(?:(?:(?<=[^\W\d_])['.:’·](?=[^\W\d_])|(?<=\d)[.,;'’](?=\d)){_WORD_CHAR}+)*"
+)
+
+def standard_tokenize(text, max_token_length=MAX_TOKEN_LENGTH):
+    """
+    Splits text into word tokens. Tokens longer than max_token_length are split into pieces.
+    """
+    tokens = []
+    position = 0
+    for match in _TOKEN_RE.finditer(text):
+        term = match.group()
+        if not term.strip("_"):
+            continue
+        start = match.start()
+        for offset in range(0, len(term), max_token_length):
+            piece = term[offset:offset + max_token_length]
+            tokens.append((piece, position, start + offset, start + offset + len(piece)))
+            position += 1
+    return tokens
+
+# -------------------------------------------
+# Porter stemmer
+# -------------------------------------------
+# A port of Martin Porter's reference implementation, which Lucene's PorterStemmer follows,
+# including its two departures from the paper ("bli" -> "ble" and "logi" -> "log").
+
+class _PorterWord:
+    def __init__(self, word):
+        self.b = list(word)
+        self.k = len(word) - 1
+        self.j = 0
+
+    def cons(self, i):
+        ch = self.b[i]
+        if ch in "aeiou":
+            return False
+        if ch == "y":
+            return i == 0 or not self.cons(i - 1)
+        return True
+
+    def m(self):
+        n = 0
+        i = 0
+        while True:
+            if i > self.j:
+                return n
+            if not self.cons(i):
+                break
+            i += 1
+        i += 1
+        while True:
+            while True:
+                if i > self.j:
+                    return n
+                if self.cons(i):
+                    break
+                i += 1
+            i += 1
+            n += 1
+            while True:
+                if i > self.j:
+                    return n
+                if not self.cons(i):
+                    break
+                i += 1
+            i += 1
+
+    def vowel_in_stem(self):
+        return any(not self.cons(i) for i in range(self.j + 1))
+
+    def double_c(self, j):
+        return j >= 1 and self.b[j] == self.b[j - 1] and self.cons(j)
+
+    def cvc(self, i):
+        if i < 2 or not self.cons(i) or self.cons(i - 1) or not self.cons(i - 2):
+            return False
+        return self.b[i] not in "wxy"
+
+    def ends(self, suffix):
+        length = len(suffix)
+        if length > self.k + 1:
+            return False
+        if "".join(self.b[self.k - length + 1:self.k + 1]) != suffix:
+            return False
+        self.j = self.k - length
+        return True
+
+    def set_to(self, suffix):
+        self.b[self.j + 1:] = list(suffix)
+        self.k = self.j + len(suffix)
+
+    def r(self, suffix):
+        if self.m() > 0:
+            self.set_to(suffix)
+
+    def step1ab(self):
+        if self.b[self.k] == "s":
+            if self.ends("sses"):
+                self.k -= 2
+            elif self.ends("ies"):
+                self.set_to("i")
+            elif self.b[self.k - 1] != "s":
+                self.k -= 1
+            del self.b[self.k + 1:]
+        if self.ends("eed"):
+            if self.m() > 0:
+                self.k -= 1
+        elif (self.ends("ed") or self.ends("ing")) and self.vowel_in_stem():
+            self.k = self.j
+            del self.b[self.k + 1:]
+            if self.ends("at"):
+                self.set_to("ate")
+            elif self.ends("bl"):
+                self.set_to("ble")
+            elif self.ends("iz"):
+                self.set_to("ize")
+            elif self.double_c(self.k):
+                if self.b[self.k] not in "lsz":
+                    self.k -= 1
+            elif self.m() == 1 and self.cvc(self.k):
+                self.j = self.k
+                self.set_to("e")
+        del self.b[self.k + 1:]
+
+    def step1c(self):
+        if self.ends("y") and self.vowel_in_stem():
+            self.b[self.k] = "i"
+
+    _STEP2 = {
+        "a": (("ational", "ate"), ("tional", "tion")),
+        "c": (("enci", "ence"), ("anci", "ance")),
+        "e": (("izer", "ize"),),
+        "l": (("bli", "ble"), ("alli", "al"), ("entli", "ent"), ("eli", "e"), ("ousli", "ous")),
+        "o": (("ization", "ize"), ("ation", "ate"), ("ator", "ate")),
+        "s": (("alism", "al"), ("iveness", "ive"), ("fulness", "ful"), ("ousness", "ous")),
+        "t": (("aliti", "al"), ("iviti", "ive"), ("biliti", "ble")),
+        "g": (("logi", "log"),),
+    }
+
+    _STEP3 = {
+        "e": (("icate", "ic"), ("ative", ""), ("alize", "al")),
+        "i": (("iciti", "ic"),),
+        "l": (("ical", "ic"), ("ful", "")),
+        "s": (("ness", ""),),
+    }
+
+    _STEP4 = {
+        "a": ("al",),
+        "c": ("ance", "ence"),
+        "e": ("er",),
+        "i": ("ic",),
+        "l": ("able", "ible"),
+        "n": ("ant", "ement", "ment", "ent"),
+        "o": ("ion", "ou"),
+        "s": ("ism",),
+        "t": ("ate", "iti"),
+        "u": ("ous",),
+        "v": ("ive",),
+        "z": ("ize",),
+    }
+
+    def _replace_first(self, rules):
+        # Only the first matching suffix is considered, as in the reference implementation.
+        for suffix, replacement in rules:
+            if self.ends(suffix):
+                self.r(replacement)
+                return
+
+    def step2(self):
+        if self.k > 0:
+            self._replace_first(self._STEP2.get(self.b[self.k - 1], ()))
+
+    def step3(self):
+        self._replace_first(self._STEP3.get(self.b[self.k], ()))
+
+    def step4(self):
+        if self.k == 0:
+            return
+        for suffix in self._STEP4.get(self.b[self.k - 1], ()):
+            if self.ends(suffix):
+                if suffix == "ion" and not (self.j >= 0 and self.b[self.j] in "st"):
+                    continue
+                if self.m() > 1:
+                    self.k = self.j
+                return
+
+    def step5(self):
+        self.j = self.k
+        if self.b[self.k] == "e":
+            a = self.m()
+            if a > 1 or (a == 1 and not self.cvc(self.k - 1)):
+                self.k -= 1
+        if self.b[self.k] == "l" and self.double_c(self.k) and self.m() > 1:
+            self.k -= 1
+
+    def stem(self):
+        self.step1ab()
+        if self.k > 0:
+            self.step1c()
+            self.step2()
+            del self.b[self.k + 1:]
+            self.step3()
+            del self.b[self.k + 1:]
+            self.step4()
+            del self.b[self.k + 1:]
+            self.step5()
+        return "".join(self.b[:self.k + 1])
+
+def porter_stem(word):
+    """
+    Returns the Porter stem of a lowercase word. Words of one or two letters are returned unchanged.
+    """
+    if len(word) <= 2:
+        return word
+    return _PorterWord(word).stem()
+
+# Survey text has a small vocabulary compared with its token count, so stems are memoized
+# in a bounded LRU cache; cached_stem.cache_info() reports the hit rate.
+cached_stem = lru_cache(maxsize=STEM_CACHE_SIZE)(porter_stem)
+
+# -------------------------------------------
+# Token filters
+# -------------------------------------------
+# Each filter takes the token list and the end position of the stream (one past the last
+# position produced by the tokenizer) and returns a new token list.
+
+def lowercase_filter(tokens, end_position):
+    return [(term.lower(), position, start, end) for term, position, start, end in tokens]
+
+def make_stop_filter(stopwords=ENGLISH_STOP_WORDS, ignore_case=False):
+    """
+    Returns a filter that removes stop words. Positions are kept, so phrase queries and
+    shingles still see the gaps the removed words leave behind.
+    """
+    if ignore_case:
+        stopwords = frozenset(word.lower() for word in stopwords)
+        return lambda tokens, end_position: [token for token in tokens if token[0].lower() not in stopwords]
+    stopwords = frozenset(stopwords)
+    return lambda tokens, end_position: [token for token in tokens if token[0] not in stopwords]
+
+def make_porter_stem_filter(stem=cached_stem):
+    return lambda tokens, end_position: [
+        (stem(term), position, start, end) for term, position, start, end in tokens
+    ]
+
+def make_shingle_filter(min_shingle_size=2, max_shingle_size=2, output_unigrams=True,
+                        token_separator=" ", filler_token="_"):
+    """
+    Returns a filter that adds word n-grams (shingles) of min_shingle_size to max_shingle_size tokens.
+    Like Lucene's ShingleFilter, positions left empty by removed tokens (before, between or after
+    the remaining tokens, at most max_shingle_size - 1 per gap) are filled with filler_token.
+    Shingles share the position of their first token and are emitted after its unigram.
+    """
+    max_fill = max_shingle_size - 1
+
+    def shingle_filter(tokens, end_position):
+        # Build the stream of real tokens and fillers.
+        slots = []
+        previous = -1
+        for token in tokens:
+            term, position, start, end = token
+            gap = min(position - previous - 1, max_fill)
+            for filler_position in range(position - gap, position):
+                slots.append((None, filler_position, start, start))
+            slots.append(token)
+            previous = position
+        if tokens:
+            gap = min(end_position - previous - 1, max_fill)
+            last_end = tokens[-1][3]
+            for filler_position in range(previous + 1, previous + 1 + gap):
+                slots.append((None, filler_position, last_end, last_end))
+
+        output = []
+        for i, (term, position, start, end) in enumerate(slots):
+            if term is not None and output_unigrams:
+                output.append((term, position, start, end))
+            for size in range(min_shingle_size, max_shingle_size + 1):
+                window = slots[i:i + size]
+                if len(window) < size:
+                    break
+                if all(slot[0] is None for slot in window):
+                    continue
+                text = token_separator.join(filler_token if slot[0] is None else slot[0] for slot in window)
+                output.append((text, position, start, window[-1][3]))
+        return output
+
+    return shingle_filter
+
+def _filter_from_definition(definition):
+    filter_type = definition.get("type")
+    if filter_type == "lowercase":
+        return lowercase_filter
+    if filter_type == "stop":
+        stopwords = definition.get("stopwords", "_english_")
+        if stopwords == "_english_":
+            stopwords = ENGLISH_STOP_WORDS
+        elif stopwords == "_none_":
+            stopwords = ()
+        return make_stop_filter(stopwords, definition.get("ignore_case", False))
+    if filter_type == "porter_stem":
+        return make_porter_stem_filter()
+    if filter_type == "shingle":
+        return make_shingle_filter(
+            definition.get("min_shingle_size", 2),
+            definition.get("max_shingle_size", 2),
+            definition.get("output_unigrams", True),
+            definition.get("token_separator", " "),
+            definition.get("filler_token", "_"),
+        )
+    raise ValueError(f"Unsupported token filter type: {filter_type}")
+
+BUILT_IN_FILTERS = {
+    "lowercase": lowercase_filter,
+    "stop": make_stop_filter(),
+    "porter_stem": make_porter_stem_filter(),
+    "shingle": make_shingle_filter(),
+}
+
+# -------------------------------------------
+# Analyzers
+# -------------------------------------------
+
+class Analyzer:
+    """
+    A tokenizer followed by a chain of token filters.
+    Calling the analyzer on a text returns its tokens as (term, position, start_offset, end_offset).
+    """
+
+    def __init__(self, name, filters, tokenizer=standard_tokenize):
+        self.name = name
+        self.tokenizer = tokenizer
+        self.filters = list(filters)
+
+    def __call__(self, text):
+        tokens = self.tokenizer(text)
+        end_position = tokens[-1][1] + 1 if tokens else 0
+        for token_filter in self.filters:
+            tokens = token_filter(tokens, end_position)
+        return tokens
+
+    def terms(self, text):
+        """
+        Returns just the token strings, like analyze_text in es_pipeline.
+        """
+        return [token[0] for token in self(text)]
+
+    def analyze_corpus(self, texts):
+        """
+        Yields the token strings of every text in an iterable (e.g. a "content" column).
+        """
+        for text in texts:
+            yield self.terms("" if text is None else str(text))
+
+def keyword_tokenize(text):
+    """
+    The keyword tokenizer: the whole text is one token.
+    """
+    return [(text, 0, 0, len(text))]
+
+STANDARD_ANALYZER = Analyzer("standard", [lowercase_filter])
+KEYWORD_ANALYZER = Analyzer("keyword", [], tokenizer=keyword_tokenize)
+
+def _analysis_section(index_settings):
+    settings = (index_settings or {}).get("settings", index_settings or {})
+    return settings.get("analysis") or settings.get("index", {}).get("analysis", {})
+
+def build_analyzer(name, index_settings=None):
+    """
+    Builds the analyzer called name from an index body (or its "settings" part) as passed to
+    create_index. "standard" and "keyword" are always available. Only the standard tokenizer is
+    supported in custom analyzers.
+    """
+    analysis = _analysis_section(index_settings)
+    definition = analysis.get("analyzer", {}).get(name)
+    if definition is None:
+        if name == "standard":
+            return STANDARD_ANALYZER
+        if name == "keyword":
+            return KEYWORD_ANALYZER
+        raise ValueError(f"Unknown analyzer: {name}")
+    if definition.get("type", "custom") != "custom":
+        raise ValueError(f"Unsupported analyzer type: {definition.get('type')}")
+    if definition.get("tokenizer", "standard") != "standard":
+        raise ValueError(f"Unsupported tokenizer: {definition.get('tokenizer')}")
+
+    custom_filters = analysis.get("filter", {})
+    filters = []
+    for filter_name in definition.get("filter", []):
+        if filter_name in custom_filters:
+            filters.append(_filter_from_definition(custom_filters[filter_name]))
+        elif filter_name in BUILT_IN_FILTERS:
+            filters.append(BUILT_IN_FILTERS[filter_name])
+        else:
+            raise ValueError(f"Unknown token filter: {filter_name}")
+    return Analyzer(name, filters)
+
+# -------------------------------------------
+# Parity check against the Analyze API
+# -------------------------------------------
+
+# The analyzer configurations of the project's indices, and texts to compare them on.
+PARITY_INDICES = {
+    "articles_token": (TOKEN_SETTINGS, "my_lowercase_analyzer"),
+    "articles_stemming": (STEMMING_SETTINGS, "stem_analyzer"),
+    "articles_pipeline": (PIPELINE_SETTINGS, "custom_analyzer"),
+    "articles_keywords": (KEYWORDS_SETTINGS, "keyword_selector"),
+}
+PARITY_TEXTS = [
+    "The Quick Brown Fox Jumps Over The Lazy Dog.",
+    "The buses were running while the bus driver drove the busses.",
+    "Gerard Salton (8 March 1927 in Nuremberg - 28 August 1995), also known as Gerry Salton, "
+    "was a Professor of Computer Science at Cornell University.",
+    "Visiting an international student studying in Singapore",
+    "Professiols (doctor, lawyer, lecturer, etc) stayed 4 days at the V Hotel Lavender; "
+    "spent $1,096.19 on shopping & F&B. It's the 1st visit to the U.S.A. for Children aged 8-12 yrs",
+]
+
+def record_parity_fixture(es, fixture_file, texts=PARITY_TEXTS, csv_file=None, sample_rows=50):
+    """
+    Records the Analyze API output of every analyzer in PARITY_INDICES for the given texts
+    (plus the "content" of the first sample_rows rows of csv_file) into a JSON fixture.
+    The indices are created with their settings if they do not exist yet.
+    """
+    texts = list(texts)
+    if csv_file is not None:
+        import pandas as pd
+        from documents import build_content
+        texts.extend(build_content(pd.read_csv(csv_file, nrows=sample_rows)).tolist())
+
+    cases = []
+    for index_name, (settings, analyzer) in PARITY_INDICES.items():
+        if not es.indices.exists(index=index_name):
+            es.indices.create(index=index_name, body=settings)
+        for text in texts:
+            response = es.indices.analyze(index=index_name, body={"analyzer": analyzer, "text": text})
+            tokens = [[token["token"], token["position"]] for token in response["tokens"]]
+            cases.append({"index": index_name, "analyzer": analyzer, "text": text, "tokens": tokens})
+
+    with open(fixture_file, "w", encoding="utf-8") as f:
+        json.dump({"indices": {name: settings for name, (settings, _) in PARITY_INDICES.items()},
+                   "cases": cases}, f, indent=1, ensure_ascii=False)
+    print(f"Recorded {len(cases)} analyzer cases into {fixture_file}")
+
+def check_parity(fixture_file):
+    """
+    Compares the local analyzers token for token (term and position) with a recorded fixture.
+    Prints every mismatch and returns the list of mismatching cases.
+    """
+    with open(fixture_file, encoding="utf-8") as f:
+        fixture = json.load(f)
+
+    mismatches = []
+    for case in fixture["cases"]:
+        analyzer = build_analyzer(case["analyzer"], fixture["indices"][case["index"]])
+        local = [[term, position] for term, position, _, _ in analyzer(case["text"])]
+        if local != case["tokens"]:
+            mismatches.append(case)
+            print(f"\nMismatch for '{case['analyzer']}' on: {case['text'][:80]}")
+            print("  expected:", case["tokens"])
+            print("  local:   ", local)
+    print(f"\n{len(fixture['cases']) - len(mismatches)}/{len(fixture['cases'])} analyzer cases match.")
+    return mismatches
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local analyzer parity check against the Analyze API.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record = subparsers.add_parser("record", help="record Analyze API output from a running cluster")
+    record.add_argument("--fixture", default="analysis_parity.json")
+    record.add_argument("--csv", default="sample_data.csv", help="CSV file to sample extra texts from")
+    check = subparsers.add_parser("check", help="compare the local analyzers with a recorded fixture")
+    check.add_argument("--fixture", default="analysis_parity.json")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        from es_pipeline import connect_es
+        record_parity_fixture(connect_es(), args.fixture, csv_file=args.csv)
+    elif check_parity(args.fixture):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from es_pipeline import settings_version
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_WORKERS = 4
+DEFAULT_CACHE_SIZE = 100000
+
+def _java_length(text):
+    """
+    Returns the length of text in UTF-16 code units, which is how Elasticsearch counts offsets.
+    """
+    return len(text.encode("utf-16-le")) // 2
+
+def split_analyze_response(texts, response):
+    """
+    Splits the tokens of an Analyze API response for an array of texts back into one token list per text.
+    Elasticsearch continues the offsets of each text where the previous one ended, plus an offset gap of 1,
+    so every token is assigned to the text whose offset range contains its start offset.
+    """
+    starts = []
+    offset = 0
+    for text in texts:
+        starts.append(offset)
+        offset += _java_length(text) + 1
+    tokens = [[] for _ in texts]
+    for token in response["tokens"]:
+        tokens[bisect_right(starts, token["start_offset"]) - 1].append(token["token"])
+    return tokens
+
+class AnalyzeClient:
+    """
+    Analyzes many texts with few Analyze API calls.
+    Texts are sent batch_size at a time as a text array, batches run on max_workers threads, and
+    results are kept in an LRU cache keyed by (index, analyzer, text, settings version). The settings
+    version comes from es_pipeline.create_index, so recreating an index with different analysis
+    settings makes its old cache entries unreachable.
+    """
+
+    def __init__(self, es, batch_size=DEFAULT_BATCH_SIZE, max_workers=DEFAULT_WORKERS,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        self.es = es
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def analyze(self, index_name, analyzer, text):
+        """
+        Returns the tokens of a single text.
+        """
+        return self.analyze_many(index_name, analyzer, [text])[0]
+
+    def analyze_many(self, index_name, analyzer, texts):
+        """
+        Returns the list of tokens of every text, in the order given.
+        """
+        texts = list(texts)
+        version = settings_version(index_name)
+        results = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for i, text in enumerate(texts):
+                key = (index_name, analyzer, text, version)
+                tokens = self._cache.get(key)
+                if tokens is not None:
+                    self._cache.move_to_end(key)
+                    results[i] = list(tokens)
+                    self.hits += 1
+                else:
+                    missing.setdefault(text, []).append(i)
+                    self.misses += 1
+
+        if missing:
+            pending = list(missing)
+            batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                analyzed = executor.map(lambda batch: self._analyze_batch(index_name, analyzer, batch), batches)
+                for batch, batch_tokens in zip(batches, analyzed):
+                    with self._lock:
+                        for text, tokens in zip(batch, batch_tokens):
+                            self._store((index_name, analyzer, text, version), tuple(tokens))
+                            for i in missing[text]:
+                                results[i] = list(tokens)
+        return results
+
+    def _analyze_batch(self, index_name, analyzer, texts):
+        response = self.es.indices.analyze(index=index_name, body={"analyzer": analyzer, "text": texts})
+        return split_analyze_response(texts, response)
+
+    def _store(self, key, tokens):
+        self._cache[key] = tokens
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def cache_info(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._cache), "max_size": self.cache_size}
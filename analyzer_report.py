@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from analysis import build_analyzer
+from documents import build_content
+from es_pipeline import DEFAULT_CHUNK_SIZE, iter_source_chunks
+from index_settings import INDEX_REGISTRY
+from segment import LENGTHS_DTYPE, SKIP_ARRAY_DTYPES, SKIP_INTERVAL, TERM_ARRAY_DTYPES
+
+# The cost of each analyzer configuration of the project, measured over the whole corpus: for every
+# "content" index of the registry (custom_analyzer of es_pipeline.py, keyword_selector of select_keywords.py,
+# stem_analyzer of stemming_analysis.py, my_lowercase_analyzer of token_casefold.py) the vocabulary size,
+# the postings (term, document pairs) and positions it produces, an estimate of the bytes the content field
+# takes in a segment (segment.py's layout) and the analysis throughput. Chunks of rows are analyzed with
+# every configuration in a process pool; the parent merges the per-chunk counts in row order.
+
+# Bytes per term, per skip entry and per document of a segment.py field, from the dtypes it writes.
+TERM_ENTRY_BYTES = sum(np.dtype(dtype).itemsize for dtype in TERM_ARRAY_DTYPES.values())
+SKIP_ENTRY_BYTES = sum(np.dtype(dtype).itemsize for dtype in SKIP_ARRAY_DTYPES.values())
+FIELD_LENGTH_BYTES = np.dtype(LENGTHS_DTYPE).itemsize
+
+_analyzers = {}
+
+def content_analyzers(registry=INDEX_REGISTRY):
+    """
+    Returns {index name: analyzer name} for the registry's indices of "content" documents.
+    """
+    analyzers = {}
+    for name, entry in registry.items():
+        if entry["documents"] == "content":
+            content = entry["settings"].get("mappings", {}).get("properties", {}).get("content", {})
+            analyzers[name] = content.get("analyzer", "standard")
+    return analyzers
+
+def _varint_size(value):
+    return 1 if value < 128 else (value.bit_length() + 6) // 7
+
+def _shard_analyzer(index_name):
+    analyzer = _analyzers.get(index_name)
+    if analyzer is None:
+        settings = INDEX_REGISTRY[index_name]["settings"]
+        content = settings["mappings"]["properties"]["content"]
+        analyzer = _analyzers[index_name] = build_analyzer(content.get("analyzer", "standard"), settings)
+    return analyzer
+
+def analyze_shard(index_name, texts, first_doc):
+    """
+    Analyzes a chunk of texts (documents first_doc, first_doc + 1, ...) with the content analyzer of
+    index_name. Returns the chunk's counts: tokens, postings, the varint bytes of term frequencies and
+    positions, the analysis time and, per term, [document frequency, first doc, last doc, bytes of the
+    doc id deltas between its documents in the chunk].
+    """
+    analyzer = _shard_analyzer(index_name)
+    start = time.process_time()
+    analyzed = [analyzer("" if text is None else str(text)) for text in texts]
+    seconds = time.process_time() - start
+
+    terms = {}
+    tokens = postings = freq_bytes = position_bytes = 0
+    for doc, doc_tokens in enumerate(analyzed, first_doc):
+        tokens += len(doc_tokens)
+        last_positions = {}
+        freqs = {}
+        for term, position, _, _ in doc_tokens:
+            position_bytes += _varint_size(position - last_positions.get(term, 0))
+            last_positions[term] = position
+            freqs[term] = freqs.get(term, 0) + 1
+        postings += len(freqs)
+        for term, freq in freqs.items():
+            freq_bytes += _varint_size(freq)
+            stats = terms.get(term)
+            if stats is None:
+                terms[term] = [1, doc, doc, 0]
+            else:
+                stats[0] += 1
+                stats[3] += _varint_size(doc - stats[2])
+                stats[2] = doc
+    return {"documents": len(texts), "tokens": tokens, "postings": postings, "freq_bytes": freq_bytes,
+            "position_bytes": position_bytes, "seconds": seconds, "terms": terms}
+
+class AnalyzerStats:
+    """
+    The counts of one analyzer configuration, merged from its chunks in document order.
+    terms maps each term to [document frequency, last doc, bytes of its doc id deltas].
+    """
+
+    def __init__(self, index_name, analyzer_name):
+        self.index_name = index_name
+        self.analyzer_name = analyzer_name
+        self.terms = {}
+        self.documents = self.tokens = self.postings = 0
+        self.freq_bytes = self.position_bytes = 0
+        self.seconds = 0.0
+
+    def add(self, shard):
+        self.documents += shard["documents"]
+        self.tokens += shard["tokens"]
+        self.postings += shard["postings"]
+        self.freq_bytes += shard["freq_bytes"]
+        self.position_bytes += shard["position_bytes"]
+        self.seconds += shard["seconds"]
+        terms = self.terms
+        for term, (df, first_doc, last_doc, delta_bytes) in shard["terms"].items():
+            stats = terms.get(term)
+            if stats is None:
+                # The first document of a term is encoded as a delta from 0.
+                terms[term] = [df, last_doc, delta_bytes + _varint_size(first_doc)]
+            else:
+                stats[0] += df
+                stats[2] += delta_bytes + _varint_size(first_doc - stats[1])
+                stats[1] = last_doc
+
+    def estimated_bytes(self):
+        """
+        Returns the estimated bytes of the content field in a segment, by part.
+        """
+        sizes = {
+            "terms": sum(len(term.encode("utf-8")) for term in self.terms) + TERM_ENTRY_BYTES * (len(self.terms) + 1),
+            "postings": sum(stats[2] for stats in self.terms.values()) + self.freq_bytes,
+            "positions": self.position_bytes,
+            "skips": SKIP_ENTRY_BYTES * sum(-(-stats[0] // SKIP_INTERVAL) for stats in self.terms.values()
+                                            if stats[0] > SKIP_INTERVAL),
+            "field_lengths": FIELD_LENGTH_BYTES * self.documents,
+        }
+        sizes["total"] = sum(sizes.values())
+        return sizes
+
+    def report(self):
+        return {
+            "index": self.index_name,
+            "analyzer": self.analyzer_name,
+            "documents": self.documents,
+            "vocabulary": len(self.terms),
+            "postings": self.postings,
+            "positions": self.tokens,
+            "tokens_per_document": self.tokens / self.documents if self.documents else 0.0,
+            "estimated_bytes": self.estimated_bytes(),
+            "analysis_seconds": self.seconds,
+            "tokens_per_second": self.tokens / self.seconds if self.seconds else 0.0,
+            "documents_per_second": self.documents / self.seconds if self.seconds else 0.0,
+        }
+
+def analyzer_report(source_file, index_names=None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, limit=None):
+    """
+    Runs the content analyzer of every index in index_names (default: every "content" index of the registry)
+    over a CSV file or workbook and returns one report dict per analyzer. The text of a row is its
+    "content" field as es_pipeline builds it. Chunks of chunk_size rows are analyzed by analyze_shard in a
+    pool of workers processes, with at most two tasks per worker in flight. Throughput is measured in the
+    workers as CPU time spent analyzing (not counting), so it does not depend on the number of workers.
+    """
+    analyzers = content_analyzers()
+    index_names = index_names or list(analyzers)
+    unknown = [name for name in index_names if name not in analyzers]
+    if unknown:
+        raise ValueError(f"Not an index of content documents: {', '.join(unknown)}")
+    workers = workers or os.cpu_count() or 1
+    stats = {name: AnalyzerStats(name, analyzers[name]) for name in index_names}
+    start = time.perf_counter()
+    rows = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in iter_source_chunks(source_file, chunk_size, limit):
+            texts = build_content(chunk).tolist()
+            for name in index_names:
+                pending.append((name, executor.submit(analyze_shard, name, texts, rows)))
+            rows += len(chunk)
+            while len(pending) >= 2 * workers:
+                name, future = pending.popleft()
+                stats[name].add(future.result())
+        while pending:
+            name, future = pending.popleft()
+            stats[name].add(future.result())
+    print(f"Analyzed {rows} rows with {len(index_names)} analyzer(s) in {time.perf_counter() - start:.2f}s "
+          f"with {workers} worker(s).")
+    return [stats[name].report() for name in index_names]
+
+def print_report(reports):
+    print(f"\n{'analyzer':<42}{'terms':>11}{'postings':>13}{'positions':>13}{'est. MB':>10}{'tokens/s':>12}")
+    for report in reports:
+        label = f"{report['analyzer']} ({report['index']})"
+        print(f"{label:<42}{report['vocabulary']:>11}{report['postings']:>13}{report['positions']:>13}"
+              f"{report['estimated_bytes']['total'] / 1e6:>10.2f}{report['tokens_per_second']:>12.0f}")
+    print("\nEstimated bytes by part:")
+    for report in reports:
+        parts = ", ".join(f"{part} {size / 1e6:.2f} MB" for part, size in report["estimated_bytes"].items()
+                          if part != "total")
+        print(f"  {report['analyzer']}: {parts}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the vocabulary, postings, size and speed of each analyzer.")
+    parser.add_argument("--source", default="sample_data.csv", help="CSV file or Excel workbook")
+    parser.add_argument("--index", nargs="+", default=None, help="indices whose content analyzer to measure "
+                                                                 "(default: every content index)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per task")
+    parser.add_argument("--limit", type=int, default=0, help="maximum rows to read (0 reads every row)")
+    parser.add_argument("--output", default=None, help="write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    reports = analyzer_report(args.source, args.index, args.workers, args.chunk_size, args.limit or None)
+    print_report(reports)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+
+if __name__ == "__main__":
+    main()
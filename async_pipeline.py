@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import os
+import time
+
+from elasticsearch import ApiError, AsyncElasticsearch
+from elasticsearch.helpers import BulkIndexError, async_streaming_bulk
+
+from es_pipeline import DEFAULT_BULK_SIZE, DEFAULT_CHUNK_SIZE, DEFAULT_ES_HOST, generate_actions, iter_source_chunks
+from index_settings import PIPELINE_SETTINGS
+
+# Asyncio variant of es_pipeline: one shared, pooled AsyncElasticsearch client, a bounded number of
+# bulk requests in flight, and exponential backoff when the cluster rejects work with HTTP 429.
+
+DEFAULT_IN_FLIGHT = 4
+DEFAULT_MAX_CHUNK_BYTES = 5 * 1024 * 1024
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_INITIAL_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 30
+
+_client = None
+
+def get_async_client(host=None, http_compress=False, connections_per_node=10):
+    """
+    Returns the shared AsyncElasticsearch client, creating it on first use. The server is host, else the
+    ES_HOST environment variable, else DEFAULT_ES_HOST (as for es_pipeline.connect_es).
+    All coroutines in the process share its connection pool; close it with close_async_client().
+    """
+    global _client
+    if _client is None:
+        host = host or os.environ.get("ES_HOST") or DEFAULT_ES_HOST
+        _client = AsyncElasticsearch(
+            host,
+            basic_auth=("elastic", "password"),
+            verify_certs=False,
+            http_compress=http_compress,
+            connections_per_node=connections_per_node
+        )
+    return _client
+
+async def close_async_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+def _is_rejection(error):
+    return isinstance(error, ApiError) and (
+        error.meta.status == 429 or "es_rejected_execution_exception" in str(error)
+    )
+
+async def with_backoff(call, max_retries=DEFAULT_MAX_RETRIES, initial_backoff=DEFAULT_INITIAL_BACKOFF,
+                       max_backoff=DEFAULT_MAX_BACKOFF):
+    """
+    Awaits call() and retries it with exponential backoff while the cluster answers 429 / rejected execution.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return await call()
+        except ApiError as error:
+            if not _is_rejection(error) or attempt == max_retries:
+                raise
+            await asyncio.sleep(min(max_backoff, initial_backoff * 2 ** attempt))
+
+async def async_create_index(client, index_name, settings):
+    """
+    Creates an index with the given settings. If the index exists, it is deleted first.
+    """
+    if await client.indices.exists(index=index_name):
+        await client.indices.delete(index=index_name)
+        print(f"Deleted existing index: {index_name}")
+    await client.indices.create(index=index_name, body=settings)
+    print(f"Created index: {index_name}")
+
+async def async_index_documents(client, index_name, source_file, chunk_size=DEFAULT_CHUNK_SIZE, limit=None,
+                                bulk_size=DEFAULT_BULK_SIZE, max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+                                in_flight=DEFAULT_IN_FLIGHT, max_retries=DEFAULT_MAX_RETRIES,
+                                initial_backoff=DEFAULT_INITIAL_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF):
+    """
+    Streams the source file into an index with async_streaming_bulk.
+    A reader task parses chunks on a worker thread and queues their actions; in_flight sender tasks each run
+    async_streaming_bulk over the queue, so at most in_flight bulk requests are outstanding. Bulk requests
+    hold at most bulk_size documents and max_chunk_bytes bytes, and documents rejected with 429 are retried
+    with exponential backoff (initial_backoff doubling up to max_backoff, max_retries times).
+    """
+    queue = asyncio.Queue(maxsize=in_flight * 2)
+    errors = []
+    indexed = 0
+
+    async def read_chunks():
+        chunks = iter_source_chunks(source_file, chunk_size, limit)
+
+        def next_actions():
+            # Parsing and document building run on a worker thread so the event loop keeps sending.
+            chunk = next(chunks, None)
+            return None if chunk is None else list(generate_actions(index_name, chunk))
+
+        rows = 0
+        try:
+            while True:
+                actions = await asyncio.to_thread(next_actions)
+                if actions is None:
+                    break
+                rows += len(actions)
+                await queue.put(actions)
+                print(f"Queued {len(actions)} documents ({rows} total).")
+        finally:
+            for _ in range(in_flight):
+                await queue.put(None)
+
+    async def queued_actions():
+        while True:
+            actions = await queue.get()
+            if actions is None:
+                return
+            for action in actions:
+                yield action
+
+    async def send():
+        nonlocal indexed
+        async for ok, item in async_streaming_bulk(
+            client, queued_actions(), chunk_size=bulk_size, max_chunk_bytes=max_chunk_bytes,
+            raise_on_error=False, max_retries=max_retries, initial_backoff=initial_backoff,
+            max_backoff=max_backoff
+        ):
+            if ok:
+                indexed += 1
+            else:
+                errors.append(item)
+
+    start = time.perf_counter()
+    await asyncio.gather(read_chunks(), *(send() for _ in range(in_flight)))
+    elapsed = time.perf_counter() - start
+
+    if errors:
+        print(f"BulkIndexError: {len(errors)} document(s) failed to index.")
+        for error in errors:
+            print(error)
+        raise BulkIndexError(f"{len(errors)} document(s) failed to index.", errors)
+    print(f"Indexed {indexed} documents into index '{index_name}' in {elapsed:.2f}s "
+          f"({indexed / elapsed if elapsed else 0:.0f} docs/s).")
+    return indexed
+
+async def async_search_documents(client, index_name, query, description="Query", **backoff):
+    """
+    Executes a search query (retrying rejected requests) and prints the total hit count and each hit's score and content.
+    """
+    res = await with_backoff(lambda: client.search(index=index_name, body=query), **backoff)
+    print(f"\nExecuting {description}:")
+    print("Total hits:", res["hits"]["total"]["value"])
+    for hit in res["hits"]["hits"]:
+        content = hit["_source"].get("content", "No content field")
+        print("Score:", hit["_score"], "Content:", content)
+    print("-" * 50)
+    return res
+
+async def async_main(args):
+    host = args.host or os.environ.get("ES_HOST") or DEFAULT_ES_HOST
+    client = get_async_client(host, http_compress=args.compress, connections_per_node=args.in_flight * 2)
+    try:
+        if not await client.ping():
+            raise ValueError(f"Connection failed: Ensure Elasticsearch is running on {host}")
+        print(f"Connected to Elasticsearch on {host}.")
+
+        index_name = "articles_pipeline"
+        await async_create_index(client, index_name, PIPELINE_SETTINGS)
+        await async_index_documents(client, index_name, args.source, chunk_size=args.chunk_size,
+                                    limit=args.limit or None, bulk_size=args.bulk_size,
+                                    max_chunk_bytes=args.max_chunk_bytes, in_flight=args.in_flight)
+        await client.indices.refresh(index=index_name)
+
+        # The three example queries of es_pipeline, sent concurrently over the shared connection pool.
+        queries = [
+            ({"query": {"match": {"content": "Singapore"}}}, "Query 1: Match 'Singapore'"),
+            ({"query": {"bool": {"must": [{"match": {"content": "Indonesian"}},
+                                          {"match": {"content": "tourist"}}]}}},
+             "Query 2: Boolean 'Indonesian' AND 'tourist'"),
+            ({"query": {"match_phrase": {"content": "Indonesian tourist"}}}, "Query 3: Phrase 'Indonesian tourist'"),
+        ]
+        await asyncio.gather(*(async_search_documents(client, index_name, query, description)
+                               for query, description in queries))
+    finally:
+        await close_async_client()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Asyncio ingestion and query pipeline.")
+    parser.add_argument("--source", default="sample_data.csv", help="CSV file or Excel workbook to index")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows read per chunk")
+    parser.add_argument("--bulk-size", type=int, default=DEFAULT_BULK_SIZE, help="documents per bulk request")
+    parser.add_argument("--max-chunk-bytes", type=int, default=DEFAULT_MAX_CHUNK_BYTES,
+                        help="maximum size of one bulk request in bytes")
+    parser.add_argument("--in-flight", type=int, default=DEFAULT_IN_FLIGHT,
+                        help="maximum number of concurrent bulk requests")
+    parser.add_argument("--limit", type=int, default=1000, help="maximum rows to index (0 indexes every row)")
+    parser.add_argument("--compress", action="store_true", help="gzip-compress request bodies")
+    parser.add_argument("--host", default=None,
+                        help=f"Elasticsearch server (default: $ES_HOST or {DEFAULT_ES_HOST})")
+    args = parser.parse_args(argv)
+    asyncio.run(async_main(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from data_cache import build_cache, load_frame
+from documents import build_content_documents, build_ids
+from es_pipeline import (DEFAULT_BULK_SIZE, DEFAULT_CHUNK_SIZE, connect_es, create_index, index_documents,
+                         iter_source_chunks)
+from index_settings import PIPELINE_SETTINGS
+from instrumentation import metrics
+from query_runner import latency_summary
+from synthetic_data import DEFAULT_SEED, parse_rows, write_synthetic
+
+# Benchmarks of the pipeline stages on synthetic survey data (see synthetic_data.py): CSV and workbook
+# loading, document building, bulk indexing, analysis and the three canonical queries of search_queries.py.
+# Results are written as JSON; given a baseline result file, every benchmark that got slower by more
+# than the threshold is reported and the run exits with status 1.
+
+BENCHMARK_INDEX = "benchmark_pipeline"
+DEFAULT_DATA_DIR = "benchmark_data"
+DEFAULT_QUERY_REPEAT = 50
+DEFAULT_ANALYZE_BATCH = 100
+DEFAULT_THRESHOLD = 0.2
+# Slowdowns smaller than this many seconds are timer noise and never count as regressions.
+DEFAULT_MIN_SECONDS = 0.01
+
+# The three canonical queries of search_queries.py.
+QUERIES = {
+    "query_match": {"query": {"match": {"content": "Singapore"}}},
+    "query_bool": {"query": {"bool": {"must": [{"match": {"content": "Indonesian"}},
+                                               {"match": {"content": "tourist"}}]}}},
+    "query_phrase": {"query": {"match_phrase": {"content": "Indonesian tourist"}}},
+}
+
+def connect(es_url=None):
+    """
+    Returns the embedded search engine, or a client for the Elasticsearch (or stand-in) server at es_url
+    (see es_pipeline.connect_es).
+    """
+    return connect_es(embedded=es_url is None, host=es_url)
+
+def synthetic_file(rows, data_dir=DEFAULT_DATA_DIR, seed=DEFAULT_SEED):
+    """
+    Returns the path of a synthetic CSV file with the given number of rows, generating it if needed.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"synthetic_{rows}_{seed}.csv")
+    if not os.path.exists(path):
+        write_synthetic(path, rows, seed=seed)
+    return path
+
+def _result(seconds, items, unit):
+    return {"seconds": seconds, "items": items, "unit": unit, "per_second": items / seconds if seconds else 0.0}
+
+def bench_csv_load(source_file, chunk_size):
+    start = time.perf_counter()
+    rows = sum(len(chunk) for chunk in iter_source_chunks(source_file, chunk_size))
+    return _result(time.perf_counter() - start, rows, "rows")
+
+def bench_workbook(workbook_file):
+    """
+    Times parsing the workbook into its columnar cache and loading it back from the cache.
+    """
+    start = time.perf_counter()
+    rows = build_cache(workbook_file)["rows"]
+    parse = _result(time.perf_counter() - start, rows, "rows")
+    start = time.perf_counter()
+    df = load_frame(workbook_file)
+    cached = _result(time.perf_counter() - start, len(df), "rows")
+    return {"xlsx_parse": parse, "xlsx_cached_load": cached}
+
+def bench_build_documents(source_file, chunk_size):
+    seconds = 0.0
+    documents = 0
+    for chunk in iter_source_chunks(source_file, chunk_size):
+        start = time.perf_counter()
+        documents += len(build_content_documents(chunk))
+        build_ids(chunk)
+        seconds += time.perf_counter() - start
+    return _result(seconds, documents, "documents")
+
+def bench_bulk_index(es, source_file, chunk_size, bulk_size):
+    """
+    Indexes the whole file and returns the time spent in bulk requests (reading and document building
+    are measured by their own benchmarks).
+    """
+    create_index(es, BENCHMARK_INDEX, PIPELINE_SETTINGS)
+    metrics.reset()
+    metrics.configure()
+    try:
+        index_documents(es, BENCHMARK_INDEX, source_file, chunk_size=chunk_size, bulk_size=bulk_size)
+        indexing = metrics.report()["indexing"]
+    finally:
+        metrics.configure(enabled=False)
+    es.indices.refresh(index=BENCHMARK_INDEX)
+    result = _result(indexing["bulk_seconds"], indexing["documents"], "documents")
+    result["bytes"] = indexing["bytes"]
+    return result
+
+def bench_analysis(es, source_file, batch_size=DEFAULT_ANALYZE_BATCH, max_texts=10000):
+    """
+    Analyzes the content of up to max_texts documents with the pipeline's custom analyzer,
+    batch_size texts per Analyze API request.
+    """
+    texts = []
+    for chunk in iter_source_chunks(source_file, limit=max_texts):
+        texts.extend(document["content"] for document in build_content_documents(chunk))
+    tokens = 0
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        response = es.indices.analyze(index=BENCHMARK_INDEX,
+                                      body={"analyzer": "custom_analyzer", "text": texts[i:i + batch_size]})
+        tokens += len(response["tokens"])
+    result = _result(time.perf_counter() - start, tokens, "tokens")
+    result["texts"] = len(texts)
+    return result
+
+def bench_query(es, query, repeat=DEFAULT_QUERY_REPEAT):
+    """
+    Runs a query repeat times and returns its total time and latency percentiles.
+    """
+    es.search(index=BENCHMARK_INDEX, body=query)
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = es.search(index=BENCHMARK_INDEX, body=query)
+        latencies.append(time.perf_counter() - start)
+    result = _result(sum(latencies), repeat, "queries")
+    result["latency"] = latency_summary(latencies)
+    result["hits"] = response["hits"]["total"]["value"]
+    return result
+
+def run_benchmarks(es, source_file, workbook_file=None, chunk_size=DEFAULT_CHUNK_SIZE, bulk_size=DEFAULT_BULK_SIZE,
+                   query_repeat=DEFAULT_QUERY_REPEAT):
+    """
+    Runs every benchmark and returns {name: result}.
+    """
+    results = {}
+
+    def report(name):
+        print(f"  {name}: {results[name]['seconds']:.3f}s "
+              f"({results[name]['per_second']:.0f} {results[name]['unit']}/s)")
+
+    def run(name, function, *args):
+        print(f"Running {name}...")
+        results[name] = function(*args)
+        report(name)
+
+    run("csv_load", bench_csv_load, source_file, chunk_size)
+    if workbook_file and os.path.exists(workbook_file):
+        print("Running xlsx_parse and xlsx_cached_load...")
+        results.update(bench_workbook(workbook_file))
+        report("xlsx_parse")
+        report("xlsx_cached_load")
+    run("build_documents", bench_build_documents, source_file, chunk_size)
+    run("bulk_index", bench_bulk_index, es, source_file, chunk_size, bulk_size)
+    run("analysis", bench_analysis, es, source_file)
+    for name, query in QUERIES.items():
+        run(name, bench_query, es, query, query_repeat)
+    return results
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, min_seconds=DEFAULT_MIN_SECONDS):
+    """
+    Returns (name, baseline seconds, current seconds) for every benchmark of both runs that
+    took more than (1 + threshold) times as long as in the baseline, and at least min_seconds longer.
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        previous = baseline["results"].get(name)
+        if (previous and previous["seconds"] and result["seconds"] > previous["seconds"] * (1 + threshold)
+                and result["seconds"] - previous["seconds"] >= min_seconds):
+            regressions.append((name, previous["seconds"], result["seconds"]))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ingest, analysis and query speed on synthetic data.")
+    parser.add_argument("--rows", type=parse_rows, default=parse_rows("10k"),
+                        help="rows of synthetic data, e.g. 10k, 100k, 1M or 10M")
+    parser.add_argument("--source", default=None, help="benchmark this CSV file instead of synthetic data")
+    parser.add_argument("--workbook", default="mock survey data.xlsx",
+                        help="workbook for the XLSX load benchmarks (skipped if missing)")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="directory for generated data")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--es-url", default=None,
+                        help="Elasticsearch or stand-in server to benchmark (default: the embedded engine)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--bulk-size", type=int, default=DEFAULT_BULK_SIZE)
+    parser.add_argument("--query-repeat", type=int, default=DEFAULT_QUERY_REPEAT)
+    parser.add_argument("--output", default="benchmark_results.json", help="file to write the results to")
+    parser.add_argument("--baseline", default=None, help="earlier results file to compare with")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown against the baseline before failing (0.2 = 20%%)")
+    parser.add_argument("--min-seconds", type=float, default=DEFAULT_MIN_SECONDS,
+                        help="slowdowns shorter than this are never reported as regressions")
+    args = parser.parse_args(argv)
+
+    source_file = args.source or synthetic_file(args.rows, args.data_dir, args.seed)
+    es = connect(args.es_url)
+    results = run_benchmarks(es, source_file, args.workbook, args.chunk_size, args.bulk_size, args.query_repeat)
+    run = {
+        "meta": {
+            "source": source_file,
+            "rows": results["csv_load"]["items"],
+            "target": args.es_url or "embedded",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(f"Wrote benchmark results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["meta"]["rows"] != run["meta"]["rows"] or baseline["meta"]["target"] != run["meta"]["target"]:
+            print("Warning: the baseline was run on a different data size or target.")
+        regressions = compare(baseline, run, args.threshold, args.min_seconds)
+        for name, before, after in regressions:
+            print(f"Regression in {name}: {before:.3f}s -> {after:.3f}s ({after / before - 1:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No benchmark slowed down by more than {args.threshold:.0%} (and {args.min_seconds}s).")
+
+if __name__ == "__main__":
+    main()
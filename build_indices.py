@@ -0,0 +1,127 @@
+import argparse
+import queue
+import threading
+import time
+
+from elasticsearch.helpers import BulkIndexError
+
+from documents import build_content_documents, build_sources
+from es_pipeline import (DEFAULT_BULK_SIZE, DEFAULT_CHUNK_SIZE, bulk_results, bump_generation, connect_es,
+                         create_index, iter_source_chunks, refresh_and_bump)
+from index_settings import INDEX_REGISTRY
+
+# Chunks buffered per index before the reader waits for that index's writer to catch up.
+DEFAULT_QUEUE_SIZE = 4
+
+class BulkWriter(threading.Thread):
+    """
+    Bulk indexes the document chunks put on its queue into one index, on its own thread.
+    Each queued item is a (ids, documents) pair; None marks the end of the stream.
+    """
+
+    def __init__(self, es, index_name, bulk_size=DEFAULT_BULK_SIZE, queue_size=DEFAULT_QUEUE_SIZE):
+        super().__init__(name=f"bulk-{index_name}", daemon=True)
+        self.es = es
+        self.index_name = index_name
+        self.bulk_size = bulk_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.indexed = 0
+        self.errors = []
+        self.elapsed = 0.0
+        self.exception = None
+        self._finished = False
+
+    def _actions(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self._finished = True
+                return
+            ids, documents = item
+            for i, doc in zip(ids, documents):
+                yield {"_index": self.index_name, "_id": i, "_source": doc}
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            for ok, item in bulk_results(self.es, self._actions(), self.bulk_size):
+                if ok:
+                    self.indexed += 1
+                else:
+                    self.errors.append(item)
+            refresh_and_bump(self.es, self.index_name)
+        except Exception as error:
+            self.exception = error
+            # Keep draining so the reader is never blocked on a full queue.
+            while not self._finished:
+                self._finished = self.queue.get() is None
+            # Some chunks may have been written; the TTL of cached searches covers an index that is not refreshed.
+            bump_generation(self.index_name)
+        self.elapsed = time.perf_counter() - start
+
+def build_indices(es, source_file, index_names=None, chunk_size=DEFAULT_CHUNK_SIZE, limit=None,
+                  bulk_size=DEFAULT_BULK_SIZE, queue_size=DEFAULT_QUEUE_SIZE):
+    """
+    Creates every index in index_names (all of INDEX_REGISTRY by default) and fills them in a single
+    pass over the source file. Each chunk is read and turned into documents once per document shape,
+    then handed to one BulkWriter thread per index, so the build takes about as long as the slowest index.
+    """
+    index_names = list(INDEX_REGISTRY if index_names is None else index_names)
+    for index_name in index_names:
+        create_index(es, index_name, INDEX_REGISTRY[index_name]["settings"])
+
+    writers = {index_name: BulkWriter(es, index_name, bulk_size, queue_size) for index_name in index_names}
+    for writer in writers.values():
+        writer.start()
+
+    start = time.perf_counter()
+    rows = 0
+    try:
+        for chunk_number, chunk in enumerate(iter_source_chunks(source_file, chunk_size, limit), start=1):
+            ids = chunk.index.tolist()
+            documents = {}
+            for index_name, writer in writers.items():
+                shape = INDEX_REGISTRY[index_name]["documents"]
+                if shape not in documents:
+                    documents[shape] = build_sources(chunk) if shape == "source" else build_content_documents(chunk)
+                writer.queue.put((ids, documents[shape]))
+            rows += len(chunk)
+            print(f"Chunk {chunk_number}: read {len(chunk)} rows ({rows} total).")
+    finally:
+        for writer in writers.values():
+            writer.queue.put(None)
+        for writer in writers.values():
+            writer.join()
+
+    errors = []
+    for index_name, writer in writers.items():
+        if writer.exception is not None:
+            raise writer.exception
+        errors.extend(writer.errors)
+        print(f"Indexed {writer.indexed} documents into index '{index_name}' "
+              f"in {writer.elapsed:.2f}s ({len(writer.errors)} failed).")
+    print(f"Built {len(writers)} indices from {rows} rows in {time.perf_counter() - start:.2f}s.")
+    if errors:
+        print(f"BulkIndexError: {len(errors)} document(s) failed to index.")
+        for error in errors:
+            print(error)
+        raise BulkIndexError(f"{len(errors)} document(s) failed to index.", errors)
+    return {index_name: writer.indexed for index_name, writer in writers.items()}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build every project index from one pass over the data.")
+    parser.add_argument("--source", default="sample_data.csv", help="CSV file or Excel workbook to index")
+    parser.add_argument("--indices", nargs="+", choices=list(INDEX_REGISTRY), default=None,
+                        help="indices to build (default: all of them)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--bulk-size", type=int, default=DEFAULT_BULK_SIZE)
+    parser.add_argument("--limit", type=int, default=1000, help="maximum rows to index (0 indexes every row)")
+    parser.add_argument("--embedded", action="store_true", help="build into the in-process search engine")
+    args = parser.parse_args(argv)
+
+    es = connect_es(embedded=args.embedded)
+    build_indices(es, args.source, args.indices, chunk_size=args.chunk_size, limit=args.limit or None,
+                  bulk_size=args.bulk_size)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+import hashlib
+import json
+import os
+import shutil
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+# A typed columnar cache of a source file (the survey workbook or a CSV export).
+# The source is parsed once, in chunks, and every column is stored as a .npy file: numbers and dates as they are,
+# text as int32 codes into a JSON string table. Loading reads only the requested columns, memory-mapped,
+# and text columns come back as pandas Categoricals. The cache is rebuilt when the source changes.
+
+DEFAULT_CACHE_DIR = ".data_cache"
+MANIFEST_FILE = "manifest.json"
+CACHE_FORMAT_VERSION = 1
+# Rows parsed per chunk when a cache is built; only one chunk of the source is in memory at a time.
+BUILD_CHUNK_SIZE = 5000
+
+def _file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_path(source_file, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Returns the directory holding the cache of a source file.
+    """
+    name = os.path.basename(source_file)
+    return os.path.join(cache_dir, f"{name}.{hashlib.sha1(os.path.abspath(source_file).encode()).hexdigest()[:8]}")
+
+def iter_workbook_chunks(excel_file, chunk_size):
+    """
+    Streams an Excel workbook in read-only mode and yields DataFrames of at most chunk_size rows.
+    The first row of the active sheet is used as the header.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        columns = list(next(rows, ()))
+        start = 0
+        batch = []
+        for values in rows:
+            batch.append(values)
+            if len(batch) == chunk_size:
+                yield pd.DataFrame(batch, columns=columns, index=pd.RangeIndex(start, start + len(batch)))
+                start += len(batch)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns, index=pd.RangeIndex(start, start + len(batch)))
+    finally:
+        workbook.close()
+
+def iter_source_frames(source_file, chunk_size=BUILD_CHUNK_SIZE):
+    """
+    Parses the source file in DataFrames of at most chunk_size rows: Excel workbooks streamed with
+    openpyxl, anything else as CSV.
+    """
+    if source_file.lower().endswith((".xlsx", ".xlsm")):
+        return iter_workbook_chunks(source_file, chunk_size)
+    return pd.read_csv(source_file, chunksize=chunk_size)
+
+def _chunk_kind(series):
+    """
+    Returns how a chunk of a column is stored ("string", "datetime" or "numeric"), or None if it is all missing.
+    """
+    if series.isna().all():
+        return None
+    if pd.api.types.is_bool_dtype(series) or not (pd.api.types.is_numeric_dtype(series)
+                                                   or pd.api.types.is_datetime64_any_dtype(series)):
+        return "string"
+    return "datetime" if pd.api.types.is_datetime64_any_dtype(series) else "numeric"
+
+class _ColumnWriter:
+    """
+    Appends the chunks of one column to a raw file that finish() turns into the column's .npy file.
+    The kind follows the chunks seen so far: integers become floats once a chunk has missing values,
+    and the column becomes a string column (converting what was written) as soon as a chunk holds text.
+    Missing rows before the first value are written once the kind is known; a column with no values
+    at all is stored as floats (NaN), as pandas reads it.
+    """
+
+    def __init__(self, directory, number, name):
+        self.directory = directory
+        self.entry = {"name": str(name), "file": f"{number}.npy"}
+        self.raw_file = os.path.join(directory, f"{number}.raw")
+        self.kind = None
+        self.dtype = None
+        self.rows = 0
+        self.missing = 0
+        self.string_codes = {}
+
+    def _raw_blocks(self):
+        if not self.rows:
+            return
+        values = np.memmap(self.raw_file, dtype=self.dtype, mode="r", shape=(self.rows,))
+        for start in range(0, self.rows, BUILD_CHUNK_SIZE):
+            yield values[start:start + BUILD_CHUNK_SIZE]
+
+    def _rewrite(self, convert, dtype):
+        """
+        Rewrites the raw file block by block through convert, as dtype.
+        """
+        tmp_file = f"{self.raw_file}.tmp"
+        with open(tmp_file, "wb") as f:
+            for block in self._raw_blocks():
+                np.asarray(convert(block)).astype(dtype).tofile(f)
+        os.replace(tmp_file, self.raw_file)
+        self.dtype = np.dtype(dtype)
+
+    def _codes(self, values):
+        """
+        Returns the int32 codes of values in the string table (-1 for missing values), extending the table.
+        Distinct values that format to the same string (e.g. 1 and "1") share a code.
+        """
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        table = np.array([self.string_codes.setdefault(str(value), len(self.string_codes)) for value in uniques]
+                         + [-1], dtype=np.int32)
+        return table[codes]
+
+    def _missing_values(self, count):
+        if self.kind == "string":
+            return np.full(count, None, dtype=object)
+        if self.kind == "datetime":
+            return np.full(count, np.datetime64("NaT"), dtype=self.dtype)
+        return np.full(count, np.nan)
+
+    def _write(self, values):
+        if self.kind == "string":
+            values = self._codes(values)
+            dtype = np.dtype(np.int32)
+        else:
+            dtype = values.dtype if self.dtype is None else np.result_type(self.dtype, values.dtype)
+            if self.rows and dtype != self.dtype:
+                self._rewrite(lambda block: block, dtype)
+        self.dtype = dtype
+        with open(self.raw_file, "ab") as f:
+            np.ascontiguousarray(values, dtype=dtype).tofile(f)
+        self.rows += len(values)
+
+    def append(self, series):
+        kind = _chunk_kind(series)
+        if kind is None:
+            if self.kind is None:
+                self.missing += len(series)
+            else:
+                self._write(self._missing_values(len(series)))
+            return
+        if self.kind is None:
+            self.kind = kind
+            if self.missing:
+                self._write(self._missing_values(self.missing))
+                self.missing = 0
+        elif kind != self.kind and self.kind != "string":
+            self.kind = "string"
+            self._rewrite(lambda block: self._codes(pd.Series(block).astype(object)), np.int32)
+        self._write(series.to_numpy(dtype=object) if self.kind == "string" else series.to_numpy())
+
+    def finish(self):
+        """
+        Writes the column's .npy file (and string table) and returns its manifest entry.
+        """
+        if self.kind is None:
+            self.kind = "numeric"
+            self._write(self._missing_values(self.missing))
+        values = np.lib.format.open_memmap(os.path.join(self.directory, self.entry["file"]), mode="w+",
+                                           dtype=self.dtype, shape=(self.rows,))
+        start = 0
+        for block in self._raw_blocks():
+            values[start:start + len(block)] = block
+            start += len(block)
+        values.flush()
+        del values
+        if os.path.exists(self.raw_file):
+            os.remove(self.raw_file)
+        if self.kind == "string":
+            self.entry.update(kind="string", strings=self.entry["file"].replace(".npy", ".strings.json"))
+            with open(os.path.join(self.directory, self.entry["strings"]), "w", encoding="utf-8") as f:
+                json.dump(list(self.string_codes), f, ensure_ascii=False)
+        else:
+            self.entry.update(kind=self.kind, dtype=str(self.dtype))
+        return self.entry
+
+def build_cache(source_file, cache_dir=DEFAULT_CACHE_DIR, chunk_size=BUILD_CHUNK_SIZE):
+    """
+    Parses the source file in chunks of chunk_size rows and writes its columnar cache chunk by chunk,
+    so memory use does not grow with the source. Returns the cache manifest.
+    The manifest is written last, so an interrupted build is never mistaken for a valid cache.
+    """
+    directory = cache_path(source_file, cache_dir)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+
+    stat = os.stat(source_file)
+    writers = []
+    rows = 0
+    with closing(iter_source_frames(source_file, chunk_size)) as chunks:
+        for chunk in chunks:
+            if not writers:
+                writers = [_ColumnWriter(directory, number, column) for number, column in enumerate(chunk.columns)]
+            for number, writer in enumerate(writers):
+                writer.append(chunk.iloc[:, number])
+            rows += len(chunk)
+    manifest = {
+        "version": CACHE_FORMAT_VERSION,
+        "source": os.path.abspath(source_file),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha1": _file_sha1(source_file),
+        "rows": rows,
+        "columns": [writer.finish() for writer in writers],
+    }
+    _write_manifest(directory, manifest)
+    print(f"Cached {rows} rows x {len(writers)} columns of {source_file} in {directory}")
+    return manifest
+
+def _write_manifest(directory, manifest):
+    tmp_file = os.path.join(directory, f"{MANIFEST_FILE}.tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_file, os.path.join(directory, MANIFEST_FILE))
+
+def current_manifest(source_file, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Returns the manifest of the source's cache if it is up to date, else None.
+    A cache is current when the source size and modification time match; if only the time differs,
+    the content hash decides, so touching or copying the file does not force a rebuild.
+    """
+    directory = cache_path(source_file, cache_dir)
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    stat = os.stat(source_file)
+    if manifest.get("version") != CACHE_FORMAT_VERSION or manifest["size"] != stat.st_size:
+        return None
+    if manifest["mtime_ns"] != stat.st_mtime_ns:
+        if manifest["sha1"] != _file_sha1(source_file):
+            return None
+        manifest["mtime_ns"] = stat.st_mtime_ns
+        _write_manifest(directory, manifest)
+    return manifest
+
+def ensure_cache(source_file, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Returns the manifest of an up-to-date cache, building it if needed.
+    """
+    return current_manifest(source_file, cache_dir) or build_cache(source_file, cache_dir)
+
+def load_frame(source_file, columns=None, mmap=True, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Returns the source data as a DataFrame read from its cache (built on first use).
+    Only the listed columns are loaded (all by default). With mmap=True the column files are
+    memory-mapped, so pages are read on demand and shared between processes.
+    """
+    manifest = ensure_cache(source_file, cache_dir)
+    directory = cache_path(source_file, cache_dir)
+    entries = {entry["name"]: entry for entry in manifest["columns"]}
+    if columns is None:
+        columns = [entry["name"] for entry in manifest["columns"]]
+    missing = [column for column in columns if column not in entries]
+    if missing:
+        raise ValueError(f"Columns not found in {source_file}: {missing}")
+
+    data = {}
+    for column in columns:
+        entry = entries[column]
+        values = np.load(os.path.join(directory, entry["file"]), mmap_mode="r" if mmap else None)
+        if entry["kind"] == "string":
+            with open(os.path.join(directory, entry["strings"]), encoding="utf-8") as f:
+                strings = json.load(f)
+            data[column] = pd.Categorical.from_codes(values, categories=strings)
+        else:
+            data[column] = values
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+def iter_cached_chunks(source_file, chunk_size, limit=None, columns=None, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Yields the cached source data in DataFrames of at most chunk_size rows (and at most limit rows in total).
+    The columns are memory-mapped, so only the rows of the current chunk need to be in memory.
+    Building a missing or stale cache parses the whole source, so a read with a limit streams the
+    source instead (see iter_source_frames) and leaves the cache to the next full read.
+    """
+    if limit is not None and current_manifest(source_file, cache_dir) is None:
+        rows = 0
+        with closing(iter_source_frames(source_file, chunk_size)) as chunks:
+            for chunk in chunks:
+                if rows >= limit:
+                    break
+                chunk = chunk.head(limit - rows)
+                rows += len(chunk)
+                yield chunk if columns is None else chunk[columns]
+        return
+    df = load_frame(source_file, columns, mmap=True, cache_dir=cache_dir)
+    rows = len(df) if limit is None else min(limit, len(df))
+    for start in range(0, rows, chunk_size):
+        yield df.iloc[start:min(start + chunk_size, rows)]
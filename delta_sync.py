@@ -0,0 +1,162 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from elasticsearch.helpers import BulkIndexError
+
+from documents import build_content_documents, build_ids, build_sources
+from es_pipeline import (DEFAULT_BULK_SIZE, DEFAULT_CHUNK_SIZE, bulk_results, connect_es,
+                         create_index, iter_source_chunks, refresh_and_bump)
+from index_settings import INDEX_REGISTRY
+
+# Incremental sync: each document's _id comes from the survey "case" column and a manifest file
+# keeps a hash of every row that was sent, so a new export only sends the rows that were added,
+# changed or removed since the last sync.
+
+DEFAULT_ID_COLUMNS = ["case"]
+
+def _canonical_strings(values):
+    """
+    Formats the distinct values of a column so the result does not depend on how pandas typed the column.
+    Numbers are written with 12 significant digits, because a chunk with a missing value turns an integer
+    column into floats and CSV round-trips can change the last digits of a float.
+    """
+    if len(values) and all(isinstance(value, (int, float, np.number)) and not isinstance(value, bool)
+                           for value in values):
+        return [f"{float(value):.12g}" for value in values]
+    return [str(value) for value in values]
+
+def row_hashes(df):
+    """
+    Returns a 64-bit content hash of every row.
+    Each distinct value of a column is formatted and hashed once, and the per-column hashes are
+    combined with vectorized integer arithmetic, so the cost is a few NumPy passes per column.
+    """
+    combined = np.zeros(len(df), dtype=np.uint64)
+    for column in df.columns:
+        codes, uniques = pd.factorize(df[column])
+        # Missing values get code -1, which picks the trailing "" entry.
+        table = np.array(_canonical_strings(list(uniques)) + [""], dtype=object)
+        combined = combined * np.uint64(1000003) ^ pd.util.hash_array(table)[codes]
+    return combined
+
+def load_manifest(manifest_file):
+    """
+    Returns the manifest as a Series of row hashes indexed by document id (empty if the file does not exist).
+    """
+    if not os.path.exists(manifest_file):
+        return pd.Series([], index=pd.Index([], dtype=object), dtype="uint64")
+    manifest = pd.read_csv(manifest_file, dtype={"id": str, "hash": "uint64"}, keep_default_na=False)
+    return pd.Series(manifest["hash"].to_numpy(), index=pd.Index(manifest["id"], dtype=object))
+
+def save_manifest(manifest_file, manifest):
+    tmp_file = f"{manifest_file}.tmp"
+    pd.DataFrame({"id": manifest.index, "hash": manifest.to_numpy()}).to_csv(tmp_file, index=False)
+    os.replace(tmp_file, manifest_file)
+
+def sync_documents(es, index_name, source_file, manifest_file, id_columns=DEFAULT_ID_COLUMNS,
+                   document_shape="content", chunk_size=DEFAULT_CHUNK_SIZE, bulk_size=DEFAULT_BULK_SIZE,
+                   limit=None):
+    """
+    Brings an index in line with the source file by sending only the differences since the last sync.
+    Rows whose id is not in the manifest are indexed, rows whose hash changed are re-indexed, and ids in
+    the manifest that no longer appear in the source are deleted. document_shape is "content" (the single
+    content field of es_pipeline) or "source" (whole rows, as in index_data.py). The manifest is rewritten
+    at the end; rows that failed to sync keep their previous manifest state so the next run retries them.
+    Returns a dict with the number of inserted, updated, deleted and unchanged rows.
+    """
+    previous = load_manifest(manifest_file)
+    previous_hashes = previous.to_numpy()
+    counts = {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+    ids_seen = []
+    hashes_seen = []
+    failed_ids = set()
+
+    def changed_actions():
+        seen = set()
+        for chunk in iter_source_chunks(source_file, chunk_size, limit):
+            ids = build_ids(chunk, id_columns)
+            seen.update(ids)
+            if len(seen) != len(ids_seen) + len(ids):
+                raise ValueError(f"Duplicate ids in {source_file} for id columns {id_columns}; "
+                                 f"pass more id columns (e.g. --id-columns Year case)")
+            hashes = row_hashes(chunk)
+            ids_seen.extend(ids)
+            hashes_seen.append(hashes)
+
+            positions = previous.index.get_indexer(ids)
+            known = positions >= 0
+            changed = ~known
+            changed[known] = previous_hashes[positions[known]] != hashes[known]
+            counts["inserted"] += int((~known).sum())
+            counts["updated"] += int((changed & known).sum())
+            counts["unchanged"] += int((~changed).sum())
+            if not changed.any():
+                continue
+
+            rows = chunk[changed]
+            documents = build_sources(rows) if document_shape == "source" else build_content_documents(rows)
+            for doc_id, doc in zip(np.asarray(ids, dtype=object)[changed].tolist(), documents):
+                yield {"_index": index_name, "_id": doc_id, "_source": doc}
+
+        for doc_id in previous.index.difference(pd.Index(ids_seen, dtype=object)):
+            counts["deleted"] += 1
+            yield {"_op_type": "delete", "_index": index_name, "_id": doc_id}
+
+    errors = []
+    for ok, item in bulk_results(es, changed_actions(), bulk_size):
+        if not ok:
+            (op_type, details), = item.items()
+            # Deleting a document that is already gone is not a failure.
+            if op_type == "delete" and details.get("status") == 404:
+                continue
+            errors.append(item)
+            failed_ids.add(str(details.get("_id")))
+
+    # Build the new manifest; failed rows keep their previous state so they are retried next time.
+    manifest = pd.Series(np.concatenate(hashes_seen) if hashes_seen else np.array([], dtype="uint64"),
+                         index=pd.Index(ids_seen, dtype=object))
+    if failed_ids:
+        failed = pd.Index(sorted(failed_ids), dtype=object)
+        manifest = manifest.drop(failed.intersection(manifest.index))
+        retained = previous[previous.index.isin(failed)]
+        manifest = pd.concat([manifest, retained])
+    save_manifest(manifest_file, manifest)
+    # A sync that sent nothing leaves the index, and the searches cached for it, as they are.
+    if counts["inserted"] or counts["updated"] or counts["deleted"]:
+        refresh_and_bump(es, index_name)
+
+    print(f"Synced index '{index_name}': {counts['inserted']} inserted, {counts['updated']} updated, "
+          f"{counts['deleted']} deleted, {counts['unchanged']} unchanged.")
+    if errors:
+        print(f"BulkIndexError: {len(errors)} document(s) failed to sync.")
+        for error in errors:
+            print(error)
+        raise BulkIndexError(f"{len(errors)} document(s) failed to sync.", errors)
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send only new, changed and deleted survey rows to an index.")
+    parser.add_argument("--index", default="articles_pipeline", choices=list(INDEX_REGISTRY))
+    parser.add_argument("--source", default="sample_data.csv", help="CSV file or Excel workbook to sync")
+    parser.add_argument("--manifest", default=None, help="manifest file (default: <index>.manifest.csv)")
+    parser.add_argument("--id-columns", nargs="+", default=DEFAULT_ID_COLUMNS,
+                        help="columns that identify a survey row (default: case)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--bulk-size", type=int, default=DEFAULT_BULK_SIZE)
+    parser.add_argument("--embedded", action="store_true", help="sync into the in-process search engine")
+    args = parser.parse_args(argv)
+
+    manifest_file = args.manifest or f"{args.index}.manifest.csv"
+    es = connect_es(embedded=args.embedded)
+    if not os.path.exists(manifest_file) or not es.indices.exists(index=args.index):
+        # No previous sync to compare with: start from an empty index and send every row.
+        if os.path.exists(manifest_file):
+            os.remove(manifest_file)
+        create_index(es, args.index, INDEX_REGISTRY[args.index]["settings"])
+    sync_documents(es, args.index, args.source, manifest_file, args.id_columns,
+                   INDEX_REGISTRY[args.index]["documents"], args.chunk_size, args.bulk_size)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+import argparse
+import sys
+import time
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+from documents import build_sources
+
+# A compact, columnar store for document sources (the survey rows), used by LocalIndex.
+# Every field is a column: repeated values (the categoricals, and most amounts) are dictionary-encoded
+# with the narrowest code type that fits, fields where most values are distinct become NumPy arrays
+# (numbers) or plain lists (text). Rows are returned as lightweight read-only views that look values
+# up on access; a dict is only built when a caller asks for one (dict(row) or row.to_dict()).
+
+INITIAL_CAPACITY = 1024
+# A dictionary-encoded column is re-examined each time its dictionary doubles past this size; if more
+# than half of its values are then distinct, it switches to a NumPy array or a plain list.
+DICTIONARY_CHECK_SIZE = 1024
+CODE_TYPES = (np.uint8, np.uint16, np.uint32)
+
+def _grow(values, size):
+    """
+    Returns values with room for at least size entries, doubling the capacity when needed (new entries are 0).
+    """
+    if size <= len(values):
+        return values
+    grown = np.zeros(max(size, 2 * len(values)), dtype=values.dtype)
+    grown[:len(values)] = values
+    return grown
+
+def _dictionary_key(value):
+    # 1, 1.0 and True are equal dict keys in Python; keep them apart, and give every NaN the same key.
+    if type(value) is str:
+        return value
+    if isinstance(value, float) and value != value:
+        return (float, "nan")
+    return (type(value), value)
+
+class _DictionaryColumn:
+    """
+    Values stored once in a dictionary, with one integer code per row.
+    Code 0 is None, which is also what rows without the field hold.
+    """
+
+    __slots__ = ("values", "index", "codes")
+
+    def __init__(self):
+        self.values = [None]
+        self.index = {_dictionary_key(None): 0}
+        self.codes = np.zeros(INITIAL_CAPACITY, dtype=np.uint8)
+
+    def code(self, value):
+        """
+        Returns the code of a value, adding it to the dictionary if needed (None if it is unhashable).
+        """
+        try:
+            key = _dictionary_key(value)
+            code = self.index.get(key)
+        except TypeError:
+            return None
+        if code is None:
+            code = self.index[key] = len(self.values)
+            self.values.append(value)
+            if len(self.values) > np.iinfo(self.codes.dtype).max:
+                self.codes = self.codes.astype(CODE_TYPES[CODE_TYPES.index(self.codes.dtype.type) + 1])
+        return code
+
+    def set(self, doc, value):
+        code = self.code(value)
+        if code is None:
+            return False
+        self.codes = _grow(self.codes, doc + 1)
+        self.codes[doc] = code
+        return True
+
+    def get(self, doc):
+        return self.values[self.codes[doc]]
+
+    def nbytes(self):
+        return self.codes.nbytes + sys.getsizeof(self.values) + sys.getsizeof(self.index) + sum(
+            sys.getsizeof(value) for value in self.values)
+
+class _NumericColumn:
+    """
+    Floats (None stored as NaN) or ints in a NumPy array.
+    """
+
+    __slots__ = ("array",)
+
+    def __init__(self, array):
+        self.array = array
+
+    def set(self, doc, value):
+        if self.array.dtype.kind == "f":
+            if value is not None and type(value) is not float:
+                return False
+            value = np.nan if value is None else value
+        elif type(value) is not int or not -2 ** 63 <= value < 2 ** 63:
+            return False
+        self.array = _grow(self.array, doc + 1)
+        self.array[doc] = value
+        return True
+
+    def get(self, doc):
+        value = self.array[doc].item()
+        return None if value != value else value
+
+    def nbytes(self):
+        return self.array.nbytes
+
+class _PlainColumn:
+    """
+    One Python value per row, for mostly distinct text and values of mixed or unhashable types.
+    """
+
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        self.values = values
+
+    def set(self, doc, value):
+        self.values.extend([None] * (doc + 1 - len(self.values)))
+        self.values[doc] = value
+        return True
+
+    def get(self, doc):
+        return self.values[doc]
+
+    def nbytes(self):
+        return sys.getsizeof(self.values) + sum(sys.getsizeof(value) for value in self.values)
+
+def _column_from_values(values):
+    """
+    Picks the representation of a column from its values (a list with one value per row).
+    """
+    kinds = {type(value) for value in values if value is not None}
+    if kinds == {float}:
+        return _NumericColumn(np.array([np.nan if value is None else value for value in values], dtype=np.float64))
+    if kinds == {int} and None not in values and all(-2 ** 63 <= value < 2 ** 63 for value in values):
+        return _NumericColumn(np.array(values, dtype=np.int64))
+    return _PlainColumn(list(values))
+
+class Row(Mapping):
+    """
+    A read-only view of one stored document. It behaves like the source dict (keys in the original order,
+    None for missing values) without building one; dict(row) or row.to_dict() makes a copy.
+    """
+
+    __slots__ = ("store", "doc")
+
+    def __init__(self, store, doc):
+        self.store = store
+        self.doc = doc
+
+    def _fields(self):
+        return self.store.schemas[self.store.schema_ids[self.doc]]
+
+    def __getitem__(self, field):
+        if field not in self.store.schema_sets[self.store.schema_ids[self.doc]]:
+            raise KeyError(field)
+        return self.store.columns[field].get(self.doc)
+
+    def __contains__(self, field):
+        return field in self.store.schema_sets[self.store.schema_ids[self.doc]]
+
+    def __iter__(self):
+        return iter(self._fields())
+
+    def __len__(self):
+        return len(self._fields())
+
+    def to_dict(self):
+        columns = self.store.columns
+        return {field: columns[field].get(self.doc) for field in self._fields()}
+
+    def __repr__(self):
+        return f"Row({self.to_dict()!r})"
+
+class DocumentStore:
+    """
+    Stores document sources column by column and returns them as Row views, by document ordinal.
+    Each row remembers its set of fields (its schema) so rows with different fields, or fields in a
+    different order, round-trip exactly. Float fields read NaN back as None, as documents.build_sources does.
+    """
+
+    DELETED = -1
+
+    def __init__(self):
+        self.columns = {}
+        self.schemas = []
+        self.schema_sets = []
+        self._schema_index = {}
+        self.schema_ids = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, doc):
+        if not 0 <= doc < self.size:
+            raise IndexError(doc)
+        return None if self.schema_ids[doc] == self.DELETED else Row(self, doc)
+
+    def __iter__(self):
+        return (self[doc] for doc in range(self.size))
+
+    def _schema(self, fields):
+        schema_id = self._schema_index.get(fields)
+        if schema_id is None:
+            schema_id = self._schema_index[fields] = len(self.schemas)
+            self.schemas.append(fields)
+            self.schema_sets.append(frozenset(fields))
+        return schema_id
+
+    def _set(self, field, doc, value):
+        column = self.columns.get(field)
+        if column is None:
+            column = self.columns[field] = _DictionaryColumn()
+        if not column.set(doc, value):
+            # The value does not fit the column's representation: fall back to a plain list.
+            column = self.columns[field] = _PlainColumn([column.get(i) for i in range(doc)])
+            column.set(doc, value)
+        elif isinstance(column, _DictionaryColumn) and len(column.values) & (len(column.values) - 1) == 0:
+            self._check_dictionary(field, doc + 1)
+
+    def _check_dictionary(self, field, rows):
+        """
+        Switches a dictionary-encoded column whose values are mostly distinct to an array or a list.
+        """
+        column = self.columns[field]
+        if len(column.values) >= DICTIONARY_CHECK_SIZE and len(column.values) > rows / 2:
+            self.columns[field] = _column_from_values([column.get(i) for i in range(rows)])
+
+    def append(self, source):
+        """
+        Adds a document (a dict of field values) and returns its ordinal.
+        """
+        doc = self.size
+        self.schema_ids = _grow(self.schema_ids, doc + 1)
+        self.schema_ids[doc] = self._schema(tuple(source))
+        for field, value in source.items():
+            self._set(field, doc, value)
+        self.size += 1
+        return doc
+
+    def append_frame(self, df):
+        """
+        Adds every row of a DataFrame, as documents.build_sources would build them, column by column:
+        new fields are encoded with pd.factorize, so only the distinct values are touched one by one.
+        Returns the range of the new ordinals.
+        """
+        start = self.size
+        fields = tuple(str(column) for column in df.columns)
+        self.schema_ids = _grow(self.schema_ids, start + len(df))
+        self.schema_ids[start:start + len(df)] = self._schema(fields)
+        end = start + len(df)
+        for field, column in zip(fields, df.columns):
+            codes, uniques = pd.factorize(df[column])
+            # Python values, as build_sources produces them (missing values get code -1, i.e. None).
+            values = pd.Series(uniques, dtype=object).tolist() + [None]
+            existing = self.columns.get(field)
+            if existing is None and len(values) > DICTIONARY_CHECK_SIZE and len(values) > len(df) / 2:
+                self.columns[field] = _column_from_values([None] * start + [values[code] for code in codes.tolist()])
+                continue
+            if existing is None:
+                existing = self.columns[field] = _DictionaryColumn()
+            if isinstance(existing, _DictionaryColumn):
+                table = [existing.code(value) for value in values]
+                if None not in table:
+                    existing.codes = _grow(existing.codes, end)
+                    existing.codes[start:end] = np.array(table)[codes]
+                    self._check_dictionary(field, end)
+                    continue
+            for i, code in enumerate(codes.tolist()):
+                self._set(field, start + i, values[code])
+        self.size += len(df)
+        return range(start, self.size)
+
+    def delete(self, doc):
+        self.schema_ids[doc] = self.DELETED
+
+    def memory_usage(self):
+        """
+        Returns an estimate of the bytes held by the store, per field and in total.
+        """
+        usage = {field: column.nbytes() for field, column in self.columns.items()}
+        usage["(row schemas)"] = self.schema_ids.nbytes
+        usage["total"] = sum(usage.values())
+        return usage
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the memory used by dict sources and the document store.")
+    parser.add_argument("--source", default="sample_data.csv", help="CSV file of survey rows")
+    parser.add_argument("--rows", type=int, default=0, help="rows to load (0 loads every row)")
+    args = parser.parse_args(argv)
+
+    df = pd.read_csv(args.source, nrows=args.rows or None)
+    start = time.perf_counter()
+    sources = build_sources(df)
+    dict_seconds = time.perf_counter() - start
+    # Dict sources: the dicts, plus every value object that is not shared between rows.
+    seen = set()
+    dict_bytes = 0
+    for source in sources:
+        dict_bytes += sys.getsizeof(source)
+        for value in source.values():
+            if id(value) not in seen:
+                seen.add(id(value))
+                dict_bytes += sys.getsizeof(value)
+
+    start = time.perf_counter()
+    store = DocumentStore()
+    store.append_frame(df)
+    store_seconds = time.perf_counter() - start
+    if any(store[doc] != sources[doc] for doc in range(len(df))):
+        raise ValueError("The document store does not reproduce build_sources")
+    usage = store.memory_usage()
+    print(f"{len(df)} rows x {len(df.columns)} fields")
+    print(f"dict sources:   {dict_bytes / 1e6:8.1f} MB, built in {dict_seconds:.2f}s")
+    print(f"document store: {usage['total'] / 1e6:8.1f} MB, built in {store_seconds:.2f}s")
+    largest = sorted(((size, field) for field, size in usage.items() if field != "total"), reverse=True)[:5]
+    print("largest fields: " + ", ".join(f"{field} {size / 1e6:.1f} MB" for size, field in largest))
+
+if __name__ == "__main__":
+    main()
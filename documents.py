@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+def select_content_columns(df, content_columns=None):
+    """
+    Returns the columns whose values are combined into the "content" field.
+    content_columns may be None (every column), a list of column names, or a
+    callable that receives the DataFrame and returns a list of column names.
+    """
+    if content_columns is None:
+        return list(df.columns)
+    if callable(content_columns):
+        content_columns = content_columns(df)
+    missing = [column for column in content_columns if column not in df.columns]
+    if missing:
+        raise ValueError(f"Content columns not found in the data: {missing}")
+    return list(content_columns)
+
+def _column_values(series):
+    """
+    Returns a column as an object array of Python values with None for missing entries,
+    together with the boolean mask of present entries.
+    """
+    present = series.notna().to_numpy()
+    values = series.to_numpy(dtype=object, copy=True)
+    values[~present] = None
+    return values, present
+
+def _column_strings(series):
+    """
+    Returns a column as an object array of strings, with "" for missing values.
+    Each distinct value is converted with str() only once and the result is spread back
+    over the rows by its factorized code, so repeated categoricals and amounts are cheap.
+    """
+    codes, uniques = pd.factorize(series)
+    table = np.array([str(value) for value in uniques] + [""], dtype=object)
+    # Missing values get code -1, which picks the trailing "" entry.
+    return table[codes]
+
+def _id_strings(series):
+    """
+    Returns an id column as an object array of strings. Whole-number floats are written as integers,
+    so a case number reads the same whether or not pandas stored its column as floats (as it does
+    when another row of the file has no case number). Missing ids raise a ValueError.
+    """
+    missing = series.isna().to_numpy()
+    if missing.any():
+        rows = series.index[missing][:5].tolist()
+        raise ValueError(f"Id column {series.name!r} has {int(missing.sum())} missing value(s), e.g. in rows {rows}")
+    if pd.api.types.is_float_dtype(series) and (series % 1 == 0).all():
+        series = series.astype("Int64")
+    return _column_strings(series)
+
+def build_content(df, content_columns=None):
+    """
+    Builds the "content" string of every row in the DataFrame.
+    If the data already has a "content" column it is used as is. Otherwise the selected
+    columns are converted to strings one column at a time and joined with spaces,
+    skipping missing and empty values, so no pandas row objects are created.
+    """
+    if "content" in df.columns:
+        return _column_values(df["content"])[0]
+
+    columns = [_column_strings(df[column]) for column in select_content_columns(df, content_columns)]
+    if not columns:
+        return np.full(len(df), "", dtype=object)
+    return np.array([" ".join(filter(None, parts)) for parts in zip(*columns)], dtype=object)
+
+def build_sources(df, columns=None):
+    """
+    Builds the "_source" dictionary of every row in the DataFrame, with None for missing values.
+    The values are converted column by column and then zipped into one dictionary per row.
+    """
+    columns = list(df.columns) if columns is None else list(columns)
+    column_values = [_column_values(df[column])[0].tolist() for column in columns]
+    return [dict(zip(columns, values)) for values in zip(*column_values)]
+
+def build_content_documents(df, content_columns=None):
+    """
+    Builds one {"content": ...} document per row, the shape used by the analyzer indices.
+    """
+    return [{"content": value} for value in build_content(df, content_columns).tolist()]
+
+def build_ids(df, id_columns=None):
+    """
+    Returns the document ids of the rows: the row labels when id_columns is None, otherwise the values
+    of the id columns (e.g. ["case"], or ["Year", "case"] when case numbers restart every year) joined with "-".
+    A row with a missing id value raises a ValueError.
+    """
+    if id_columns is None:
+        return df.index.tolist()
+    parts = [_id_strings(df[column]) for column in id_columns]
+    if len(parts) == 1:
+        return parts[0].tolist()
+    return ["-".join(values) for values in zip(*parts)]
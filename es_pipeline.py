@@ -1,86 +1,318 @@
+import argparse
+import copy
+import hashlib
+import itertools
+import json
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import closing
+
 import pandas as pd
 from elasticsearch import Elasticsearch, helpers
 from elasticsearch.helpers import BulkIndexError
 
-def connect_es():
+from data_cache import iter_cached_chunks
+from documents import build_content_documents, build_ids
+from index_settings import PIPELINE_SETTINGS
+from instrumentation import TimedIterator, metrics
+from local_engine import LocalSearchEngine
+
+# Elasticsearch server connect_es connects to unless a host is given; the ES_HOST environment
+# variable overrides it (e.g. http://127.0.0.1:9200 for the es_standin.py server).
+DEFAULT_ES_HOST = "https://localhost:9200"
+
+# Rows read from the source file per chunk, and documents sent per bulk request.
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_BULK_SIZE = 500
+
+# Hits fetched per search_after page when streaming results, and how long the point in time
+# is kept open between two pages.
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_KEEP_ALIVE = "2m"
+
+# Query run against a freshly built index before it goes live, to warm its caches.
+WARM_QUERY = {"query": {"match": {"content": "Singapore"}}}
+
+# Version of the analysis settings each index was last created with by create_index.
+# Cached analysis results (see analyze_client.py) are keyed by it.
+_settings_versions = {}
+
+# Generation of every index, bumped whenever this process recreates it or writes documents to it.
+# Cached search results (see search_cache.py) are keyed by it.
+_index_generations = {}
+
+@metrics.timed("connect_es")
+def connect_es(embedded=False, host=None):
     """
-    Connects to Elasticsearch running on HTTPS and returns the client.
+    Connects to Elasticsearch and returns the client. The server is host, else the ES_HOST
+    environment variable, else DEFAULT_ES_HOST.
+    With embedded=True an in-process LocalSearchEngine is returned instead, so the
+    pipeline can run without an Elasticsearch server.
     """
+    if embedded:
+        print("Using the embedded search engine.")
+        return LocalSearchEngine()
+    host = host or os.environ.get("ES_HOST") or DEFAULT_ES_HOST
     es = Elasticsearch(
-        "https://localhost:9200",
+        host,
         basic_auth=("elastic", "password"),
         verify_certs=False
     )
     if not es.ping():
-        raise ValueError("Connection failed: Ensure Elasticsearch is running on https://localhost:9200")
-    print("Connected to Elasticsearch.")
+        raise ValueError(f"Connection failed: Ensure Elasticsearch is running on {host}")
+    print(f"Connected to Elasticsearch on {host}.")
     return es
 
+def settings_version(index_name):
+    """
+    Returns a hash of the settings the index was created with by create_index,
+    or None if this process has not created it.
+    """
+    return _settings_versions.get(index_name)
+
+def index_generation(index_name):
+    """
+    Returns the generation counter of an index (0 if this process has not changed it).
+    """
+    return _index_generations.get(index_name, 0)
+
+def bump_generation(index_name):
+    """
+    Marks an index as changed, so results cached for earlier generations are no longer used.
+    """
+    _index_generations[index_name] = index_generation(index_name) + 1
+
+def refresh_and_bump(es, index_name):
+    """
+    Refreshes an index after writes, then bumps its generation. Searches only see the writes once
+    the index is refreshed, so a search cached under the new generation never misses them.
+    """
+    es.indices.refresh(index=index_name)
+    bump_generation(index_name)
+
+@metrics.timed("create_index")
 def create_index(es, index_name, settings):
     """
     Creates an index with the given settings. If the index exists, it is deleted first.
+    The settings version of the index is updated, so cached analysis results for
+    different settings are no longer used.
     """
+    if es.indices.exists_alias(name=index_name):
+        raise ValueError(f"{index_name} is an alias; rebuild it with reindex_with_alias instead")
     if es.indices.exists(index=index_name):
         es.indices.delete(index=index_name)
         print(f"Deleted existing index: {index_name}")
     es.indices.create(index=index_name, body=settings)
+    _settings_versions[index_name] = hashlib.sha1(
+        json.dumps(settings.get("settings", {}), sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    bump_generation(index_name)
     print(f"Created index: {index_name}")
 
-def index_documents(es, index_name, csv_file):
-    """
-    Reads a CSV file, selects the first 1000 documents, and bulk indexes them into the specified index.
-    To avoid mapping conflicts, this function extracts (or creates) a single "content" field.
-    """
-    df = pd.read_csv(csv_file)
-    df = df.head(1000)
-    # Replace NaN with None so that JSON serialization works correctly.
-    df = df.where(pd.notnull(df), None)
-    actions = []
-    for i, row in df.iterrows():
-        # If the CSV already has a "content" column, use it.
-        # Otherwise, combine all column values into one string.
-        if "content" in row:
-            content_value = row["content"]
-        else:
-            content_value = " ".join(str(val) for val in row.values if val is not None)
-        doc = {"content": content_value}
-        action = {
+def iter_source_chunks(source_file, chunk_size=DEFAULT_CHUNK_SIZE, limit=None):
+    """
+    Reads a CSV file or an Excel workbook in chunks of at most chunk_size rows.
+    Only one chunk is held in memory at a time. Reading stops after limit rows
+    (None reads the whole file). Row labels keep counting across chunks.
+    Workbooks are read from their memory-mapped columnar cache (see data_cache.py), which is
+    built, chunk by chunk, on the first full read and rebuilt when the workbook changes; until
+    then a read with a limit streams the sheet with openpyxl and stops after limit rows.
+    """
+    if source_file.lower().endswith((".xlsx", ".xlsm")):
+        chunks = iter_cached_chunks(source_file, chunk_size, limit)
+    else:
+        chunks = pd.read_csv(source_file, chunksize=chunk_size, nrows=limit)
+    remaining = limit
+    with closing(chunks):
+        for chunk in chunks:
+            if remaining is not None:
+                if remaining <= 0:
+                    break
+                chunk = chunk.head(remaining)
+                remaining -= len(chunk)
+            yield chunk
+
+def generate_actions(index_name, df, content_columns=None, id_columns=None):
+    """
+    Yields one bulk action per row of a DataFrame chunk.
+    To avoid mapping conflicts, each document has a single "content" field, built
+    column-wise by documents.build_content_documents from content_columns
+    (every column by default, or the existing "content" column if there is one).
+    Document ids are the row numbers, or the values of id_columns (see documents.build_ids).
+    """
+    documents = build_content_documents(df, content_columns)
+    for i, doc in zip(build_ids(df, id_columns), documents):
+        yield {
             "_index": index_name,
             "_id": i,
             "_source": doc
         }
-        actions.append(action)
-    
-    try:
-        helpers.bulk(es, actions)
-        print(f"Indexed {len(actions)} documents into index '{index_name}'.")
-    except BulkIndexError as bulk_error:
-        error_details = bulk_error.errors
-        print(f"BulkIndexError: {len(error_details)} document(s) failed to index.")
-        for error in error_details:
+
+def _local_bulk_results(es, actions, bulk_size):
+    """
+    Applies actions to the embedded engine in batches of bulk_size, each recorded like a bulk request
+    (with no payload bytes, as nothing is serialized).
+    """
+    actions = iter(actions)
+    while True:
+        batch = list(itertools.islice(actions, bulk_size))
+        if not batch:
+            return
+        start = time.perf_counter()
+        results = list(es.streaming_bulk(batch))
+        metrics.record_bulk(batch[0].get("_index"), len(batch), 0, time.perf_counter() - start,
+                            sum(1 for ok, _ in results if not ok))
+        yield from results
+
+def bulk_results(es, actions, bulk_size=DEFAULT_BULK_SIZE, thread_count=1):
+    """
+    Sends bulk actions and yields an (ok, item) pair per action without raising on failures.
+    Uses helpers.streaming_bulk, helpers.parallel_bulk when thread_count is greater than 1,
+    or the embedded engine's own streaming_bulk. The latency and bytes of every bulk request are
+    recorded in metrics (see PipelineMetrics.watch_bulk_requests).
+    """
+    if isinstance(es, LocalSearchEngine):
+        return _local_bulk_results(es, actions, bulk_size)
+    metrics.watch_bulk_requests(es)
+    if thread_count > 1:
+        return helpers.parallel_bulk(es, actions, thread_count=thread_count,
+                                     chunk_size=bulk_size, raise_on_error=False)
+    return helpers.streaming_bulk(es, actions, chunk_size=bulk_size, raise_on_error=False)
+
+@metrics.timed("index_documents")
+def index_documents(es, index_name, source_file, chunk_size=DEFAULT_CHUNK_SIZE, limit=None,
+                    bulk_size=DEFAULT_BULK_SIZE, thread_count=1, content_columns=None, id_columns=None):
+    """
+    Streams a CSV file (or Excel workbook) in chunks and bulk indexes the rows into the specified index.
+    Each chunk is turned into bulk actions by a generator and sent with helpers.streaming_bulk,
+    or helpers.parallel_bulk when thread_count is greater than 1, so memory use does not grow
+    with the size of the file. Progress and failures are reported per chunk. At the end the index is
+    refreshed (see refresh_and_bump), and a BulkIndexError listing every failed document is raised
+    if anything failed.
+    content_columns selects the columns combined into "content" (see documents.select_content_columns)
+    and id_columns the columns used as document ids instead of the row number (e.g. ["case"]).
+    """
+    indexed = 0
+    errors = []
+    chunks = iter_source_chunks(source_file, chunk_size, limit)
+    read_start = time.perf_counter()
+    for chunk_number, chunk in enumerate(chunks, start=1):
+        bulk_start = time.perf_counter()
+        # Actions are built as the bulk helper pulls them; the time spent building them is kept apart.
+        actions = TimedIterator(generate_actions(index_name, chunk, content_columns, id_columns))
+        chunk_indexed = 0
+        chunk_errors = []
+        for ok, item in bulk_results(es, actions, bulk_size, thread_count):
+            if ok:
+                chunk_indexed += 1
+            else:
+                chunk_errors.append(item)
+        metrics.record_chunk(index_name, len(chunk), bulk_start - read_start, actions.seconds,
+                             time.perf_counter() - bulk_start - actions.seconds, len(chunk_errors))
+        indexed += chunk_indexed
+        errors.extend(chunk_errors)
+        print(f"Chunk {chunk_number}: indexed {chunk_indexed}/{len(chunk)} documents "
+              f"({indexed} total, {len(chunk_errors)} failed).")
+        for error in chunk_errors:
             print(error)
-        raise
+        read_start = time.perf_counter()
+
+    refresh_and_bump(es, index_name)
+    if errors:
+        print(f"BulkIndexError: {len(errors)} document(s) failed to index.")
+        raise BulkIndexError(f"{len(errors)} document(s) failed to index.", errors)
+    print(f"Indexed {indexed} documents into index '{index_name}'.")
+    return indexed
+
+def _next_index_version(es, alias):
+    """
+    Returns the next free version number for the versioned indices behind an alias (alias_v1, alias_v2, ...).
+    """
+    pattern = re.compile(rf"^{re.escape(alias)}_v(\d+)$")
+    versions = [int(match.group(1)) for match in map(pattern.match, es.indices.get(index=f"{alias}_v*")) if match]
+    return max(versions, default=0) + 1
 
-def analyze_text(es, index_name, analyzer, text):
+def reindex_with_alias(es, alias, settings, source_file, warm_queries=(), keep_old=False, **index_kwargs):
+    """
+    Rebuilds the index behind an alias without interrupting searches on it.
+    A new versioned index (e.g. articles_pipeline_v2) is created with refresh disabled and no replicas,
+    loaded with index_documents (index_kwargs are passed through), then its refresh interval and replica
+    count are restored from settings, it is refreshed, force-merged to one segment and warmed with
+    warm_queries. Finally the alias is moved to it in one atomic update_aliases call. A concrete index
+    that still has the alias name is removed in the same call, and older versions are deleted unless
+    keep_old is set. Returns the name of the new index.
+    """
+    new_index = f"{alias}_v{_next_index_version(es, alias)}"
+    index_settings = settings.get("settings", {}).get("index", {})
+    body = copy.deepcopy(settings)
+    load_settings = body.setdefault("settings", {}).setdefault("index", {})
+    load_settings.update({"refresh_interval": "-1", "number_of_replicas": 0})
+    create_index(es, new_index, body)
+
+    index_documents(es, new_index, source_file, **index_kwargs)
+
+    es.indices.put_settings(index=new_index, settings={"index": {
+        "refresh_interval": index_settings.get("refresh_interval"),
+        "number_of_replicas": index_settings.get("number_of_replicas", 1),
+    }})
+    with metrics.stage("refresh"):
+        es.indices.refresh(index=new_index)
+    with metrics.stage("forcemerge"):
+        es.indices.forcemerge(index=new_index, max_num_segments=1)
+    with metrics.stage("warm"):
+        for query in warm_queries:
+            es.search(index=new_index, body=query)
+    print(f"Loaded, merged and warmed index: {new_index}")
+
+    old_indices = list(es.indices.get_alias(name=alias)) if es.indices.exists_alias(name=alias) else []
+    actions = [{"remove": {"index": old_index, "alias": alias}} for old_index in old_indices]
+    if not old_indices and es.indices.exists(index=alias):
+        # First switch from a plain index to an alias: drop the old index in the same atomic call.
+        actions.append({"remove_index": {"index": alias}})
+    actions.append({"add": {"index": new_index, "alias": alias}})
+    es.indices.update_aliases(actions=actions)
+    _settings_versions[alias] = _settings_versions[new_index]
+    bump_generation(alias)
+    print(f"Alias '{alias}' now points to {new_index}")
+
+    if not keep_old:
+        for old_index in old_indices:
+            es.indices.delete(index=old_index)
+            print(f"Deleted previous index: {old_index}")
+    return new_index
+
+@metrics.timed("analyze_text")
+def analyze_text(es, index_name, analyzer, text, client=None):
     """
     Uses the Analyze API to process a sample text with a specified analyzer.
+    If an analyze_client.AnalyzeClient is given, the tokens come from its cache when possible.
     """
-    body = {
-        "analyzer": analyzer,
-        "text": text
-    }
-    response = es.indices.analyze(index=index_name, body=body)
-    tokens = [token["token"] for token in response["tokens"]]
+    if client is not None:
+        tokens = client.analyze(index_name, analyzer, text)
+    else:
+        body = {
+            "analyzer": analyzer,
+            "text": text
+        }
+        response = es.indices.analyze(index=index_name, body=body)
+        tokens = [token["token"] for token in response["tokens"]]
     print(f"\nAnalyzed tokens using '{analyzer}':")
     print(tokens)
     return tokens
 
-def search_documents(es, index_name, query, description="Query"):
+@metrics.timed("search_documents")
+def search_documents(es, index_name, query, description="Query", cache=None):
     """
     Executes a search query and prints the total hit count and each hit’s score and content.
+    With a search_cache.SearchCache, repeated queries are answered from the cache.
     """
     print(f"\nExecuting {description}:")
-    res = es.search(index=index_name, body=query)
+    start = time.perf_counter()
+    res = cache.search(index_name, query) if cache is not None else es.search(index=index_name, body=query)
+    metrics.record_search(index_name, description, res, time.perf_counter() - start)
     total = res["hits"]["total"]["value"]
     print("Total hits:", total)
     for hit in res["hits"]["hits"]:
@@ -89,9 +321,145 @@ def search_documents(es, index_name, query, description="Query"):
     print("-" * 50)
     return res
 
-def main():
+def _iter_slice(es, pit_id, query, source, page_size, keep_alive, slice_id, slice_max):
+    """
+    Yields the pages of hits of one slice of a point in time, in index order, using search_after.
+    """
+    search_after = None
+    while True:
+        body = {
+            "query": query,
+            "size": page_size,
+            "pit": {"id": pit_id, "keep_alive": keep_alive},
+            "sort": [{"_shard_doc": "asc"}],
+            "track_total_hits": False,
+        }
+        if source is not None:
+            body["_source"] = source
+        if slice_max > 1:
+            body["slice"] = {"id": slice_id, "max": slice_max}
+        if search_after is not None:
+            body["search_after"] = search_after
+        res = es.search(body=body)
+        # The point in time id can change between requests; always use the latest one.
+        pit_id = res.get("pit_id", pit_id)
+        hits = res["hits"]["hits"]
+        if not hits:
+            return
+        yield hits
+        if len(hits) < page_size:
+            return
+        search_after = hits[-1]["sort"]
+
+def stream_documents(es, index_name, query, source=None, page_size=DEFAULT_PAGE_SIZE, slices=1,
+                     keep_alive=DEFAULT_KEEP_ALIVE):
+    """
+    Yields every hit of a query, not just the first page that search_documents shows.
+    The hits are read from a point in time in pages of page_size with search_after, so the results
+    are consistent and memory stays constant however many documents match. source filters the
+    returned _source (e.g. ["content"], or False for ids only). With slices > 1 the point in time is
+    split into sliced scrolls read by one thread each; at most two pages per slice are buffered, and
+    hits then arrive in no particular order. Closing the generator early closes the point in time.
+    """
+    pit_id = es.open_point_in_time(index=index_name, keep_alive=keep_alive)["id"]
+    try:
+        if slices <= 1:
+            for hits in _iter_slice(es, pit_id, query, source, page_size, keep_alive, 0, 1):
+                yield from hits
+            return
+
+        pages = queue.Queue(maxsize=slices * 2)
+        stop = threading.Event()
+
+        def read_slice(slice_id):
+            try:
+                for hits in _iter_slice(es, pit_id, query, source, page_size, keep_alive, slice_id, slices):
+                    while not stop.is_set():
+                        try:
+                            pages.put(hits, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+                pages.put(None)
+            except Exception as error:
+                pages.put(error)
+
+        threads = [threading.Thread(target=read_slice, args=(slice_id,), daemon=True) for slice_id in range(slices)]
+        for thread in threads:
+            thread.start()
+        try:
+            finished = 0
+            while finished < slices:
+                page = pages.get()
+                if page is None:
+                    finished += 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield from page
+        finally:
+            stop.set()
+            # Unblock readers waiting to put their last page or error.
+            while any(thread.is_alive() for thread in threads):
+                try:
+                    pages.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+    finally:
+        es.close_point_in_time(id=pit_id)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Index the survey data and run the example queries.")
+    parser.add_argument("--source", default="sample_data.csv",
+                        help="CSV file or Excel workbook to index (default: sample_data.csv)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="rows read from the source per chunk")
+    parser.add_argument("--bulk-size", type=int, default=DEFAULT_BULK_SIZE,
+                        help="documents sent per bulk request")
+    parser.add_argument("--limit", type=int, default=1000,
+                        help="maximum number of rows to index (0 indexes every row)")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="bulk threads; more than 1 uses helpers.parallel_bulk")
+    parser.add_argument("--content-columns", nargs="+", default=None,
+                        help="columns combined into the content field (default: every column)")
+    parser.add_argument("--id-columns", nargs="+", default=None,
+                        help="columns used as document ids, e.g. case (default: the row number)")
+    parser.add_argument("--host", default=None,
+                        help=f"Elasticsearch server (default: $ES_HOST or {DEFAULT_ES_HOST})")
+    parser.add_argument("--embedded", action="store_true",
+                        help="run against the in-process search engine instead of Elasticsearch")
+    parser.add_argument("--reindex", action="store_true",
+                        help="rebuild behind an alias (articles_pipeline -> articles_pipeline_vN) without downtime")
+    parser.add_argument("--metrics-json", default=None,
+                        help="write stage timings, bulk and search measurements as JSON to this file")
+    parser.add_argument("--metrics-prom", default=None,
+                        help="write the measurements in Prometheus text format to this file")
+    parser.add_argument("--profile", default=None, metavar="DIR",
+                        help="run each stage under cProfile and write <stage>.prof files to DIR")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="record the peak Python heap of each stage with tracemalloc")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.metrics_json or args.metrics_prom or args.profile or args.trace_memory:
+        metrics.configure(profile_dir=args.profile, trace_memory=args.trace_memory)
+    try:
+        run_pipeline(args)
+    finally:
+        if metrics.enabled:
+            metrics.print_summary()
+            if args.metrics_json:
+                metrics.write_json(args.metrics_json)
+            if args.metrics_prom:
+                metrics.write_prometheus(args.metrics_prom)
+            metrics.write_profiles()
+
+def run_pipeline(args):
     # Step 1: Connect to Elasticsearch using the API.
-    es = connect_es()
+    es = connect_es(embedded=args.embedded, host=args.host)
     
     # Step 2: Create an index with a custom analyzer that performs:
     # - Standard tokenization
@@ -99,32 +467,18 @@ def main():
     # - Stopword removal
     # - Porter stemming (for morphological analysis)
     index_name = "articles_pipeline"
-    settings = {
-        "settings": {
-            "analysis": {
-                "analyzer": {
-                    "custom_analyzer": {
-                        "type": "custom",
-                        "tokenizer": "standard",
-                        "filter": ["lowercase", "stop", "porter_stem"]
-                    }
-                }
-            }
-        },
-        "mappings": {
-            "properties": {
-                "content": {
-                    "type": "text",
-                    "analyzer": "custom_analyzer"
-                }
-            }
-        }
-    }
-    create_index(es, index_name, settings)
-    
-    # Step 3: Index the first 1000 documents from your dataset (sample_data.csv).
-    csv_file = "sample_data.csv"  # Ensure this file exists in your working directory.
-    index_documents(es, index_name, csv_file)
+    settings = PIPELINE_SETTINGS  # defined in index_settings.py
+    index_kwargs = {"chunk_size": args.chunk_size, "limit": args.limit or None, "bulk_size": args.bulk_size,
+                    "thread_count": args.threads, "content_columns": args.content_columns,
+                    "id_columns": args.id_columns}
+    if args.reindex:
+        # Steps 2 and 3 without downtime: build a new version of the index, then switch the alias to it.
+        reindex_with_alias(es, index_name, settings, args.source, warm_queries=[WARM_QUERY], **index_kwargs)
+    else:
+        create_index(es, index_name, settings)
+
+        # Step 3: Stream the dataset (sample_data.csv by default) into the index, first 1000 rows unless --limit says otherwise.
+        index_documents(es, index_name, args.source, **index_kwargs)
     
     # Step 4: Demonstrate text analysis (tokenization, case folding, stopword removal, and stemming)
     sample_text = "The buses were running while the bus driver drove the busses."
@@ -0,0 +1,422 @@
+import argparse
+import gzip
+import json
+import random
+import re
+import threading
+import time
+from collections.abc import Mapping
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import numpy as np
+
+from build_indices import build_indices
+from index_settings import INDEX_REGISTRY
+from local_engine import LocalSearchEngine
+
+# A local HTTP stand-in for the Elasticsearch REST API, backed by the in-process LocalSearchEngine,
+# so the unmodified Elasticsearch client (and every script that uses it) can run without a cluster:
+#     python es_standin.py --port 9200 &
+#     ES_HOST=http://127.0.0.1:9200 python es_pipeline.py
+# It serves the endpoints the project calls (ping, index exists/create/delete/get/settings/refresh/
+# forcemerge/analyze, aliases, _bulk, _search, _msearch and points in time) over plain HTTP, and can
+# inject faults from a seeded random generator: extra latency on every request, whole requests rejected
+# with 429 (bulk and search only) and bulk items rejected with 429, which helpers.streaming_bulk reports
+# as failures (es_pipeline raises BulkIndexError) or retries when max_retries is set. With a single client
+# thread the same seed rejects the same requests and items on every run.
+# Requests are served by one thread each but run against the engine one at a time.
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 9200
+STANDIN_VERSION = "8.15.0"
+PRODUCT_HEADER = ("X-Elastic-Product", "Elasticsearch")
+JSON_CONTENT_TYPE = "application/json"
+# Endpoints that can be rejected as a whole with 429, like a saturated write or search thread pool.
+REJECTABLE_ENDPOINTS = ("bulk", "search", "msearch")
+
+class ApiError(Exception):
+    """
+    An error returned to the client as an Elasticsearch error response.
+    """
+
+    def __init__(self, status, error_type, reason):
+        super().__init__(reason)
+        self.status = status
+        self.error_type = error_type
+        self.reason = reason
+
+    def body(self):
+        return {"error": {"root_cause": [{"type": self.error_type, "reason": self.reason}],
+                          "type": self.error_type, "reason": self.reason}, "status": self.status}
+
+def api_error(error):
+    """
+    Maps a ValueError raised by the engine to the status and type Elasticsearch would return.
+    """
+    reason = str(error)
+    if reason.startswith("No such index"):
+        return ApiError(404, "index_not_found_exception", reason)
+    if reason.startswith("Index already exists"):
+        return ApiError(400, "resource_already_exists_exception", reason)
+    if reason.startswith(("Alias not found", "No such point in time")):
+        return ApiError(404, "resource_not_found_exception", reason)
+    return ApiError(400, "illegal_argument_exception", reason)
+
+def _json_default(value):
+    # Sources are returned by the document store as read-only Mapping views; amounts may be NumPy scalars.
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def parse_ndjson(data):
+    """
+    Returns the JSON objects of a newline-delimited body (bulk and msearch requests).
+    """
+    return [json.loads(line) for line in data.splitlines() if line.strip()]
+
+# -------------------------------------------
+# Fault injection
+# -------------------------------------------
+
+class FaultInjector:
+    """
+    Decides, from one seeded random generator, the latency added to each request, whether a bulk or
+    search request is rejected with 429 and which bulk items are rejected.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, reject_rate=0.0, bulk_failure_rate=0.0, seed=0):
+        for name, rate in (("reject_rate", reject_rate), ("bulk_failure_rate", bulk_failure_rate)):
+            if not 0.0 <= rate <= 1.0:
+                raise ValueError(f"{name} must be between 0 and 1, got {rate}")
+        if latency < 0 or jitter < 0:
+            raise ValueError("latency and jitter must not be negative")
+        self.latency = latency
+        self.jitter = jitter
+        self.reject_rate = reject_rate
+        self.bulk_failure_rate = bulk_failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def delay(self):
+        """
+        Returns the seconds to wait before answering a request.
+        """
+        if not self.jitter:
+            return self.latency
+        with self.lock:
+            return self.latency + self.random.uniform(0.0, self.jitter)
+
+    def reject_request(self):
+        if not self.reject_rate:
+            return False
+        with self.lock:
+            return self.random.random() < self.reject_rate
+
+    def rejected_items(self, count):
+        """
+        Returns the set of positions, among count bulk items, to reject.
+        """
+        if not self.bulk_failure_rate:
+            return set()
+        with self.lock:
+            return {i for i in range(count) if self.random.random() < self.bulk_failure_rate}
+
+# -------------------------------------------
+# REST API
+# -------------------------------------------
+
+_NAME = r"(?P<index>[^_/][^/]*)"
+# (methods, path pattern, handler); the first match wins.
+ROUTES = [
+    (("HEAD",), r"/", "ping"),
+    (("GET",), r"/", "info"),
+    (("GET",), r"/_standin/stats", "stats"),
+    (("POST", "PUT"), rf"(?:/{_NAME})?/_bulk", "bulk"),
+    (("GET", "POST"), rf"(?:/{_NAME})?/_search", "search"),
+    (("GET", "POST"), rf"(?:/{_NAME})?/_msearch", "msearch"),
+    (("GET", "POST"), rf"(?:/{_NAME})?/_analyze", "analyze"),
+    (("GET", "POST"), rf"(?:/{_NAME})?/_refresh", "refresh"),
+    (("POST",), rf"(?:/{_NAME})?/_forcemerge", "forcemerge"),
+    (("POST",), rf"/{_NAME}/_pit", "open_point_in_time"),
+    (("DELETE",), r"/_pit", "close_point_in_time"),
+    (("PUT",), rf"/{_NAME}/_settings", "put_settings"),
+    (("POST",), r"/_aliases", "update_aliases"),
+    (("HEAD",), rf"(?:/{_NAME})?/_alias/(?P<name>[^/]+)", "exists_alias"),
+    (("GET",), rf"(?:/{_NAME})?/_alias(?:/(?P<name>[^/]+))?", "get_alias"),
+    (("HEAD",), rf"/{_NAME}", "exists"),
+    (("GET",), rf"/{_NAME}", "get"),
+    (("PUT",), rf"/{_NAME}", "create"),
+    (("DELETE",), rf"/{_NAME}", "delete"),
+]
+COMPILED_ROUTES = [(methods, re.compile(pattern), handler) for methods, pattern, handler in ROUTES]
+
+class StandinApi:
+    """
+    Executes REST requests against a LocalSearchEngine and returns (status, response body).
+    Handlers take the path parameters, the query string parameters and the raw request body.
+    """
+
+    def __init__(self, engine=None, faults=None):
+        self.engine = engine if engine is not None else LocalSearchEngine()
+        self.faults = faults or FaultInjector()
+        self.engine_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.endpoint_stats = {}
+
+    def route(self, method, path):
+        """
+        Returns the handler name and path parameters of a request (ApiError if no endpoint matches).
+        """
+        path = path.rstrip("/") or "/"
+        for methods, pattern, handler in COMPILED_ROUTES:
+            match = pattern.fullmatch(path)
+            if match and method in methods:
+                params = {key: unquote(value) for key, value in match.groupdict().items() if value is not None}
+                return handler, params
+        raise ApiError(405 if any(pattern.fullmatch(path) for _, pattern, _ in COMPILED_ROUTES) else 400,
+                       "illegal_argument_exception", f"Unsupported request: {method} {path}")
+
+    def handle(self, method, path, query, data):
+        """
+        Serves one request: waits for the injected latency, rejects it if the injector says so,
+        then runs the handler with the engine locked. Returns (status, body, endpoint).
+        """
+        start = time.perf_counter()
+        endpoint = None
+        try:
+            endpoint, params = self.route(method, path)
+            delay = self.faults.delay()
+            if delay:
+                time.sleep(delay)
+            if endpoint in REJECTABLE_ENDPOINTS and self.faults.reject_request():
+                raise ApiError(429, "es_rejected_execution_exception",
+                               f"rejected execution of {endpoint} request (injected fault)")
+            with self.engine_lock:
+                status, body = getattr(self, f"_{endpoint}")(params, query, data)
+        except ApiError as error:
+            status, body = error.status, error.body()
+        except ValueError as error:
+            error = api_error(error)
+            status, body = error.status, error.body()
+        except Exception as error:
+            # A request the engine cannot handle (e.g. a malformed body) fails alone, like a shard failure.
+            error = ApiError(500, "exception", f"{type(error).__name__}: {error}")
+            status, body = error.status, error.body()
+        self._record(endpoint or "unsupported", status, time.perf_counter() - start)
+        return status, body, endpoint
+
+    def _record(self, endpoint, status, seconds):
+        with self.stats_lock:
+            stats = self.endpoint_stats.setdefault(endpoint, {"requests": 0, "errors": 0, "seconds": 0.0})
+            stats["requests"] += 1
+            stats["errors"] += status >= 400
+            stats["seconds"] += seconds
+
+    def stats(self):
+        """
+        Returns the requests, error responses and server-side seconds per endpoint.
+        """
+        with self.stats_lock:
+            return {endpoint: dict(stats) for endpoint, stats in sorted(self.endpoint_stats.items())}
+
+    def _body(self, data):
+        return json.loads(data) if data and data.strip() else {}
+
+    def _ping(self, params, query, data):
+        return 200, None
+
+    def _info(self, params, query, data):
+        return 200, {"name": "es-standin", "cluster_name": "es-standin", "version": {
+            "number": STANDIN_VERSION, "build_flavor": "default", "lucene_version": "9.11.1"},
+            "tagline": "You Know, for Search"}
+
+    def _stats(self, params, query, data):
+        return 200, self.stats()
+
+    def _exists(self, params, query, data):
+        return (200 if self.engine.indices.exists(index=params["index"]) else 404), None
+
+    def _create(self, params, query, data):
+        return 200, self.engine.indices.create(index=params["index"], body=self._body(data))
+
+    def _delete(self, params, query, data):
+        return 200, self.engine.indices.delete(index=params["index"])
+
+    def _get(self, params, query, data):
+        indices = self.engine.indices.get(index=params["index"])
+        if not indices and "*" not in params["index"]:
+            raise ApiError(404, "index_not_found_exception", f"No such index: {params['index']}")
+        return 200, indices
+
+    def _put_settings(self, params, query, data):
+        return 200, self.engine.indices.put_settings(index=params["index"], body=self._body(data))
+
+    def _refresh(self, params, query, data):
+        return 200, self.engine.indices.refresh(index=params.get("index"))
+
+    def _forcemerge(self, params, query, data):
+        max_num_segments = query.get("max_num_segments")
+        return 200, self.engine.indices.forcemerge(
+            index=params.get("index"), max_num_segments=None if max_num_segments is None else int(max_num_segments))
+
+    def _analyze(self, params, query, data):
+        return 200, self.engine.indices.analyze(index=params.get("index"), body=self._body(data))
+
+    def _exists_alias(self, params, query, data):
+        found = self.engine.indices.exists_alias(name=params["name"], index=params.get("index"))
+        return (200 if found else 404), None
+
+    def _get_alias(self, params, query, data):
+        return 200, self.engine.indices.get_alias(name=params.get("name"), index=params.get("index"))
+
+    def _update_aliases(self, params, query, data):
+        return 200, self.engine.indices.update_aliases(actions=self._body(data).get("actions", []))
+
+    def _bulk(self, params, query, data):
+        """
+        Applies the bulk operations that the fault injector does not reject; rejected items are
+        reported in place with status 429, as Elasticsearch does when its write queue is full.
+        """
+        start = time.perf_counter()
+        lines = parse_ndjson(data)
+        entries = []
+        position = 0
+        while position < len(lines):
+            (op_type, meta), = lines[position].items()
+            if op_type == "delete":
+                entries.append(lines[position:position + 1])
+                position += 1
+            else:
+                entries.append(lines[position:position + 2])
+                position += 2
+        rejected = self.faults.rejected_items(len(entries))
+        applied = self.engine.bulk([line for i, entry in enumerate(entries) if i not in rejected for line in entry],
+                                   index=params.get("index"), refresh=query.get("refresh"))
+        applied_items = iter(applied["items"])
+        items = []
+        for i, entry in enumerate(entries):
+            if i not in rejected:
+                items.append(next(applied_items))
+                continue
+            (op_type, meta), = entry[0].items()
+            doc_id = meta.get("_id")
+            items.append({op_type: {
+                "_index": meta.get("_index", params.get("index")), "_id": None if doc_id is None else str(doc_id),
+                "status": 429, "error": {"type": "es_rejected_execution_exception",
+                                         "reason": "rejected execution of bulk item (injected fault)"}}})
+        if query.get("refresh") in ("", "true", "wait_for"):
+            self.engine.indices.refresh(index=params.get("index"))
+        return 200, {"took": int((time.perf_counter() - start) * 1000), "errors": applied["errors"] or bool(rejected),
+                     "items": items}
+
+    def _search(self, params, query, data):
+        body = self._body(data)
+        for name, key in (("size", "size"), ("from", "from")):
+            if name in query and key not in body:
+                body[key] = int(query[name])
+        return 200, self.engine.search(index=params.get("index"), body=body)
+
+    def _msearch(self, params, query, data):
+        return 200, self.engine.msearch(searches=parse_ndjson(data), index=params.get("index"))
+
+    def _open_point_in_time(self, params, query, data):
+        return 200, self.engine.open_point_in_time(index=params["index"], keep_alive=query.get("keep_alive"))
+
+    def _close_point_in_time(self, params, query, data):
+        return 200, self.engine.close_point_in_time(body=self._body(data))
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """
+    Reads a request, passes it to the server's StandinApi and writes the JSON response.
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version = "es-standin"
+
+    def _serve(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length) if length else b""
+        if self.headers.get("Content-Encoding") == "gzip":
+            data = gzip.decompress(data)
+        status, body, _ = self.server.api.handle(self.command, url.path, dict(parse_qsl(url.query, True)),
+                                                 data.decode("utf-8"))
+        payload = b"" if body is None else json.dumps(body, default=_json_default).encode("utf-8")
+        self.send_response(status)
+        self.send_header(*PRODUCT_HEADER)
+        self.send_header("Content-Type", JSON_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _serve
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, api, verbose=False):
+        super().__init__(address, StandinHandler)
+        self.api = api
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+def start_standin(host=DEFAULT_HOST, port=0, engine=None, faults=None, verbose=False):
+    """
+    Starts a stand-in server in a background thread (port 0 picks a free port) and returns it;
+    server.url is the address to connect to and server.shutdown() stops it.
+    """
+    server = StandinServer((host, port), StandinApi(engine, faults), verbose)
+    threading.Thread(target=server.serve_forever, name="es-standin", daemon=True).start()
+    return server
+
+def print_stats(stats):
+    print(f"\n{'endpoint':<22}{'requests':>10}{'errors':>8}{'server ms/request':>19}")
+    for endpoint, row in stats.items():
+        print(f"{endpoint:<22}{row['requests']:>10}{row['errors']:>8}{1000 * row['seconds'] / row['requests']:>19.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the local search engine over the Elasticsearch REST API.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency, up to this many seconds")
+    parser.add_argument("--reject-rate", type=float, default=0.0,
+                        help="fraction of bulk and search requests rejected with 429")
+    parser.add_argument("--bulk-failure-rate", type=float, default=0.0,
+                        help="fraction of bulk items rejected with 429")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the fault injector")
+    parser.add_argument("--load", nargs="+", choices=list(INDEX_REGISTRY), default=None,
+                        help="indices to build from --source before serving")
+    parser.add_argument("--source", default="sample_data.csv", help="CSV file or Excel workbook for --load")
+    parser.add_argument("--limit", type=int, default=1000, help="rows to load (0 loads every row)")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    engine = LocalSearchEngine()
+    if args.load:
+        build_indices(engine, args.source, args.load, limit=args.limit or None)
+    faults = FaultInjector(args.latency, args.jitter, args.reject_rate, args.bulk_failure_rate, args.seed)
+    server = StandinServer((args.host, args.port), StandinApi(engine, faults), args.verbose)
+    print(f"Serving the Elasticsearch stand-in on {server.url} (export ES_HOST={server.url}).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print_stats(server.api.stats())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import argparse
+import json
+import time
+
+from es_pipeline import (DEFAULT_PAGE_SIZE, connect_es, create_index, index_documents, stream_documents)
+from index_settings import INDEX_REGISTRY
+
+# Exports every hit of a query as NDJSON ({"_id": ..., "_source": ...} per line), streaming the
+# results with a point in time and search_after (see es_pipeline.stream_documents).
+
+def export_hits(es, index_name, query, output_file, source=None, page_size=DEFAULT_PAGE_SIZE, slices=1):
+    """
+    Writes every hit of the query to output_file and returns the number of hits written.
+    """
+    count = 0
+    start = time.perf_counter()
+    with open(output_file, "w", encoding="utf-8") as f:
+        for hit in stream_documents(es, index_name, query, source, page_size, slices):
+            f.write(json.dumps({"_id": hit["_id"], "_source": hit.get("_source")}, ensure_ascii=False))
+            f.write("\n")
+            count += 1
+    elapsed = time.perf_counter() - start
+    print(f"Exported {count} hits from '{index_name}' to {output_file} in {elapsed:.2f}s "
+          f"({count / elapsed if elapsed else 0:.0f} hits/s).")
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export every hit of a query as NDJSON.")
+    parser.add_argument("--index", default="articles_pipeline", choices=list(INDEX_REGISTRY))
+    parser.add_argument("--query", default='{"match_phrase": {"content": "Indonesian tourist"}}',
+                        help="query clause as JSON (default: the phrase 'Indonesian tourist')")
+    parser.add_argument("--fields", nargs="+", default=None,
+                        help="_source fields to export (default: the whole source)")
+    parser.add_argument("--output", default="hits.ndjson", help="NDJSON file to write")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE, help="hits per search_after page")
+    parser.add_argument("--slices", type=int, default=1, help="sliced readers running in parallel")
+    parser.add_argument("--embedded", action="store_true",
+                        help="load --source into the in-process search engine first")
+    parser.add_argument("--source", default="sample_data.csv", help="data loaded with --embedded")
+    args = parser.parse_args(argv)
+
+    es = connect_es(embedded=args.embedded)
+    if args.embedded:
+        create_index(es, args.index, INDEX_REGISTRY[args.index]["settings"])
+        index_documents(es, args.index, args.source)
+    export_hits(es, args.index, json.loads(args.query), args.output, args.fields, args.page_size, args.slices)
+
+if __name__ == "__main__":
+    main()
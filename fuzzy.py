@@ -0,0 +1,415 @@
+import argparse
+import bisect
+import heapq
+import time
+from collections import Counter
+
+from build_indices import build_indices
+from documents import build_content_documents, build_sources
+from es_pipeline import connect_es, iter_source_chunks, search_documents
+from index_settings import INDEX_REGISTRY
+from local_engine import LocalIndex, LocalSearchEngine
+
+# Typo-tolerant and prefix search over the term dictionary of one field, with indexes built once from
+# the indexed vocabulary instead of edit-distance automata run at query time:
+# - SymSpellIndex maps every string obtained by deleting up to max_distance characters from the first
+#   prefix_length characters of a term to the terms it came from. A misspelled word only has to generate
+#   its own deletes and look them up; the few candidates found are checked with a bounded edit distance.
+# - PrefixDictionary keeps the terms sorted (a plain sorted array rather than an FST), so the completions
+#   of a prefix are a contiguous range; the best completions of prefixes with large ranges are precomputed.
+#   Completions are built over the words as they appear in the text (before stemming), so they are
+#   words a user would type rather than stems.
+# expand_query rewrites the match clauses of a query into the matched terms before it is sent to
+# search_documents, so the cluster (or the embedded engine) only runs ordinary term lookups.
+
+DEFAULT_MAX_DISTANCE = 2
+DEFAULT_PREFIX_LENGTH = 7
+DEFAULT_MAX_EXPANSIONS = 50
+DEFAULT_SUGGESTIONS = 10
+# Prefixes matching more terms than this have their best completions precomputed.
+PREFIX_SCAN_LIMIT = 256
+# The last code point: prefix + LAST_CHARACTER sorts after every term starting with prefix.
+LAST_CHARACTER = "\U0010ffff"
+
+# -------------------------------------------
+# Edit distance
+# -------------------------------------------
+
+def _deletes(word, max_distance):
+    """
+    Returns the set of strings obtained by deleting up to max_distance characters from word (word included).
+    """
+    deletes = {word}
+    level = {word}
+    for _ in range(max_distance):
+        level = {candidate[:i] + candidate[i + 1:] for candidate in level for i in range(len(candidate))}
+        level -= deletes
+        if not level:
+            break
+        deletes |= level
+    return deletes
+
+def edit_distance(a, b, max_distance):
+    """
+    Returns the Damerau-Levenshtein distance (optimal string alignment: insertions, deletions,
+    substitutions and transpositions of adjacent characters) between a and b, or max_distance + 1
+    as soon as it is known to be larger than max_distance.
+    """
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    # Common prefixes and suffixes do not change the distance.
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    a, b = a[start:], b[start:]
+    while a and b and a[-1] == b[-1]:
+        a, b = a[:-1], b[:-1]
+    if not a or not b:
+        return len(a) + len(b) if len(a) + len(b) <= max_distance else max_distance + 1
+
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                distance = min(distance, previous_previous[j - 2] + 1)
+            current[j] = distance
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return previous[-1] if previous[-1] <= max_distance else max_distance + 1
+
+def auto_fuzziness(term):
+    """
+    Returns the edit distance allowed for a term under Elasticsearch's "AUTO" fuzziness:
+    0 up to 2 characters, 1 up to 5 and 2 beyond.
+    """
+    return 0 if len(term) <= 2 else 1 if len(term) <= 5 else 2
+
+# -------------------------------------------
+# Deletion index and prefix dictionary
+# -------------------------------------------
+
+class SymSpellIndex:
+    """
+    A symmetric delete index over a vocabulary ({term: document frequency}) for lookups within
+    max_distance edits.
+    """
+
+    def __init__(self, vocabulary, max_distance=DEFAULT_MAX_DISTANCE, prefix_length=DEFAULT_PREFIX_LENGTH):
+        if prefix_length <= max_distance:
+            raise ValueError("prefix_length must be greater than max_distance")
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.terms = list(vocabulary)
+        self.counts = [vocabulary[term] for term in self.terms]
+        self.deletes = {}
+        for term_id, term in enumerate(self.terms):
+            for delete in _deletes(term[:prefix_length], max_distance):
+                self.deletes.setdefault(delete, []).append(term_id)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def lookup(self, word, max_distance=None, size=None):
+        """
+        Returns the (term, distance, document frequency) of the terms within max_distance edits of word,
+        closest first and then most frequent first.
+        """
+        max_distance = self.max_distance if max_distance is None else max_distance
+        if max_distance > self.max_distance:
+            raise ValueError(f"The index was built for edit distances up to {self.max_distance}")
+        seen = set()
+        matches = []
+        for delete in _deletes(word[:self.prefix_length], max_distance):
+            for term_id in self.deletes.get(delete, ()):
+                if term_id in seen:
+                    continue
+                seen.add(term_id)
+                distance = edit_distance(word, self.terms[term_id], max_distance)
+                if distance <= max_distance:
+                    matches.append((distance, -self.counts[term_id], self.terms[term_id]))
+        matches.sort()
+        return [(term, distance, -count) for distance, count, term in matches[:size]]
+
+class PrefixDictionary:
+    """
+    The terms of a vocabulary ({term: document frequency}) in sorted order, for completions of a prefix.
+    """
+
+    def __init__(self, vocabulary, size=DEFAULT_SUGGESTIONS, scan_limit=PREFIX_SCAN_LIMIT):
+        self.terms = sorted(vocabulary)
+        self.counts = [vocabulary[term] for term in self.terms]
+        self.size = size
+        self.scan_limit = scan_limit
+        # {prefix: best completions} for the prefixes whose range is longer than scan_limit, found by
+        # walking down from the empty prefix: only the children of a long range can have long ranges.
+        self.top = {}
+        pending = [""]
+        while pending:
+            prefix = pending.pop()
+            start, end = self._range(prefix)
+            if end - start <= scan_limit:
+                continue
+            self.top[prefix] = self._best(start, end, size)
+            children = {term[len(prefix)] for term in self.terms[start:end] if len(term) > len(prefix)}
+            pending.extend(prefix + character for character in children)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def _range(self, prefix):
+        return (bisect.bisect_left(self.terms, prefix),
+                bisect.bisect_left(self.terms, prefix + LAST_CHARACTER))
+
+    def _best(self, start, end, size):
+        best = heapq.nlargest(size, range(start, end), key=lambda i: (self.counts[i], -i))
+        return [(self.terms[i], self.counts[i]) for i in best]
+
+    def suggest(self, prefix, size=None):
+        """
+        Returns the (term, document frequency) of the most frequent terms starting with prefix.
+        """
+        size = self.size if size is None else size
+        if prefix in self.top and size <= self.size:
+            return self.top[prefix][:size]
+        start, end = self._range(prefix)
+        return self._best(start, end, size)
+
+def lowercases(analyzer):
+    """
+    Returns True if an analyzer lowercases its tokens.
+    """
+    tokens = analyzer("X")
+    return bool(tokens) and tokens[0][0] == "x"
+
+class FuzzyIndex:
+    """
+    The deletion index and prefix dictionary of one field, together with the analyzer its text goes
+    through, so query text is looked up the way it was indexed (lowercased, stemmed, ...).
+    vocabulary holds the indexed terms and surface_vocabulary the words they were analyzed from
+    (see field_vocabularies); completions come from surface_vocabulary when it is given.
+    """
+
+    def __init__(self, field, vocabulary, analyzer, max_distance=DEFAULT_MAX_DISTANCE,
+                 prefix_length=DEFAULT_PREFIX_LENGTH, surface_vocabulary=None):
+        self.field = field
+        self.analyzer = analyzer
+        self.vocabulary = vocabulary
+        self.symspell = SymSpellIndex(vocabulary, max_distance, prefix_length)
+        self.prefixes = PrefixDictionary(vocabulary if surface_vocabulary is None else surface_vocabulary)
+        self.lowercase = lowercases(analyzer)
+
+    def expansions(self, term, fuzziness="AUTO", max_expansions=DEFAULT_MAX_EXPANSIONS):
+        """
+        Returns the indexed terms a query term expands to: the term itself when it is indexed, then the
+        closest and most frequent terms within the allowed edit distance, at most max_expansions in all.
+        """
+        max_distance = auto_fuzziness(term) if fuzziness == "AUTO" else int(fuzziness)
+        max_distance = min(max_distance, self.symspell.max_distance)
+        if max_distance == 0:
+            return [term] if term in self.vocabulary else []
+        return [match for match, _, _ in self.symspell.lookup(term, max_distance, max_expansions)]
+
+    def suggest(self, text, size=DEFAULT_SUGGESTIONS):
+        """
+        Returns the most frequent words completing the last word of text, as (word, document frequency).
+        The words are the unstemmed forms of the indexed terms; the prefix is only lowercased when the
+        analyzer lowercases.
+        """
+        words = text.split()
+        prefix = words[-1] if words else ""
+        if self.lowercase:
+            prefix = prefix.lower()
+        return self.prefixes.suggest(prefix, size)
+
+# -------------------------------------------
+# Vocabularies
+# -------------------------------------------
+
+def index_vocabulary(es, index_name, field):
+    """
+    Returns {term: document frequency} of a field of an index held by the embedded engine, read from its
+    term dictionary (a LocalIndex built in memory or a memory-mapped segment.Segment).
+    """
+    if not isinstance(es, LocalSearchEngine):
+        raise ValueError("Reading the term dictionary needs the embedded engine; use source_vocabulary")
+    local_index = es.get_index(index_name)
+    postings = local_index.postings.get(field)
+    if postings is None:
+        raise ValueError(f"Field {field} is not indexed in {index_name}")
+    if isinstance(postings, dict):
+        return {term: len(docs) for term, docs in postings.items() if docs}
+    return dict(zip(postings.terms, postings.doc_freqs.tolist()))
+
+def _field_text(local_index, source, field):
+    """
+    Returns the text of a field in a document, reading multi-fields (e.g. "f5_designation.oth.keyword")
+    from their parent field.
+    """
+    if field in source:
+        return source[field]
+    base, _, subfield = field.rpartition(".")
+    if subfield in local_index.field_mapping(base).get("fields", {}):
+        return source.get(base)
+    return None
+
+def field_vocabularies(texts, analyzer):
+    """
+    Returns ({term: document frequency}, {surface form: document frequency}) of texts analyzed with
+    analyzer. The surface form of a token is the text it was analyzed from (read through its offsets,
+    lowercased when the analyzer lowercases), e.g. "singapore" for the stem "singapor".
+    """
+    lowercase = lowercases(analyzer)
+    vocabulary = Counter()
+    surfaces = Counter()
+    for text in texts:
+        if not isinstance(text, str):
+            continue
+        tokens = analyzer(text)
+        vocabulary.update({token for token, _, _, _ in tokens})
+        words = {text[start:end] for _, _, start, end in tokens}
+        surfaces.update({word.lower() for word in words} if lowercase else words)
+    return dict(vocabulary), dict(surfaces)
+
+def _source_texts(source_file, index_name, field, limit=None):
+    """
+    Yields the text of a field in every document of a registered index, built from the source file.
+    """
+    entry = INDEX_REGISTRY[index_name]
+    local_index = LocalIndex(index_name, entry["settings"])
+    for chunk in iter_source_chunks(source_file, limit=limit):
+        documents = build_sources(chunk) if entry["documents"] == "source" else build_content_documents(chunk)
+        for source in documents:
+            yield _field_text(local_index, source, field)
+
+def source_vocabulary(source_file, index_name, field, limit=None):
+    """
+    Returns {term: document frequency} of a field as the documents of a registered index would be analyzed,
+    computed from the source file. Used when the index lives on an Elasticsearch cluster.
+    """
+    analyzer = LocalIndex(index_name, INDEX_REGISTRY[index_name]["settings"]).analyzer_for(field)
+    return field_vocabularies(_source_texts(source_file, index_name, field, limit), analyzer)[0]
+
+def build_fuzzy_index(es, index_name, field, source_file=None, limit=None, max_distance=DEFAULT_MAX_DISTANCE):
+    """
+    Builds the FuzzyIndex of a field: from the embedded engine's term dictionary and stored documents, or
+    from the source file when es is an Elasticsearch client.
+    """
+    if isinstance(es, LocalSearchEngine):
+        local_index = es.get_index(index_name)
+        analyzer = local_index.analyzer_for(field)
+        vocabulary = index_vocabulary(es, index_name, field)
+        texts = (_field_text(local_index, local_index.get_source(doc), field)
+                 for doc in local_index.id_to_doc.values())
+        surfaces = field_vocabularies(texts, analyzer)[1]
+    else:
+        if source_file is None:
+            raise ValueError("A source file is needed to build the vocabulary of an Elasticsearch index")
+        analyzer = LocalIndex(index_name, INDEX_REGISTRY[index_name]["settings"]).analyzer_for(field)
+        vocabulary, surfaces = field_vocabularies(_source_texts(source_file, index_name, field, limit), analyzer)
+    return FuzzyIndex(field, vocabulary, analyzer, max_distance, surface_vocabulary=surfaces)
+
+# -------------------------------------------
+# Query expansion
+# -------------------------------------------
+
+def _expand_match(fuzzy_index, value, fuzziness, max_expansions):
+    """
+    Rewrites the parameters of a match clause into a bool query over the expanded terms. Each query term
+    becomes a bool "should" of one match per expansion, analyzed with the keyword analyzer so the indexed
+    terms are looked up as they are; the term clauses are combined like the original operator.
+    """
+    params = value if isinstance(value, dict) else {"query": value}
+    operator = params.get("operator", "or").lower()
+    fuzziness = params.get("fuzziness", fuzziness)
+    terms = list(dict.fromkeys(token for token, _, _, _ in fuzzy_index.analyzer(str(params["query"]))))
+    clauses = []
+    for term in terms:
+        expansions = fuzzy_index.expansions(term, fuzziness, max_expansions) or [term]
+        clauses.append({"bool": {"should": [
+            {"match": {fuzzy_index.field: {"query": expansion, "analyzer": "keyword"}}} for expansion in expansions
+        ]}})
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"bool": {"must" if operator == "and" else "should": clauses}}
+
+def expand_query(query, fuzzy_indexes, fuzziness="AUTO", max_expansions=DEFAULT_MAX_EXPANSIONS):
+    """
+    Returns a copy of a search body or query in which every match clause on a field of fuzzy_indexes
+    ({field: FuzzyIndex}) is expanded to the indexed terms within the allowed edit distance of its terms.
+    A "fuzziness" parameter on the clause overrides the default; other clauses are left unchanged
+    (phrases are not expanded).
+    """
+    if not isinstance(query, dict):
+        return query
+    expanded = {}
+    for key, value in query.items():
+        if key == "match" and len(value) == 1 and next(iter(value)) in fuzzy_indexes:
+            (field, params), = value.items()
+            return _expand_match(fuzzy_indexes[field], params, fuzziness, max_expansions)
+        if isinstance(value, list):
+            expanded[key] = [expand_query(item, fuzzy_indexes, fuzziness, max_expansions) for item in value]
+        elif key in ("query", "bool", "must", "should", "filter", "must_not"):
+            expanded[key] = expand_query(value, fuzzy_indexes, fuzziness, max_expansions)
+        else:
+            expanded[key] = value
+    return expanded
+
+def _should_clauses(query):
+    """
+    Returns the match clauses of an expanded query, for printing.
+    """
+    if "match" in query:
+        return [query]
+    bool_query = query["bool"]
+    return [clause for key in ("must", "should") for item in bool_query.get(key, []) for clause in _should_clauses(item)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Typo-tolerant and prefix search over the indexed vocabulary.")
+    parser.add_argument("queries", nargs="*", default=["Singapre hotl", "Professiols"],
+                        help="query texts to expand and run")
+    parser.add_argument("--complete", nargs="*", default=["sin", "hot", "Pro"], help="prefixes to complete")
+    parser.add_argument("--index", default="articles_pipeline", choices=list(INDEX_REGISTRY))
+    parser.add_argument("--field", default="content", help="field to search (e.g. City_residence on articles)")
+    parser.add_argument("--source", default="sample_data.csv", help="CSV file of survey rows")
+    parser.add_argument("--limit", type=int, default=1000, help="rows to index (0 indexes every row)")
+    parser.add_argument("--max-expansions", type=int, default=DEFAULT_MAX_EXPANSIONS)
+    parser.add_argument("--repeat", type=int, default=1000, help="times each lookup is timed")
+    parser.add_argument("--embedded", action="store_true", help="use the in-process search engine")
+    args = parser.parse_args(argv)
+
+    es = connect_es(embedded=args.embedded)
+    if args.embedded:
+        build_indices(es, args.source, [args.index], limit=args.limit or None)
+    start = time.perf_counter()
+    fuzzy_index = build_fuzzy_index(es, args.index, args.field, args.source, args.limit or None)
+    print(f"Built the fuzzy index of {args.index}.{args.field} in {time.perf_counter() - start:.2f}s: "
+          f"{len(fuzzy_index.symspell)} terms, {len(fuzzy_index.symspell.deletes)} deletes, "
+          f"{len(fuzzy_index.prefixes.top)} precomputed prefixes")
+
+    fuzzy_indexes = {args.field: fuzzy_index}
+    for text in args.queries:
+        query = {"query": {"match": {args.field: text}}}
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            expanded = expand_query(query, fuzzy_indexes, max_expansions=args.max_expansions)
+        expand_time = (time.perf_counter() - start) / args.repeat
+        terms = [clause["match"][args.field]["query"] for clause in _should_clauses(expanded["query"])]
+        print(f"\n{text!r}: expanded in {expand_time * 1e6:.0f} us to {terms}")
+        search_documents(es, args.index, {**expanded, "size": 3}, f"fuzzy match for {text!r}")
+
+    for prefix in args.complete:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            suggestions = fuzzy_index.suggest(prefix)
+        suggest_time = (time.perf_counter() - start) / args.repeat
+        print(f"Completions of {prefix!r} in {suggest_time * 1e6:.1f} us: {suggestions}")
+
+if __name__ == "__main__":
+    main()
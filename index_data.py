@@ -1,13 +1,17 @@
+import argparse
+
 import pandas as pd
-from elasticsearch import Elasticsearch, helpers
+from elasticsearch import helpers
 from elasticsearch.helpers import BulkIndexError
 
+from documents import build_sources
+from es_pipeline import DEFAULT_ES_HOST, connect_es
+from index_settings import ARTICLES_SETTINGS
+
 # -------------------------------------------
 # Step 1: Load the dataset (first 1000 documents)
 # -------------------------------------------
 df = pd.read_csv("sample_data.csv")
-# Convert any NaN values to None (helps JSON serialization)
-df = df.where(pd.notnull(df), None)
 # Select the first 1000 rows (in case file has more)
 df = df.head(1000)
 print("Number of documents in sample:", len(df))
@@ -15,18 +19,11 @@ print("Number of documents in sample:", len(df))
 # -------------------------------------------
 # Step 2: Connect to Elasticsearch using HTTPS
 # -------------------------------------------
-# Replace the credentials with your actual username and password.
-es = Elasticsearch(
-    "https://localhost:9200",
-    basic_auth=("elastic", "password"),
-    verify_certs=False
-)
-
-# Test connection
-if not es.ping():
-    raise ValueError("Connection failed: Ensure Elasticsearch is running on https://localhost:9200")
-else:
-    print("Connected to Elasticsearch.")
+# The server is --host, else $ES_HOST, else DEFAULT_ES_HOST (see es_pipeline.connect_es).
+parser = argparse.ArgumentParser(description="Index the first 1000 rows of sample_data.csv into the articles index.")
+parser.add_argument("--host", default=None, help=f"Elasticsearch server (default: $ES_HOST or {DEFAULT_ES_HOST})")
+args = parser.parse_args()
+es = connect_es(host=args.host)
 
 # -------------------------------------------
 # Step 3: Create an index (delete if exists for a clean start)
@@ -37,22 +34,24 @@ if es.indices.exists(index=index_name):
     es.indices.delete(index=index_name)
     print(f"Deleted existing index: {index_name}")
 
-# Create the index with default settings (or add custom mapping if needed)
-es.indices.create(index=index_name)
+# Create the index with the typed survey mapping defined in index_settings.py
+# (keyword facets, scaled_float spend amounts, a date field), so aggregations.py can
+# run the spend analytics on the cluster.
+es.indices.create(index=index_name, body=ARTICLES_SETTINGS)
 print(f"Created index: {index_name}")
 
 # -------------------------------------------
 # Step 4: Prepare documents for bulk indexing
 # -------------------------------------------
-actions = []
-for i, row in df.iterrows():
-    doc = row.to_dict()
-    action = {
+# build_sources converts the DataFrame column by column (NaN becomes None for JSON serialization).
+actions = [
+    {
         "_index": index_name,
         "_id": i,  # Alternatively, use a unique field from your document
         "_source": doc
     }
-    actions.append(action)
+    for i, doc in zip(df.index.tolist(), build_sources(df))
+]
 
 # -------------------------------------------
 # Step 5: Bulk index the documents with error debugging
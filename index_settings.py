@@ -0,0 +1,181 @@
+# -------------------------------------------
+# Index settings used by the project's scripts
+# -------------------------------------------
+
+# es_pipeline.py: "custom_analyzer" performs
+# - Standard tokenization
+# - Lowercase (case folding)
+# - Stopword removal
+# - Porter stemming (for morphological analysis)
+PIPELINE_SETTINGS = {
+    "settings": {
+        "analysis": {
+            "analyzer": {
+                "custom_analyzer": {
+                    "type": "custom",
+                    "tokenizer": "standard",
+                    "filter": ["lowercase", "stop", "porter_stem"]
+                }
+            }
+        }
+    },
+    "mappings": {
+        "properties": {
+            "content": {
+                "type": "text",
+                "analyzer": "custom_analyzer"
+            }
+        }
+    }
+}
+
+# select_keywords.py: "keyword_selector" is defined to:
+# - Use the standard tokenizer
+# - Apply a lowercase filter (case folding)
+# - Apply a stop filter (remove common English stopwords)
+# - Apply a shingle filter to generate bigrams and trigrams (while outputting unigrams as well)
+# No similarity is configured, so the default BM25 (a TF-IDF variant) is used.
+KEYWORDS_SETTINGS = {
+    "settings": {
+        "analysis": {
+            "analyzer": {
+                "keyword_selector": {
+                    "type": "custom",
+                    "tokenizer": "standard",
+                    "filter": [
+                        "lowercase",
+                        "stop",       # removes common English stopwords
+                        "my_shingle"  # custom shingle filter for n-grams
+                    ]
+                }
+            },
+            "filter": {
+                "my_shingle": {
+                    "type": "shingle",
+                    "min_shingle_size": 2,
+                    "max_shingle_size": 3,
+                    "output_unigrams": True  # include original tokens too
+                }
+            }
+        }
+    },
+    "mappings": {
+        "properties": {
+            "content": {
+                "type": "text",
+                "analyzer": "keyword_selector"
+            }
+        }
+    }
+}
+
+# stemming_analysis.py: "stem_analyzer" uses:
+#   - "standard" tokenizer: splits text into tokens.
+#   - "lowercase" filter: converts tokens to lower case.
+#   - "porter_stem" filter: reduces tokens to their word stem.
+STEMMING_SETTINGS = {
+    "settings": {
+        "analysis": {
+            "analyzer": {
+                "stem_analyzer": {
+                    "type": "custom",
+                    "tokenizer": "standard",
+                    "filter": ["lowercase", "porter_stem"]
+                }
+            }
+        }
+    },
+    "mappings": {
+        "properties": {
+            "content": {
+                "type": "text",
+                "analyzer": "stem_analyzer"
+            }
+        }
+    }
+}
+
+# token_casefold.py: "my_lowercase_analyzer" uses:
+#   - "standard" tokenizer: splits text based on language-independent rules.
+#   - "lowercase" filter: performs case folding (converts tokens to lower case).
+TOKEN_SETTINGS = {
+    "settings": {
+        "analysis": {
+            "analyzer": {
+                "my_lowercase_analyzer": {
+                    "type": "custom",
+                    "tokenizer": "standard",
+                    "filter": ["lowercase"]
+                }
+            }
+        }
+    },
+    "mappings": {
+        "properties": {
+            "content": {
+                "type": "text",
+                "analyzer": "my_lowercase_analyzer"
+            }
+        }
+    }
+}
+
+# index_data.py: "articles" holds whole survey rows with an explicit typed mapping, so the spend
+# analytics run as aggregations on the cluster (see aggregations.py):
+#   - "subobjects": False keeps dotted column names (R.mth, travel_companion.1, f5_designation.oth)
+#     as flat fields; otherwise f5_designation would have to be both a keyword and an object.
+#   - Categorical columns are keyword fields; the most used facets load global ordinals eagerly
+#     at refresh, so the first terms aggregation after indexing does not pay for building them.
+#   - Spend amounts are scaled_float (stored as cents) with doc values but no search index:
+#     they are aggregated, never looked up.
+#   - Fields that are never aggregated or sorted on keep no doc values.
+# Columns not listed here (e.g. a "content" field) are still mapped dynamically.
+SURVEY_KEYWORD_FIELDS = [
+    "R.mth", "intv_nam", "Country_residence", "City_residence", "Purpose_grp", "Purpose",
+    "Air_Terminal", "Sea_Terminal", "Land_Terminal", "langint", "1st_visit", "length_stay",
+    "travel_type", "f1_gender", "f3_occupation", "f4_industry", "f5_designation", "MainAccomm",
+    "MainHotel", "travel_companion.1", "travel_companion.2", "travel_companion.3",
+    "travel_companion.4", "travel_companion.5",
+]
+SURVEY_FACET_FIELDS = ["Country_residence", "City_residence", "Purpose_grp", "MainAccomm"]
+SURVEY_SPEND_FIELDS = [
+    "shop_$fash", "shop_$jew", "shop_$wat", "shop_$well", "shop_$food", "shop_$gift", "shop_$ctec",
+    "shop_$anti", "shop_$oth", "shop_$any", "totacc_$", "totfnb_$", "tottran_$", "totbiz_$",
+    "totedu_$", "totmedi_$", "tototh_$", "totshopping_$", "totexp_$",
+]
+
+SURVEY_PROPERTIES = {
+    **{field: {"type": "keyword"} for field in SURVEY_KEYWORD_FIELDS},
+    **{field: {"type": "keyword", "eager_global_ordinals": True} for field in SURVEY_FACET_FIELDS},
+    **{field: {"type": "scaled_float", "scaling_factor": 100, "index": False} for field in SURVEY_SPEND_FIELDS},
+    "case": {"type": "integer"},
+    "Year": {"type": "short"},
+    "date": {"type": "date", "format": "strict_date_optional_time||yyyy-MM-dd HH:mm:ss"},
+    "intv_nam": {"type": "keyword", "doc_values": False},
+    "Weights_QTR": {"type": "float", "index": False},
+    "f5_designation.oth": {
+        "type": "text",
+        "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}
+    },
+}
+
+ARTICLES_SETTINGS = {
+    "mappings": {
+        "subobjects": False,
+        "properties": SURVEY_PROPERTIES
+    }
+}
+
+# -------------------------------------------
+# Index registry
+# -------------------------------------------
+# Every index the scripts build, with its settings and the documents it holds:
+# "source" documents are whole survey rows (as in index_data.py) and "content"
+# documents have the single combined "content" field (as in es_pipeline.py).
+INDEX_REGISTRY = {
+    "articles": {"settings": ARTICLES_SETTINGS, "documents": "source"},
+    "articles_pipeline": {"settings": PIPELINE_SETTINGS, "documents": "content"},
+    "articles_keywords": {"settings": KEYWORDS_SETTINGS, "documents": "content"},
+    "articles_stemming": {"settings": STEMMING_SETTINGS, "documents": "content"},
+    "articles_token": {"settings": TOKEN_SETTINGS, "documents": "content"},
+}
@@ -0,0 +1,332 @@
+import cProfile
+import functools
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+# Stage-level measurements for the pipeline: wall time per stage, per-chunk read/build/bulk timings,
+# latency and payload bytes of every bulk request, indexing throughput, Elasticsearch "took" next to client-side search latency,
+# and peak RSS. Recording is off until PipelineMetrics.configure(enabled=True) is called (es_pipeline
+# does this for its --metrics-* flags); optionally each stage is also profiled with cProfile and
+# tracemalloc. Results are written as a JSON report and in the Prometheus text exposition format.
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+def peak_rss_bytes():
+    """
+    Returns the peak resident set size of this process in bytes (ru_maxrss is in KiB on Linux, bytes on macOS).
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _summary(values):
+    """
+    Returns count, sum, mean, quantiles and max of a list of durations in seconds.
+    """
+    if not values:
+        return {"count": 0, "sum": 0.0}
+    array = np.asarray(values, dtype=float)
+    summary = {"count": len(array), "sum": float(array.sum()), "mean": float(array.mean()),
+               "max": float(array.max())}
+    for quantile, value in zip(QUANTILES, np.quantile(array, QUANTILES)):
+        summary[f"p{int(quantile * 100)}"] = float(value)
+    return summary
+
+class TimedIterator:
+    """
+    Wraps an iterator and adds up the time spent producing its items, e.g. the time a bulk helper
+    spends pulling actions from a generator.
+    """
+
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return next(self.iterator)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+class PipelineMetrics:
+    """
+    Collects the measurements of one pipeline run.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.profile_dir = None
+        self.trace_memory = False
+        self.reset()
+
+    def configure(self, enabled=True, profile_dir=None, trace_memory=False):
+        """
+        Turns recording on or off. With profile_dir set, every stage is also run under cProfile and its
+        statistics are written to <profile_dir>/<stage>.prof; with trace_memory, tracemalloc records the
+        peak Python heap of each stage.
+        """
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        if enabled and trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def reset(self):
+        self.stages = {}
+        self.chunks = []
+        self.bulks = []
+        self.searches = []
+        self._profiles = {}
+        self._active = []
+        self._profiling = False
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measures the wall time of a block as one call of a stage.
+        Nested stages are measured separately; only the outermost stage running is profiled, so
+        its profile includes the stages nested in it.
+        """
+        if not self.enabled:
+            yield
+            return
+        profile = None
+        if self.profile_dir and not self._profiling:
+            profile = self._profiles.setdefault(name, cProfile.Profile())
+            self._profiling = True
+            profile.enable()
+        frame = {"traced_peak": 0}
+        self._active.append(frame)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+            self._active.pop()
+            stats = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+            stats["calls"] += 1
+            stats["seconds"] += elapsed
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+            stats["peak_rss_bytes"] = peak_rss_bytes()
+            if self.trace_memory:
+                # reset_peak() in a nested stage hides earlier allocations from this one, so the
+                # peaks of finished nested stages are carried up to their parent.
+                traced_peak = max(tracemalloc.get_traced_memory()[1], frame["traced_peak"])
+                stats["traced_peak_bytes"] = max(stats.get("traced_peak_bytes", 0), traced_peak)
+                if self._active:
+                    self._active[-1]["traced_peak"] = max(self._active[-1]["traced_peak"], traced_peak)
+
+    def timed(self, name):
+        """
+        Decorator that runs a function as a stage.
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record_chunk(self, index_name, documents, read_seconds, build_seconds, bulk_seconds, failed=0):
+        """
+        Records one chunk of index_documents: the time spent reading it from the source, building its
+        documents and sending its bulk requests (less the time spent building the actions they pull).
+        """
+        if not self.enabled:
+            return
+        self.chunks.append({"index": index_name, "documents": documents, "failed": failed,
+                            "read_seconds": read_seconds, "build_seconds": build_seconds,
+                            "bulk_seconds": bulk_seconds})
+
+    def record_bulk(self, index_name, documents, payload_bytes, seconds, failed=0):
+        """
+        Records one bulk request: its documents, the size of its body and its latency.
+        """
+        if not self.enabled:
+            return
+        self.bulks.append({"index": index_name, "documents": documents, "failed": failed,
+                           "bytes": payload_bytes, "seconds": seconds})
+
+    def watch_bulk_requests(self, es):
+        """
+        Wraps the perform_request of an Elasticsearch client's transport so that every _bulk request
+        (from helpers.streaming_bulk, parallel_bulk or es.bulk) is recorded while recording is on.
+        The bytes are those of the body the helpers serialized, so nothing is serialized twice.
+        The transport is shared by the clients es.options() returns, and is wrapped only once.
+        """
+        transport = getattr(es, "transport", None)
+        if transport is None or getattr(transport, "_bulk_metrics", False):
+            return
+        perform_request = transport.perform_request
+
+        @functools.wraps(perform_request)
+        def wrapper(method, target, *args, **kwargs):
+            if not self.enabled or not target.split("?", 1)[0].endswith("/_bulk"):
+                return perform_request(method, target, *args, **kwargs)
+            start = time.perf_counter()
+            response = perform_request(method, target, *args, **kwargs)
+            seconds = time.perf_counter() - start
+            body = kwargs.get("body")
+            if isinstance(body, (list, tuple)):
+                payload_bytes = sum(len(line if isinstance(line, bytes) else line.encode("utf-8")) + 1
+                                    for line in body)
+            else:
+                payload_bytes = len(body) if isinstance(body, (bytes, str)) else 0
+            items = [next(iter(item.values())) for item in response.body.get("items", [])] \
+                if isinstance(response.body, dict) else []
+            index_name = items[0].get("_index") if items else None
+            self.record_bulk(index_name, len(items), payload_bytes, seconds,
+                             sum(1 for item in items if "error" in item))
+            return response
+
+        transport.perform_request = wrapper
+        transport._bulk_metrics = True
+
+    def record_search(self, index_name, description, response, seconds):
+        """
+        Records one search: the server-side "took" next to the latency measured by the client.
+        """
+        if not self.enabled:
+            return
+        self.searches.append({"index": index_name, "description": description,
+                              "took_seconds": response["took"] / 1000, "client_seconds": seconds,
+                              "hits": response["hits"]["total"]["value"]})
+
+    def report(self):
+        """
+        Returns every measurement as a JSON-serializable dict.
+        """
+        documents = sum(chunk["documents"] for chunk in self.chunks)
+        bulk_seconds = sum(chunk["bulk_seconds"] for chunk in self.chunks)
+        chunk_seconds = sum(chunk["read_seconds"] + chunk["build_seconds"] + chunk["bulk_seconds"]
+                            for chunk in self.chunks)
+        return {
+            "stages": self.stages,
+            "indexing": {
+                "chunks": len(self.chunks),
+                "documents": documents,
+                "failed": sum(chunk["failed"] for chunk in self.chunks),
+                "bulk_requests": len(self.bulks),
+                "bytes": sum(bulk["bytes"] for bulk in self.bulks),
+                "read_seconds": sum(chunk["read_seconds"] for chunk in self.chunks),
+                "build_seconds": sum(chunk["build_seconds"] for chunk in self.chunks),
+                "bulk_seconds": bulk_seconds,
+                "docs_per_second": documents / chunk_seconds if chunk_seconds else 0.0,
+                "bulk_docs_per_second": documents / bulk_seconds if bulk_seconds else 0.0,
+                "bulk_latency": _summary([bulk["seconds"] for bulk in self.bulks]),
+            },
+            "search": {
+                "took": _summary([search["took_seconds"] for search in self.searches]),
+                "client": _summary([search["client_seconds"] for search in self.searches]),
+            },
+            "peak_rss_bytes": peak_rss_bytes(),
+            "chunk_details": self.chunks,
+            "bulk_details": self.bulks,
+            "search_details": self.searches,
+        }
+
+    def write_json(self, report_file):
+        with open(report_file, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+        print(f"Wrote metrics report to {report_file}")
+
+    def prometheus_text(self):
+        """
+        Returns the measurements in the Prometheus text exposition format (e.g. for the node_exporter
+        textfile collector).
+        """
+        report = self.report()
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        def summary(name, help_text, values):
+            samples = [({"quantile": str(quantile)}, values.get(f"p{int(quantile * 100)}", "NaN"))
+                       for quantile in QUANTILES]
+            metric(name, "summary", help_text, samples)
+            lines.append(f"{name}_sum {values['sum']}")
+            lines.append(f"{name}_count {values['count']}")
+
+        stages = report["stages"]
+        metric("pipeline_stage_seconds_total", "counter", "Wall time spent in each pipeline stage.",
+               [({"stage": name}, stats["seconds"]) for name, stats in stages.items()])
+        metric("pipeline_stage_calls_total", "counter", "Number of times each pipeline stage ran.",
+               [({"stage": name}, stats["calls"]) for name, stats in stages.items()])
+        indexing = report["indexing"]
+        metric("pipeline_indexed_documents_total", "counter", "Documents sent in bulk requests.",
+               [({}, indexing["documents"])])
+        metric("pipeline_failed_documents_total", "counter", "Documents rejected by bulk requests.",
+               [({}, indexing["failed"])])
+        metric("pipeline_bulk_bytes_total", "counter", "Size of the bulk request bodies sent.",
+               [({}, indexing["bytes"])])
+        metric("pipeline_chunk_phase_seconds_total", "counter", "Time spent per phase of index_documents.",
+               [({"phase": phase}, indexing[f"{phase}_seconds"]) for phase in ("read", "build", "bulk")])
+        metric("pipeline_docs_per_second", "gauge", "Indexing throughput over read, build and bulk time.",
+               [({}, indexing["docs_per_second"])])
+        metric("pipeline_bulk_requests_total", "counter", "Bulk requests sent.", [({}, indexing["bulk_requests"])])
+        summary("pipeline_bulk_request_seconds", "Latency of each bulk request.", indexing["bulk_latency"])
+        summary("pipeline_search_took_seconds", "Search time reported by Elasticsearch.", report["search"]["took"])
+        summary("pipeline_search_client_seconds", "Search latency measured by the client.",
+                report["search"]["client"])
+        metric("pipeline_peak_rss_bytes", "gauge", "Peak resident set size of the process.",
+               [({}, report["peak_rss_bytes"])])
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, metrics_file):
+        tmp_file = f"{metrics_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        # The textfile collector may read at any time, so the file is replaced atomically.
+        os.replace(tmp_file, metrics_file)
+        print(f"Wrote Prometheus metrics to {metrics_file}")
+
+    def write_profiles(self):
+        """
+        Writes the cProfile statistics of each profiled stage to <profile_dir>/<stage>.prof.
+        """
+        if not self.profile_dir:
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        for name, profile in self._profiles.items():
+            profile.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
+        print(f"Wrote {len(self._profiles)} stage profile(s) to {self.profile_dir}")
+
+    def print_summary(self):
+        report = self.report()
+        print("\nStage timings:")
+        for name, stats in report["stages"].items():
+            print(f"  {name}: {stats['seconds']:.3f}s over {stats['calls']} call(s)")
+        indexing = report["indexing"]
+        if indexing["chunks"]:
+            print(f"Indexing: {indexing['documents']} documents, {indexing['bulk_requests']} bulk requests "
+                  f"of {indexing['bytes']} bytes, "
+                  f"read {indexing['read_seconds']:.3f}s, build {indexing['build_seconds']:.3f}s, "
+                  f"bulk {indexing['bulk_seconds']:.3f}s ({indexing['docs_per_second']:.0f} docs/s)")
+        for search in report["search_details"]:
+            print(f"  {search['description']}: took {search['took_seconds'] * 1000:.1f} ms, "
+                  f"client {search['client_seconds'] * 1000:.1f} ms")
+        print(f"Peak RSS: {report['peak_rss_bytes'] / 2 ** 20:.1f} MiB")
+
+# Shared by every module of the pipeline.
+metrics = PipelineMetrics()
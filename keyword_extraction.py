@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from analysis import build_analyzer
+from documents import build_content
+from es_pipeline import DEFAULT_CHUNK_SIZE, iter_source_chunks
+from index_settings import KEYWORDS_SETTINGS
+from local_engine import BM25_B, BM25_K1
+
+# Corpus-wide keyword selection with the "keyword_selector" analyzer of select_keywords.py
+# (lowercase, stop words, unigrams plus 2-3 word shingles): the top-k unigrams, bigrams and trigrams
+# of the whole corpus and of every value of a facet column (e.g. Country_residence), weighted by
+# TF-IDF or BM25. Shards of rows are analyzed and counted into sparse matrices in a process pool;
+# the parent merges the per-shard counts, so memory is bounded by the vocabulary, not the corpus.
+
+KEYWORD_ANALYZER_NAME = "keyword_selector"
+FILLER_TOKEN = "_"
+MISSING_FACET = "(missing)"
+DEFAULT_TOP_K = 20
+DEFAULT_MIN_DF = 2
+DEFAULT_MAX_VOCABULARY = 2000000
+NUMERIC_TERM = re.compile(r"[\d.,:\-_ ]+")
+
+_analyzer = None
+
+def _shard_analyzer():
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = build_analyzer(KEYWORD_ANALYZER_NAME, KEYWORDS_SETTINGS)
+    return _analyzer
+
+def text_columns(df, exclude=()):
+    """
+    Returns the text columns of the survey data (everything that is not a number or a date), without exclude.
+    """
+    return [column for column in df.columns
+            if column not in exclude
+            and not pd.api.types.is_numeric_dtype(df[column])
+            and not pd.api.types.is_datetime64_any_dtype(df[column])]
+
+def count_shard(texts, facet_values, k1=BM25_K1, b=BM25_B):
+    """
+    Analyzes a shard of documents and returns its counts per facet value over a shard-local vocabulary:
+    (terms, facet keys, number of documents per facet, term frequencies, document frequencies,
+    BM25-saturated term frequencies), the last three as facets x terms sparse matrices.
+    Shingles that contain a filler token (a gap left by a removed stop word) are skipped.
+    BM25 length normalization uses the average document length of the shard.
+    """
+    analyzer = _shard_analyzer()
+    vocabulary = {}
+    indices = []
+    indptr = [0]
+    for text in texts:
+        for term in analyzer.terms(text):
+            if FILLER_TOKEN in term and FILLER_TOKEN in term.split(" "):
+                continue
+            indices.append(vocabulary.setdefault(term, len(vocabulary)))
+        indptr.append(len(indices))
+
+    counts = sparse.csr_matrix((np.ones(len(indices), dtype=np.float64), indices, indptr),
+                               shape=(len(texts), len(vocabulary)))
+    counts.sum_duplicates()
+    lengths = np.diff(np.asarray(indptr))
+    average_length = lengths.mean() if len(lengths) and lengths.mean() else 1.0
+    rows = np.repeat(np.arange(len(texts)), np.diff(counts.indptr))
+    norms = k1 * (1 - b + b * lengths[rows] / average_length)
+    saturated = counts.copy()
+    saturated.data = counts.data * (k1 + 1) / (counts.data + norms)
+    present = counts.copy()
+    present.data = np.ones_like(present.data)
+
+    codes, keys = pd.factorize(pd.Series(facet_values, dtype=object).fillna(MISSING_FACET))
+    membership = sparse.csr_matrix((np.ones(len(codes)), (codes, np.arange(len(codes)))),
+                                   shape=(len(keys), len(texts)))
+    return (list(vocabulary), [str(key) for key in keys], np.bincount(codes, minlength=len(keys)),
+            (membership @ counts).tocoo(), (membership @ present).tocoo(), (membership @ saturated).tocoo())
+
+class KeywordCounts:
+    """
+    Accumulates the shard counts of count_shard under one global vocabulary and facet list.
+    """
+
+    def __init__(self, max_vocabulary=DEFAULT_MAX_VOCABULARY):
+        self.max_vocabulary = max_vocabulary
+        self.vocabulary = {}
+        self.facets = {}
+        self.documents = np.zeros(0, dtype=np.int64)
+        self._parts = []
+        self._pending = 0
+        self.matrices = None
+
+    def add(self, shard):
+        terms, facet_keys, documents, *matrices = shard
+        term_ids = np.fromiter((self.vocabulary.setdefault(term, len(self.vocabulary)) for term in terms),
+                               dtype=np.int64, count=len(terms))
+        facet_ids = np.fromiter((self.facets.setdefault(key, len(self.facets)) for key in facet_keys),
+                                dtype=np.int64, count=len(facet_keys))
+        if len(self.facets) > len(self.documents):
+            self.documents = np.concatenate([self.documents, np.zeros(len(self.facets) - len(self.documents),
+                                                                      dtype=np.int64)])
+        np.add.at(self.documents, facet_ids, documents)
+        self._parts.append([(facet_ids[matrix.row], term_ids[matrix.col], matrix.data) for matrix in matrices])
+        self._pending += matrices[0].nnz
+        # Merging sums duplicate (facet, term) cells, so memory follows the vocabulary, not the shard count.
+        if self._pending > 4 * max(len(self.vocabulary), 1000000):
+            self._merge()
+        if len(self.vocabulary) > self.max_vocabulary:
+            self._prune()
+
+    def _merge(self):
+        shape = (len(self.facets), len(self.vocabulary))
+        merged = []
+        for measure in range(3):
+            parts = [part[measure] for part in self._parts]
+            if self.matrices is not None:
+                previous = self.matrices[measure].tocoo()
+                parts.append((previous.row, previous.col, previous.data))
+            rows, cols, data = (np.concatenate(values) for values in zip(*parts)) if parts else ([], [], [])
+            merged.append(sparse.csr_matrix((data, (rows, cols)), shape=shape))
+        self.matrices = merged
+        self._parts = []
+        self._pending = 0
+
+    def _prune(self):
+        """
+        Keeps the vocabulary within max_vocabulary by dropping the terms seen in only one document so far.
+        Frequent terms are never dropped, so the top keywords are not affected in practice.
+        """
+        self._merge()
+        document_frequency = np.asarray(self.matrices[1].sum(axis=0)).ravel()
+        keep = np.flatnonzero(document_frequency > 1)
+        terms = list(self.vocabulary)
+        self.vocabulary = {terms[i]: new_id for new_id, i in enumerate(keep)}
+        self.matrices = [matrix[:, keep].tocsr() for matrix in self.matrices]
+        print(f"Pruned the vocabulary to {len(self.vocabulary)} terms.")
+
+    def top_keywords(self, top_k=DEFAULT_TOP_K, weighting="bm25", min_df=DEFAULT_MIN_DF, keep_numbers=False):
+        """
+        Returns {"overall": {n: rows}, "facets": {facet: {n: rows}}} with the top_k n-grams of each order n
+        (1 to 3), where rows are dicts of term, score, tf and df. TF-IDF scores are tf * idf with a
+        smoothed idf; BM25 scores are the sum of the term's BM25 scores over all documents.
+        idf is computed over all documents in both cases.
+        """
+        self._merge()
+        tf, df, saturated = self.matrices
+        total_documents = int(self.documents.sum())
+        document_frequency = np.asarray(df.sum(axis=0)).ravel()
+        if weighting == "tfidf":
+            idf = np.log((1 + total_documents) / (1 + document_frequency)) + 1
+            weights = tf
+        elif weighting == "bm25":
+            idf = np.log(1 + (total_documents - document_frequency + 0.5) / (document_frequency + 0.5))
+            weights = saturated
+        else:
+            raise ValueError(f"Unknown weighting: {weighting} (expected tfidf or bm25)")
+
+        terms = np.array(list(self.vocabulary), dtype=object)
+        orders = np.fromiter((term.count(" ") + 1 for term in terms), dtype=np.int64, count=len(terms))
+        allowed = document_frequency >= min_df
+        if not keep_numbers:
+            allowed &= np.fromiter((NUMERIC_TERM.fullmatch(term) is None for term in terms), dtype=bool,
+                                   count=len(terms))
+
+        def ranked(term_ids, scores, term_tf, term_df):
+            result = {}
+            for order in (1, 2, 3):
+                mask = allowed[term_ids] & (orders[term_ids] == order)
+                candidates = np.flatnonzero(mask)
+                if len(candidates) > top_k:
+                    candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+                candidates = candidates[np.lexsort((terms[term_ids[candidates]].astype(str), -scores[candidates]))]
+                result[order] = [{"term": terms[term_ids[i]], "score": float(scores[i]), "tf": int(term_tf[i]),
+                                  "df": int(term_df[i])} for i in candidates]
+            return result
+
+        all_terms = np.arange(len(terms))
+        overall = ranked(all_terms, np.asarray(weights.sum(axis=0)).ravel() * idf,
+                         np.asarray(tf.sum(axis=0)).ravel(), document_frequency)
+        facets = {}
+        for facet, row in self.facets.items():
+            start, end = tf.indptr[row], tf.indptr[row + 1]
+            term_ids = tf.indices[start:end]
+            facets[facet] = ranked(term_ids, weights[row].toarray().ravel()[term_ids] * idf[term_ids],
+                                   tf.data[start:end], df.data[start:end])
+        return {"documents": total_documents, "overall": overall, "facets": facets,
+                "facet_documents": {facet: int(self.documents[row]) for facet, row in self.facets.items()}}
+
+def extract_keywords(source_file, facet=None, columns=None, top_k=DEFAULT_TOP_K, weighting="bm25",
+                     workers=None, chunk_size=DEFAULT_CHUNK_SIZE, limit=None, min_df=DEFAULT_MIN_DF,
+                     keep_numbers=False, max_vocabulary=DEFAULT_MAX_VOCABULARY):
+    """
+    Selects the top keywords of a CSV file or workbook, overall and per value of the facet column.
+    The text of a row is its columns (text_columns by default, without the facet column) joined by spaces,
+    as in es_pipeline. Chunks of chunk_size rows are counted by count_shard in a pool of workers processes,
+    with at most two chunks per worker in flight.
+    """
+    workers = workers or os.cpu_count() or 1
+    counts = KeywordCounts(max_vocabulary)
+    start = time.perf_counter()
+    rows = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in iter_source_chunks(source_file, chunk_size, limit):
+            chunk_columns = columns or text_columns(chunk, exclude=[facet])
+            texts = build_content(chunk.drop(columns=["content"], errors="ignore"), chunk_columns).tolist()
+            facet_values = chunk[facet].tolist() if facet else [MISSING_FACET] * len(chunk)
+            pending.append(executor.submit(count_shard, texts, facet_values))
+            rows += len(chunk)
+            while len(pending) >= 2 * workers:
+                counts.add(pending.popleft().result())
+        while pending:
+            counts.add(pending.popleft().result())
+    print(f"Counted {rows} rows into {len(counts.vocabulary)} terms in {time.perf_counter() - start:.2f}s "
+          f"with {workers} worker(s).")
+    return counts.top_keywords(top_k, weighting, min_df, keep_numbers)
+
+def print_keywords(keywords, facet=None, top_k=10):
+    names = {1: "Unigrams", 2: "Bigrams", 3: "Trigrams"}
+
+    def show(title, ranked):
+        print(f"\n{title}")
+        for order, rows in ranked.items():
+            terms = ", ".join(f"{row['term']} ({row['score']:.1f})" for row in rows[:top_k])
+            print(f"  {names[order]}: {terms}")
+
+    show(f"Top keywords of {keywords['documents']} documents:", keywords["overall"])
+    if facet:
+        for value, ranked in keywords["facets"].items():
+            show(f"{facet} = {value} ({keywords['facet_documents'][value]} documents):", ranked)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Select the top keywords and n-grams of the survey corpus.")
+    parser.add_argument("--source", default="sample_data.csv", help="CSV file or Excel workbook")
+    parser.add_argument("--facet", default="Country_residence", help="column to select keywords per value of ('' for none)")
+    parser.add_argument("--columns", nargs="+", default=None, help="text columns (default: every non-numeric column)")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K, help="keywords per n-gram order")
+    parser.add_argument("--weighting", choices=["bm25", "tfidf"], default="bm25")
+    parser.add_argument("--min-df", type=int, default=DEFAULT_MIN_DF, help="minimum document frequency")
+    parser.add_argument("--keep-numbers", action="store_true", help="keep terms made only of digits and punctuation")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per shard")
+    parser.add_argument("--limit", type=int, default=0, help="maximum rows to read (0 reads every row)")
+    parser.add_argument("--max-vocabulary", type=int, default=DEFAULT_MAX_VOCABULARY,
+                        help="terms kept in memory before singleton terms are pruned")
+    parser.add_argument("--output", default=None, help="write the keywords as JSON to this file")
+    args = parser.parse_args(argv)
+
+    keywords = extract_keywords(args.source, args.facet or None, args.columns, args.top_k, args.weighting,
+                                args.workers, args.chunk_size, args.limit or None, args.min_df, args.keep_numbers,
+                                args.max_vocabulary)
+    print_keywords(keywords, args.facet or None)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(keywords, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
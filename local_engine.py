@@ -0,0 +1,903 @@
+import base64
+import math
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from fnmatch import fnmatchcase
+
+from analysis import KEYWORD_ANALYZER, STANDARD_ANALYZER, build_analyzer
+from doc_store import DocumentStore
+
+# Elasticsearch's default BM25 parameters.
+BM25_K1 = 1.2
+BM25_B = 0.75
+DEFAULT_SIZE = 10
+DEFAULT_PERCENTS = [1.0, 5.0, 25.0, 50.0, 75.0, 95.0, 99.0]
+
+# Field types whose string values are put in the inverted index; other mapped types
+# (numbers, dates) are only read from the stored source, like doc values.
+INDEXED_STRING_TYPES = (None, "text", "keyword")
+
+def new_doc_id():
+    """
+    Returns a random 22-character URL-safe id for a document indexed without one, like the ids
+    Elasticsearch generates; it cannot collide with the explicit ids of the other documents.
+    """
+    return base64.urlsafe_b64encode(uuid.uuid4().bytes).rstrip(b"=").decode("ascii")
+
+def parse_date(value):
+    """
+    Returns a date field value (ISO string, "yyyy-MM-dd HH:mm:ss" string or datetime) as a UTC datetime.
+    """
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+def _epoch_millis(value):
+    return int(value.timestamp() * 1000)
+
+def filter_source(source, source_filter):
+    """
+    Applies a search body's "_source" option: False, a field pattern, a list of patterns,
+    or {"includes": [...], "excludes": [...]}. Returns a new dict, or None when the source is disabled.
+    """
+    if source_filter is None or source_filter is True:
+        return dict(source)
+    if source_filter is False:
+        return None
+    if isinstance(source_filter, dict):
+        includes = source_filter.get("includes", source_filter.get("include", []))
+        excludes = source_filter.get("excludes", source_filter.get("exclude", []))
+    else:
+        includes, excludes = source_filter, []
+    includes = [includes] if isinstance(includes, str) else list(includes)
+    excludes = [excludes] if isinstance(excludes, str) else list(excludes)
+    return {
+        field: value for field, value in source.items()
+        if (not includes or any(fnmatchcase(field, pattern) for pattern in includes))
+        and not any(fnmatchcase(field, pattern) for pattern in excludes)
+    }
+
+class LocalIndex:
+    """
+    A positional inverted index over the string fields of one index's documents.
+    postings[field][term] maps each document ordinal to the positions of term in that field.
+    The sources are kept column by column in a doc_store.DocumentStore and read back as row views.
+    """
+
+    def __init__(self, name, body=None):
+        self.name = name
+        self.body = body or {}
+        self.ids = []
+        self.sources = DocumentStore()
+        self.id_to_doc = {}
+        self.postings = defaultdict(lambda: defaultdict(dict))
+        self.field_lengths = defaultdict(dict)
+        self.field_totals = defaultdict(int)
+        self.analyzers = {}
+
+    def field_mapping(self, field):
+        """
+        Returns the mapping of a field (e.g. {"type": "keyword"}), including multi-fields such as
+        "name.keyword", or {} for a dynamically mapped field.
+        """
+        properties = self.body.get("mappings", {}).get("properties", {})
+        if field in properties:
+            return properties[field]
+        base, _, subfield = field.rpartition(".")
+        return properties.get(base, {}).get("fields", {}).get(subfield, {})
+
+    def analyzer_for(self, field):
+        """
+        Returns the analyzer of a field: "keyword" for keyword fields, otherwise the one named
+        in the mappings, or "standard".
+        """
+        mapping = self.field_mapping(field)
+        if mapping.get("type") == "keyword":
+            return KEYWORD_ANALYZER
+        return self.analyzer(mapping.get("analyzer", "standard"))
+
+    def analyzer(self, name):
+        """
+        Returns the analysis.Analyzer defined under name in the index settings.
+        """
+        if name not in self.analyzers:
+            self.analyzers[name] = build_analyzer(name, self.body.get("settings"))
+        return self.analyzers[name]
+
+    def _text_fields(self, source, prefix=""):
+        """
+        Yields the (field, text) pairs of a document that go into the inverted index:
+        strings of text, keyword and unmapped fields, and of their multi-fields.
+        """
+        for key, value in source.items():
+            field = f"{prefix}{key}"
+            if isinstance(value, dict):
+                yield from self._text_fields(value, f"{field}.")
+            elif isinstance(value, str):
+                mapping = self.field_mapping(field)
+                if mapping.get("type") in INDEXED_STRING_TYPES and mapping.get("index", True):
+                    yield field, value
+                for subfield in mapping.get("fields", {}):
+                    yield f"{field}.{subfield}", value
+
+    def index(self, doc_id, source):
+        """
+        Adds or replaces a document. Returns "created" or "updated" like the bulk API.
+        """
+        doc_id = str(doc_id)
+        result = "updated" if self.delete(doc_id) else "created"
+        doc = len(self.ids)
+        self.ids.append(doc_id)
+        self.sources.append(source)
+        self.id_to_doc[doc_id] = doc
+        for field, text in self._text_fields(source):
+            tokens = self.analyzer_for(field)(text)
+            postings = self.postings[field]
+            for token, position, _, _ in tokens:
+                postings[token].setdefault(doc, []).append(position)
+            self.field_lengths[field][doc] = len(tokens)
+            self.field_totals[field] += len(tokens)
+        return result
+
+    def delete(self, doc_id):
+        """
+        Removes a document from the index. Returns False if the id is unknown.
+        """
+        doc = self.id_to_doc.pop(str(doc_id), None)
+        if doc is None:
+            return False
+        for field, text in self._text_fields(self.sources[doc]):
+            postings = self.postings[field]
+            for token, _, _, _ in self.analyzer_for(field)(text):
+                docs = postings.get(token)
+                if docs is not None and docs.pop(doc, None) is not None and not docs:
+                    del postings[token]
+            self.field_totals[field] -= self.field_lengths[field].pop(doc)
+        self.sources.delete(doc)
+        return True
+
+    def doc_count(self, field=None):
+        """
+        Returns the number of live documents, or of live documents that have the field.
+        """
+        if field is None:
+            return len(self.id_to_doc)
+        return len(self.field_lengths.get(field, ()))
+
+    def avg_field_length(self, field):
+        count = self.doc_count(field)
+        return self.field_totals[field] / count if count else 0.0
+
+    def field_length(self, field, doc):
+        return self.field_lengths[field][doc]
+
+    def term_postings(self, field, term):
+        """
+        Returns {doc: positions} for a term, or an empty dict.
+        """
+        return self.postings.get(field, {}).get(term, {})
+
+    def get_source(self, doc):
+        return self.sources[doc]
+
+    def doc_value(self, doc, field):
+        """
+        Returns the value of a field in a document (None if missing), as read by term-level
+        queries and aggregations. A multi-field such as "name.keyword" reads its parent field.
+        """
+        source = self.sources[doc]
+        if field in source:
+            return source[field]
+        base, _, subfield = field.rpartition(".")
+        if subfield in self.field_mapping(base).get("fields", {}):
+            return source.get(base)
+        return None
+
+    # Hooks for indices that are not a single in-memory LocalIndex (see lsm_index.LSMIndex).
+
+    def searcher(self):
+        """
+        Returns the reader searches run against: the index itself, whose writes are visible immediately.
+        """
+        return self
+
+    def refresh(self):
+        pass
+
+    def force_merge(self, max_num_segments=None):
+        pass
+
+    def auto_id(self):
+        """
+        Returns the id of a document indexed without one.
+        """
+        return new_doc_id()
+
+    def drop(self):
+        """
+        Releases the resources of a deleted index.
+        """
+
+class LocalIndicesClient:
+    """
+    The subset of Elasticsearch's indices client used by this project.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def exists(self, index):
+        return index in self.engine.indexes or index in self.engine.aliases
+
+    def create(self, index, body=None, settings=None, mappings=None):
+        if index in self.engine.indexes or index in self.engine.aliases:
+            raise ValueError(f"Index already exists: {index}")
+        body = dict(body or {})
+        if settings is not None:
+            body["settings"] = settings
+        if mappings is not None:
+            body["mappings"] = mappings
+        self.engine.indexes[index] = self.engine.index_class(index, body)
+        return {"acknowledged": True, "index": index}
+
+    def delete(self, index):
+        local_index = self.engine.indexes.pop(index, None)
+        if local_index is None:
+            raise ValueError(f"No such index: {index}")
+        local_index.drop()
+        for indexes in self.engine.aliases.values():
+            indexes.discard(index)
+        self.engine.aliases = {alias: indexes for alias, indexes in self.engine.aliases.items() if indexes}
+        return {"acknowledged": True}
+
+    def get(self, index):
+        """
+        Returns the settings, mappings and aliases of the indices matching a name or wildcard pattern.
+        """
+        return {
+            name: {
+                "aliases": self.get_alias(index=name).get(name, {}).get("aliases", {}),
+                "mappings": local_index.body.get("mappings", {}),
+                "settings": local_index.body.get("settings", {}),
+            }
+            for name, local_index in self.engine.indexes.items()
+            if fnmatchcase(name, index)
+        }
+
+    def put_settings(self, index, settings=None, body=None):
+        """
+        Merges dynamic index settings (e.g. refresh_interval) into the stored index body.
+        A LocalIndex makes documents searchable immediately, so they have no other effect on it
+        (lsm_index.LSMIndex reads refresh_interval).
+        """
+        settings = settings if settings is not None else body
+        stored = self.engine.get_index(index).body.setdefault("settings", {}).setdefault("index", {})
+        stored.update(settings.get("index", settings))
+        return {"acknowledged": True}
+
+    def _resolve(self, index):
+        """
+        Returns the indices named by index (a name, an alias, a comma-separated list or None for all of them).
+        """
+        if index is None:
+            return list(self.engine.indexes.values())
+        names = index.split(",") if isinstance(index, str) else index
+        return [self.engine.get_index(name) for name in names]
+
+    def forcemerge(self, index=None, max_num_segments=None):
+        for local_index in self._resolve(index):
+            local_index.force_merge(max_num_segments)
+        return {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+    def exists_alias(self, name, index=None):
+        indexes = self.engine.aliases.get(name, set())
+        return bool(indexes) and (index is None or index in indexes)
+
+    def get_alias(self, name=None, index=None):
+        result = {}
+        for alias, indexes in self.engine.aliases.items():
+            if name is not None and alias != name:
+                continue
+            for alias_index in indexes:
+                if index is None or alias_index == index:
+                    result.setdefault(alias_index, {"aliases": {}})["aliases"][alias] = {}
+        if name is not None and not result:
+            raise ValueError(f"Alias not found: {name}")
+        return result
+
+    def update_aliases(self, actions=None, body=None):
+        """
+        Applies add, remove and remove_index actions atomically: all are checked before any is applied.
+        """
+        actions = actions if actions is not None else body["actions"]
+        aliases = {alias: set(indexes) for alias, indexes in self.engine.aliases.items()}
+        removed_indexes = []
+        for action in actions:
+            (action_type, params), = action.items()
+            index = params["index"]
+            if index not in self.engine.indexes or index in removed_indexes:
+                raise ValueError(f"No such index: {index}")
+            if action_type == "add":
+                aliases.setdefault(params["alias"], set()).add(index)
+            elif action_type == "remove":
+                aliases.get(params["alias"], set()).discard(index)
+            elif action_type == "remove_index":
+                removed_indexes.append(index)
+            else:
+                raise ValueError(f"Unsupported alias action: {action_type}")
+        if any(alias in self.engine.indexes and alias not in removed_indexes for alias in aliases):
+            raise ValueError("An alias cannot have the same name as an index")
+        for index in removed_indexes:
+            self.engine.indexes.pop(index).drop()
+        self.engine.aliases = {
+            alias: indexes - set(removed_indexes) for alias, indexes in aliases.items() if indexes - set(removed_indexes)
+        }
+        return {"acknowledged": True}
+
+    def refresh(self, index=None):
+        for local_index in self._resolve(index):
+            local_index.refresh()
+        return {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+    def analyze(self, index=None, body=None, analyzer=None, text=None, field=None):
+        body = dict(body or {})
+        analyzer = body.get("analyzer", analyzer)
+        field = body.get("field", field)
+        text = body.get("text", text)
+        local_index = self.engine.get_index(index) if index is not None else None
+        if local_index is not None and field is not None:
+            analyze = local_index.analyzer_for(field)
+        elif local_index is not None and analyzer is not None:
+            analyze = local_index.analyzer(analyzer)
+        elif analyzer is not None:
+            analyze = build_analyzer(analyzer)
+        else:
+            analyze = STANDARD_ANALYZER
+        texts = [text] if isinstance(text, str) else list(text)
+        tokens = []
+        position_base = 0
+        offset_base = 0
+        for value in texts:
+            analyzed = analyze(value)
+            for token, position, start, end in analyzed:
+                tokens.append({
+                    "token": token,
+                    "start_offset": offset_base + start,
+                    "end_offset": offset_base + end,
+                    "type": "<ALPHANUM>",
+                    "position": position_base + position,
+                })
+            if analyzed:
+                position_base += analyzed[-1][1] + 1
+            offset_base += len(value) + 1
+        return {"tokens": tokens}
+
+class LocalSearchEngine:
+    """
+    An in-process stand-in for the Elasticsearch client.
+    It supports the calls made by es_pipeline and search_queries.py (ping, indices.exists/create/
+    delete/analyze, bulk indexing and search with match, bool, match_phrase, term, terms, range and
+    exists queries, plus the aggregations used by aggregations.py) and scores hits with BM25 over a
+    positional inverted index, returning Elasticsearch-shaped responses.
+    """
+
+    index_class = LocalIndex
+
+    def __init__(self):
+        self.indexes = {}
+        self.aliases = {}
+        self.indices = LocalIndicesClient(self)
+        self.points_in_time = {}
+        self._next_pit = 0
+
+    def ping(self):
+        return True
+
+    def get_index(self, index):
+        """
+        Returns the LocalIndex called index, or the single index behind an alias of that name.
+        """
+        if index in self.aliases:
+            if len(self.aliases[index]) != 1:
+                raise ValueError(f"Alias {index} points to more than one index")
+            index, = self.aliases[index]
+        if index not in self.indexes:
+            raise ValueError(f"No such index: {index}")
+        return self.indexes[index]
+
+    # -------------------------------------------
+    # Indexing
+    # -------------------------------------------
+
+    def _apply_action(self, action, default_index=None):
+        """
+        Applies one helpers-style action dict and returns (ok, {op_type: item}).
+        """
+        op_type = action.get("_op_type", "index")
+        index = action.get("_index", default_index)
+        doc_id = action.get("_id")
+        item = {"_index": index, "_id": None if doc_id is None else str(doc_id)}
+        try:
+            local_index = self.get_index(index)
+            if op_type == "delete":
+                found = local_index.delete(doc_id)
+                item.update(status=200 if found else 404, result="deleted" if found else "not_found")
+                return found, {op_type: item}
+            if doc_id is None:
+                doc_id = item["_id"] = local_index.auto_id()
+            source = action.get("_source")
+            if source is None:
+                source = {key: value for key, value in action.items() if not key.startswith("_")}
+            result = local_index.index(doc_id, source)
+            item.update(status=201 if result == "created" else 200, result=result)
+            return True, {op_type: item}
+        except ValueError as error:
+            item.update(status=404, error={"type": "index_not_found_exception", "reason": str(error)})
+            return False, {op_type: item}
+
+    def streaming_bulk(self, actions, index=None, raise_on_error=False, **kwargs):
+        """
+        Mirrors helpers.streaming_bulk: yields (ok, item) for every action.
+        """
+        for action in actions:
+            ok, item = self._apply_action(action, index)
+            if not ok and raise_on_error:
+                raise ValueError(f"Failed to index document: {item}")
+            yield ok, item
+
+    def bulk(self, operations, index=None, refresh=None):
+        """
+        Mirrors the bulk API: operations alternate action lines and document sources.
+        """
+        start = time.perf_counter()
+        items = []
+        operations = iter(operations)
+        for line in operations:
+            (op_type, meta), = line.items()
+            action = {"_op_type": op_type, **meta}
+            if op_type != "delete":
+                action["_source"] = next(operations)
+            ok, item = self._apply_action(action, index)
+            items.append(item)
+        took = int((time.perf_counter() - start) * 1000)
+        errors = any("error" in item for entry in items for item in entry.values())
+        return {"took": took, "errors": errors, "items": items}
+
+    # -------------------------------------------
+    # Search
+    # -------------------------------------------
+
+    def open_point_in_time(self, index, keep_alive=None):
+        """
+        Opens a point in time on an index. Documents indexed after it was opened are not visible
+        through it; unlike Elasticsearch, documents deleted afterwards disappear from it too.
+        """
+        local_index = self.get_index(index).searcher()
+        self._next_pit += 1
+        pit_id = f"local-pit-{self._next_pit}"
+        self.points_in_time[pit_id] = (local_index, len(local_index.ids))
+        return {"id": pit_id}
+
+    def close_point_in_time(self, id=None, body=None):
+        pit_id = id if id is not None else body["id"]
+        found = self.points_in_time.pop(pit_id, None) is not None
+        return {"succeeded": True, "num_freed": int(found)}
+
+    def _sort_by_doc(self, sort):
+        """
+        Returns True for a sort on index order ("_doc" or "_shard_doc", ascending), the only sort supported.
+        """
+        if sort is None:
+            return False
+        sort = sort if isinstance(sort, list) else [sort]
+        for clause in sort:
+            field, order = (clause, "asc") if isinstance(clause, str) else next(iter(clause.items()))
+            order = order.get("order", "asc") if isinstance(order, dict) else order
+            if field not in ("_doc", "_shard_doc") or order != "asc":
+                raise ValueError(f"Unsupported sort: {clause}")
+        return True
+
+    def search(self, index=None, body=None, query=None, size=None, from_=None, **kwargs):
+        """
+        Executes a search and returns the same structure as the Elasticsearch client.
+        Besides relevance-ranked pages it supports deep paging in index order: a point in time ("pit"),
+        "sort" on "_shard_doc", "search_after" and "slice" ({"id", "max"}, split by document number).
+        """
+        start = time.perf_counter()
+        body = dict(body or {})
+        query = body.get("query", query) or {"match_all": {}}
+        size = body.get("size", DEFAULT_SIZE if size is None else size)
+        from_ = body.get("from", 0 if from_ is None else from_)
+        pit = body.get("pit")
+        if pit is not None:
+            if pit["id"] not in self.points_in_time:
+                raise ValueError(f"No such point in time: {pit['id']}")
+            local_index, visible_docs = self.points_in_time[pit["id"]]
+        else:
+            local_index = self.get_index(index).searcher()
+            visible_docs = None
+
+        scores = self._evaluate(local_index, query)
+        if visible_docs is not None:
+            scores = {doc: score for doc, score in scores.items() if doc < visible_docs}
+        if "slice" in body:
+            slice_id, slice_max = body["slice"]["id"], body["slice"]["max"]
+            scores = {doc: score for doc, score in scores.items() if doc % slice_max == slice_id}
+        by_doc = self._sort_by_doc(body.get("sort"))
+        if by_doc:
+            ranked = sorted(scores.items())
+            if "search_after" in body:
+                after, = body["search_after"]
+                ranked = [(doc, score) for doc, score in ranked if doc > after]
+        elif "search_after" in body:
+            raise ValueError("search_after requires a sort")
+        else:
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        aggs = body.get("aggs", body.get("aggregations"))
+        source_filter = body.get("_source")
+        hits = []
+        for doc, score in ranked[from_:from_ + size]:
+            hit = {"_index": local_index.name, "_id": local_index.ids[doc], "_score": None if by_doc else score}
+            source = filter_source(local_index.get_source(doc), source_filter)
+            if source is not None:
+                hit["_source"] = source
+            if by_doc:
+                hit["sort"] = [doc]
+            hits.append(hit)
+        response = {
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {
+                "total": {"value": len(scores), "relation": "eq"},
+                "max_score": None if by_doc or not ranked else ranked[0][1],
+                "hits": hits,
+            },
+        }
+        if body.get("track_total_hits") is False:
+            del response["hits"]["total"]
+        if pit is not None:
+            response["pit_id"] = pit["id"]
+        if aggs:
+            response["aggregations"] = self._aggregate(local_index, [doc for doc, _ in ranked], aggs)
+        response["took"] = int((time.perf_counter() - start) * 1000)
+        return response
+
+    def msearch(self, searches=None, body=None, index=None):
+        """
+        Mirrors the multi-search API: searches alternate header ({"index": ...}) and body entries.
+        Failed searches are reported in place as an error response, like Elasticsearch does.
+        """
+        start = time.perf_counter()
+        searches = list(searches if searches is not None else body)
+        responses = []
+        for header, search_body in zip(searches[::2], searches[1::2]):
+            try:
+                response = self.search(index=header.get("index", index), body=search_body)
+                response["status"] = 200
+            except ValueError as error:
+                response = {"error": {"type": "search_phase_execution_exception", "reason": str(error)},
+                            "status": 400}
+            responses.append(response)
+        return {"took": int((time.perf_counter() - start) * 1000), "responses": responses}
+
+    def _evaluate(self, local_index, query):
+        """
+        Returns {doc: score} for the documents matching a query clause.
+        """
+        (query_type, params), = query.items()
+        if query_type == "match_all":
+            return {doc: 1.0 for doc in local_index.id_to_doc.values()}
+        if query_type == "match":
+            return self._match(local_index, params)
+        if query_type == "match_phrase":
+            return self._match_phrase(local_index, params)
+        if query_type == "bool":
+            return self._bool(local_index, params)
+        if query_type in ("term", "terms", "range", "exists"):
+            return dict.fromkeys(self._term_level(local_index, query_type, params), 1.0)
+        raise ValueError(f"Unsupported query type: {query_type}")
+
+    def _field_query(self, params):
+        (field, value), = params.items()
+        if isinstance(value, dict):
+            return field, value["query"], value.get("operator", "or").lower()
+        return field, value, "or"
+
+    def _query_analyzer(self, local_index, params):
+        """
+        Returns the analyzer of a match or match_phrase query: the one named by its "analyzer" parameter,
+        or the field's.
+        """
+        (field, value), = params.items()
+        if isinstance(value, dict) and "analyzer" in value:
+            return local_index.analyzer(value["analyzer"])
+        return local_index.analyzer_for(field)
+
+    def _bm25(self, local_index, field, idf, freq, doc):
+        avg_length = local_index.avg_field_length(field)
+        length = local_index.field_length(field, doc)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length) if avg_length else BM25_K1
+        return idf * freq / (freq + norm)
+
+    def _idf(self, local_index, field, doc_freq):
+        doc_count = local_index.doc_count(field)
+        return math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def _match(self, local_index, params):
+        field, text, operator = self._field_query(params)
+        terms = [token for token, _, _, _ in self._query_analyzer(local_index, params)(str(text))]
+        scores = defaultdict(float)
+        matched = defaultdict(int)
+        for term in terms:
+            postings = local_index.term_postings(field, term)
+            idf = self._idf(local_index, field, len(postings))
+            for doc, positions in postings.items():
+                scores[doc] += self._bm25(local_index, field, idf, len(positions), doc)
+                matched[doc] += 1
+        if operator == "and":
+            return {doc: score for doc, score in scores.items() if matched[doc] == len(terms)}
+        return dict(scores)
+
+    def _match_phrase(self, local_index, params):
+        field, text, _ = self._field_query(params)
+        tokens = self._query_analyzer(local_index, params)(str(text))
+        if not tokens:
+            return {}
+        first_position = tokens[0][1]
+        phrase = [(token, position - first_position) for token, position, _, _ in tokens]
+        postings = [local_index.term_postings(field, token) for token, _ in phrase]
+        if not all(postings):
+            return {}
+        idf = sum(self._idf(local_index, field, len(docs)) for docs in postings)
+        candidates = set.intersection(*(set(docs) for docs in sorted(postings, key=len)))
+        scores = {}
+        for doc in candidates:
+            starts = set(postings[0][doc])
+            for docs, (_, offset) in zip(postings[1:], phrase[1:]):
+                starts &= {position - offset for position in docs[doc]}
+            if starts:
+                scores[doc] = self._bm25(local_index, field, idf, len(starts), doc)
+        return scores
+
+    def _term_level(self, local_index, query_type, params):
+        """
+        Returns the documents matching a term, terms, range or exists query. Strings are looked up
+        unanalyzed in the inverted index; other values are compared with the stored field values.
+        """
+        if query_type == "exists":
+            field = params["field"]
+            return [doc for doc in local_index.id_to_doc.values() if local_index.doc_value(doc, field) is not None]
+        (field, value), = params.items()
+        if query_type == "range":
+            is_date = local_index.field_mapping(field).get("type") == "date"
+            convert = parse_date if is_date else (lambda v: v)
+            bounds = [(operator, convert(value[operator])) for operator in ("gt", "gte", "lt", "lte") if operator in value]
+            checks = {"gt": lambda v, b: v > b, "gte": lambda v, b: v >= b,
+                      "lt": lambda v, b: v < b, "lte": lambda v, b: v <= b}
+            docs = []
+            for doc in local_index.id_to_doc.values():
+                field_value = local_index.doc_value(doc, field)
+                if field_value is None or field_value != field_value:
+                    continue
+                field_value = convert(field_value)
+                if all(checks[operator](field_value, bound) for operator, bound in bounds):
+                    docs.append(doc)
+            return docs
+        if query_type == "term":
+            values = [value["value"] if isinstance(value, dict) else value]
+        else:
+            values = list(value)
+        docs = set()
+        for term in values:
+            if isinstance(term, str) and field in local_index.postings:
+                docs.update(local_index.term_postings(field, term))
+            else:
+                docs.update(doc for doc in local_index.id_to_doc.values() if local_index.doc_value(doc, field) == term)
+        return docs
+
+    def _bool(self, local_index, params):
+        def clauses(name):
+            value = params.get(name, [])
+            return [value] if isinstance(value, dict) else value
+
+        must = [self._evaluate(local_index, clause) for clause in clauses("must")]
+        filters = [self._evaluate(local_index, clause) for clause in clauses("filter")]
+        should = [self._evaluate(local_index, clause) for clause in clauses("should")]
+        must_not = [self._evaluate(local_index, clause) for clause in clauses("must_not")]
+
+        required = must + filters
+        if required:
+            docs = set.intersection(*(set(result) for result in required))
+        elif should:
+            docs = set().union(*should)
+        else:
+            docs = set(local_index.id_to_doc.values())
+        for result in must_not:
+            docs -= result.keys()
+
+        scores = {}
+        for doc in docs:
+            scores[doc] = sum(result[doc] for result in must) + sum(result.get(doc, 0.0) for result in should)
+        return scores
+
+    # -------------------------------------------
+    # Aggregations
+    # -------------------------------------------
+
+    def _aggregate(self, local_index, docs, aggs):
+        """
+        Computes the aggregations of a search body over the matching documents.
+        Bucket aggregations (terms, date_histogram, filter) run their sub-aggregations per bucket.
+        """
+        results = {}
+        for name, definition in aggs.items():
+            sub_aggs = definition.get("aggs", definition.get("aggregations", {}))
+            (agg_type, params), = ((key, value) for key, value in definition.items()
+                                   if key not in ("aggs", "aggregations"))
+            handler = getattr(self, f"_agg_{agg_type}", None)
+            if handler is None:
+                raise ValueError(f"Unsupported aggregation type: {agg_type}")
+            results[name] = handler(local_index, docs, params, sub_aggs)
+        return results
+
+    def _numbers(self, local_index, docs, field):
+        """
+        Returns the numeric values of a field in the documents (dates as epoch milliseconds),
+        skipping missing values.
+        """
+        is_date = local_index.field_mapping(field).get("type") == "date"
+        values = []
+        for doc in docs:
+            value = local_index.doc_value(doc, field)
+            if value is None or value != value:
+                continue
+            values.append(_epoch_millis(parse_date(value)) if is_date else float(value))
+        return values
+
+    def _agg_avg(self, local_index, docs, params, sub_aggs):
+        values = self._numbers(local_index, docs, params["field"])
+        return {"value": sum(values) / len(values) if values else None}
+
+    def _agg_sum(self, local_index, docs, params, sub_aggs):
+        return {"value": float(sum(self._numbers(local_index, docs, params["field"])))}
+
+    def _agg_min(self, local_index, docs, params, sub_aggs):
+        return {"value": min(self._numbers(local_index, docs, params["field"]), default=None)}
+
+    def _agg_max(self, local_index, docs, params, sub_aggs):
+        return {"value": max(self._numbers(local_index, docs, params["field"]), default=None)}
+
+    def _agg_value_count(self, local_index, docs, params, sub_aggs):
+        return {"value": sum(local_index.doc_value(doc, params["field"]) is not None for doc in docs)}
+
+    def _agg_cardinality(self, local_index, docs, params, sub_aggs):
+        values = {local_index.doc_value(doc, params["field"]) for doc in docs}
+        values.discard(None)
+        return {"value": len(values)}
+
+    def _agg_stats(self, local_index, docs, params, sub_aggs):
+        values = self._numbers(local_index, docs, params["field"])
+        if not values:
+            return {"count": 0, "min": None, "max": None, "avg": None, "sum": 0.0}
+        return {"count": len(values), "min": min(values), "max": max(values),
+                "avg": sum(values) / len(values), "sum": float(sum(values))}
+
+    def _agg_weighted_avg(self, local_index, docs, params, sub_aggs):
+        value_field = params["value"]["field"]
+        weight_field = params["weight"]["field"]
+        total = 0.0
+        weights = 0.0
+        for doc in docs:
+            value = local_index.doc_value(doc, value_field)
+            weight = local_index.doc_value(doc, weight_field)
+            if value is None or weight is None or value != value or weight != weight:
+                continue
+            total += float(value) * float(weight)
+            weights += float(weight)
+        return {"value": total / weights if weights else None}
+
+    def _agg_percentiles(self, local_index, docs, params, sub_aggs):
+        """
+        Exact percentiles with linear interpolation (Elasticsearch estimates them with t-digest).
+        """
+        values = sorted(self._numbers(local_index, docs, params["field"]))
+        result = {}
+        for percent in params.get("percents", DEFAULT_PERCENTS):
+            if not values:
+                result[str(float(percent))] = None
+                continue
+            rank = percent / 100 * (len(values) - 1)
+            lower = int(rank)
+            upper = min(lower + 1, len(values) - 1)
+            result[str(float(percent))] = values[lower] + (values[upper] - values[lower]) * (rank - lower)
+        return {"values": result}
+
+    def _agg_filter(self, local_index, docs, params, sub_aggs):
+        matching = self._evaluate(local_index, params)
+        bucket_docs = [doc for doc in docs if doc in matching]
+        return {"doc_count": len(bucket_docs), **self._aggregate(local_index, bucket_docs, sub_aggs)}
+
+    def _agg_terms(self, local_index, docs, params, sub_aggs):
+        field = params["field"]
+        groups = defaultdict(list)
+        for doc in docs:
+            value = local_index.doc_value(doc, field)
+            if value is not None and value == value:
+                groups[value].append(doc)
+        buckets = [{"key": key, "doc_count": len(bucket_docs), **self._aggregate(local_index, bucket_docs, sub_aggs)}
+                   for key, bucket_docs in groups.items()
+                   if len(bucket_docs) >= params.get("min_doc_count", 1)]
+
+        (order_key, direction), = params.get("order", {"_count": "desc"}).items()
+        if order_key == "_count":
+            sort_key = lambda bucket: bucket["doc_count"]
+        elif order_key == "_key":
+            sort_key = lambda bucket: bucket["key"]
+        else:
+            # Ordering by a single-value metric sub-aggregation, e.g. {"avg_spend": "desc"}.
+            sort_key = lambda bucket: -math.inf if bucket[order_key]["value"] is None else bucket[order_key]["value"]
+        buckets.sort(key=lambda bucket: bucket["key"])
+        buckets.sort(key=sort_key, reverse=direction == "desc")
+        size = params.get("size", 10)
+        return {
+            "doc_count_error_upper_bound": 0,
+            "sum_other_doc_count": sum(bucket["doc_count"] for bucket in buckets[size:]),
+            "buckets": buckets[:size],
+        }
+
+    def _agg_date_histogram(self, local_index, docs, params, sub_aggs):
+        """
+        Buckets documents by calendar interval (day, week, month, quarter or year). As in Elasticsearch,
+        empty buckets between the first and last bucket are included unless min_doc_count is set.
+        """
+        interval = params.get("calendar_interval", params.get("interval", "month"))
+        interval = {"1d": "day", "1w": "week", "1M": "month", "1q": "quarter", "1y": "year"}.get(interval, interval)
+        if interval not in ("day", "week", "month", "quarter", "year"):
+            raise ValueError(f"Unsupported calendar_interval: {interval}")
+
+        def bucket_start(value):
+            value = value.replace(hour=0, minute=0, second=0, microsecond=0)
+            if interval == "week":
+                return value - timedelta(days=value.weekday())
+            if interval == "month":
+                return value.replace(day=1)
+            if interval == "quarter":
+                return value.replace(month=(value.month - 1) // 3 * 3 + 1, day=1)
+            if interval == "year":
+                return value.replace(month=1, day=1)
+            return value
+
+        def next_start(value):
+            if interval in ("day", "week"):
+                return value + timedelta(days=1 if interval == "day" else 7)
+            months = {"month": 1, "quarter": 3, "year": 12}[interval]
+            month = value.month - 1 + months
+            return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+        field = params["field"]
+        groups = defaultdict(list)
+        for doc in docs:
+            value = local_index.doc_value(doc, field)
+            if value is not None and value == value:
+                groups[bucket_start(parse_date(value))].append(doc)
+        min_doc_count = params.get("min_doc_count", 0)
+        starts = sorted(groups)
+        if starts and min_doc_count == 0:
+            filled = [starts[0]]
+            while filled[-1] < starts[-1]:
+                filled.append(next_start(filled[-1]))
+            starts = filled
+        buckets = []
+        for start in starts:
+            bucket_docs = groups.get(start, [])
+            if len(bucket_docs) < min_doc_count:
+                continue
+            buckets.append({
+                "key_as_string": start.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                "key": _epoch_millis(start),
+                "doc_count": len(bucket_docs),
+                **self._aggregate(local_index, bucket_docs, sub_aggs),
+            })
+        return {"buckets": buckets}
@@ -0,0 +1,788 @@
+import argparse
+import bisect
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import accumulate
+
+import numpy as np
+
+from es_pipeline import DEFAULT_CHUNK_SIZE, bump_generation, create_index, index_documents
+from index_settings import INDEX_REGISTRY
+from local_engine import LocalIndex, LocalSearchEngine, new_doc_id
+from segment import Segment, SegmentWriter
+
+# An embedded index that takes live appends and deletes without being rebuilt, organized like a Lucene shard:
+# - Writes go to a small in-memory LocalIndex (the memtable). A refresh (every refresh_interval, when the memtable
+#   holds buffer_docs documents, or on indices.refresh) freezes it into an immutable unit and makes it searchable.
+# - Deleting or replacing a document that is already in a unit only sets a tombstone in that unit's bitmap;
+#   tombstones also become visible at the next refresh.
+# - A background thread writes frozen memtables to disk as segments (segment.py) and merges segments under a
+#   tiered policy, dropping tombstoned documents. Segments are written by a separate process, so text analysis
+#   does not compete with searches for the interpreter, and swapped in with a brief lock once complete.
+# - Searches run on a snapshot of the units taken at the last refresh, which has the reader interface of
+#   LocalIndex; term postings are read from the units concurrently and statistics are summed over them, so
+#   scores are those of a single index holding the live documents.
+# The segments and their tombstones are committed (lsm.json) when a memtable is written to disk, after each merge
+# and on close; documents still in memory are lost if the process dies (there is no translog).
+
+LSM_MANIFEST_FILE = "lsm.json"
+LSM_FORMAT_VERSION = 1
+DEFAULT_LSM_DIR = "lsm"
+SEGMENT_PREFIX = "segment_"
+DEFAULT_BUFFER_DOCS = 10000
+# Seconds between refreshes unless the index settings have a refresh_interval ("-1" turns them off).
+DEFAULT_REFRESH_INTERVAL = 1.0
+# Tiered merge policy: segments within a factor MERGE_FACTOR of each other in size share a tier, and a tier
+# holding MERGE_FACTOR segments is merged into one. Segments below FLOOR_SEGMENT_DOCS count as that size, and a
+# segment whose documents are more than MAX_DELETED_RATIO deleted is rewritten on its own.
+MERGE_FACTOR = 10
+FLOOR_SEGMENT_DOCS = 1000
+MAX_DELETED_RATIO = 0.5
+SEARCH_THREADS = 4
+# Documents whose location is updated per lock acquisition when a new segment is swapped in.
+SWAP_BATCH = 65536
+
+def parse_interval(value, default=DEFAULT_REFRESH_INTERVAL):
+    """
+    Returns an Elasticsearch time value ("1s", "500ms", "2m"; bare numbers are milliseconds) in seconds,
+    None for "-1", or default when value is None.
+    """
+    if value is None:
+        return default
+    value = str(value).strip()
+    if value == "-1":
+        return None
+    for suffix, scale in (("ms", 0.001), ("s", 1.0), ("m", 60.0)):
+        if value.endswith(suffix):
+            return float(value[:-len(suffix)]) * scale
+    return float(value) / 1000
+
+def select_merge(segments, merge_factor=MERGE_FACTOR, floor_docs=FLOOR_SEGMENT_DOCS,
+                 max_deleted_ratio=MAX_DELETED_RATIO):
+    """
+    The tiered merge policy. segments is a list of (live documents, deleted documents); returns the positions of
+    the segments to merge next, or None. A segment with too many deleted documents is rewritten first; otherwise
+    the oldest merge_factor segments of the smallest full tier are merged.
+    """
+    for position, (live, deleted) in enumerate(segments):
+        if deleted and deleted > max_deleted_ratio * (live + deleted):
+            return [position]
+    tiers = defaultdict(list)
+    for position, (live, _) in enumerate(segments):
+        tiers[int(math.log(max(live, floor_docs) / floor_docs, merge_factor) + 1e-9)].append(position)
+    for tier in sorted(tiers):
+        if len(tiers[tier]) >= merge_factor:
+            return tiers[tier][:merge_factor]
+    return None
+
+def _write_segment(directory, name, body, parts):
+    """
+    Writes a segment from parts, in order: ([(doc_id, source)], None) for the documents of a frozen memtable or
+    (segment directory, ordinals) for the live documents of a segment. Runs in the merge process.
+    """
+    writer = SegmentWriter(directory, name, body)
+    for source, docs in parts:
+        if isinstance(source, str):
+            segment = Segment(source)
+            for doc in docs.tolist():
+                writer.add(segment.ids[doc], segment.get_source(doc))
+        else:
+            for doc_id, document in source:
+                writer.add(doc_id, document)
+    writer.close()
+
+# -------------------------------------------
+# Units and snapshots
+# -------------------------------------------
+
+def _live_docs(reader, deleted):
+    """
+    Returns the ordinals of the documents of a unit that are neither deleted nor tombstoned.
+    """
+    if isinstance(reader, Segment):
+        docs = np.arange(len(reader.ids))
+    else:
+        docs = np.sort(np.fromiter(reader.id_to_doc.values(), dtype=np.int64, count=len(reader.id_to_doc)))
+    return docs if deleted is None else docs[~deleted[docs]]
+
+def _total_length(reader, field):
+    if isinstance(reader, Segment):
+        return reader.postings[field].total_length if field in reader.postings else 0
+    return reader.field_totals.get(field, 0)
+
+def _field_stats(reader, docs):
+    """
+    Returns {field: (documents, total length)} of a field over the documents that have it.
+    """
+    stats = {}
+    if isinstance(reader, Segment):
+        for field, field_index in reader.postings.items():
+            lengths = np.asarray(field_index.lengths)[docs]
+            present = lengths >= 0
+            if present.any():
+                stats[field] = (int(present.sum()), int(lengths[present].sum()))
+    else:
+        for field, lengths in reader.field_lengths.items():
+            values = [lengths[doc] for doc in docs.tolist() if doc in lengths]
+            if values:
+                stats[field] = (len(values), sum(values))
+    return stats
+
+class _Unit:
+    """
+    One immutable part of an LSMIndex: a frozen memtable (a LocalIndex, name None) or an on-disk segment (name is
+    its directory), with its tombstones. delete() replaces the tombstone bitmap and statistics rather than
+    changing them, so snapshots keep the ones they were taken with.
+    """
+
+    def __init__(self, reader, name=None, deleted=None):
+        self.reader = reader
+        self.name = name
+        self.deleted = np.zeros(len(reader.ids), dtype=bool)
+        self.deleted_count = 0
+        self.deleted_stats = {}
+        self.deleted_file = None
+        self.committed_deletes = 0
+        self.busy = False
+        if deleted is not None:
+            self.delete(np.flatnonzero(deleted))
+            self.committed_deletes = self.deleted_count
+
+    def live_count(self):
+        return len(self.reader.id_to_doc) - self.deleted_count
+
+    def delete(self, docs):
+        docs = np.unique(np.asarray(docs, dtype=np.int64))
+        docs = docs[~self.deleted[docs]]
+        if not len(docs):
+            return
+        deleted = self.deleted.copy()
+        deleted[docs] = True
+        stats = dict(self.deleted_stats)
+        for field, (count, total) in _field_stats(self.reader, docs).items():
+            previous_count, previous_total = stats.get(field, (0, 0))
+            stats[field] = (previous_count + count, previous_total + total)
+        self.deleted, self.deleted_stats = deleted, stats
+        self.deleted_count += len(docs)
+
+class _Concatenated(Sequence):
+    """
+    The ids or the sources of a snapshot's documents, numbered across its units.
+    """
+
+    def __init__(self, snapshot, get):
+        self.snapshot = snapshot
+        self.get = get
+
+    def __len__(self):
+        return self.snapshot.starts[-1]
+
+    def __getitem__(self, doc):
+        part, local_doc = self.snapshot.locate(doc)
+        return self.get(self.snapshot.readers[part], local_doc)
+
+class _SnapshotDocIds(Mapping):
+    """
+    Maps the ids of a snapshot's live documents to their ordinals; values() lists the ordinals in order.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __getitem__(self, doc_id):
+        snapshot = self.snapshot
+        for part in reversed(range(len(snapshot.readers))):
+            doc = snapshot.readers[part].id_to_doc.get(str(doc_id))
+            deleted = snapshot.deleted[part]
+            if doc is not None and (deleted is None or not deleted[doc]):
+                return snapshot.starts[part] + doc
+        raise KeyError(doc_id)
+
+    def __iter__(self):
+        return (self.snapshot.ids[doc] for doc in self.values())
+
+    def __len__(self):
+        return sum(self.snapshot.live_counts)
+
+    def values(self):
+        return self.snapshot.live_docs()
+
+class _Snapshot(LocalIndex):
+    """
+    A point-in-time view of an LSMIndex with the reader interface of LocalIndex, so LocalSearchEngine searches it
+    like any other index. Documents are numbered across the units; tombstoned documents are left out of the
+    postings and of the statistics.
+    """
+
+    def __init__(self, name, body, units, executor):
+        super().__init__(name, body)
+        self.readers = [unit.reader for unit in units]
+        self.deleted = [unit.deleted if unit.deleted_count else None for unit in units]
+        self.deleted_stats = [unit.deleted_stats for unit in units]
+        self.live_counts = [unit.live_count() for unit in units]
+        self.starts = list(accumulate((len(reader.ids) for reader in self.readers), initial=0))
+        self.executor = executor
+        self.ids = _Concatenated(self, lambda reader, doc: reader.ids[doc])
+        self.sources = _Concatenated(self, lambda reader, doc: reader.get_source(doc))
+        self.id_to_doc = _SnapshotDocIds(self)
+        self.postings = frozenset(field for reader in self.readers for field in reader.postings)
+        self._field_totals = {}
+        self._live_docs = None
+
+    def locate(self, doc):
+        """
+        Returns (unit position, ordinal in the unit) of a document.
+        """
+        if not 0 <= doc < self.starts[-1]:
+            raise IndexError(doc)
+        part = bisect.bisect_right(self.starts, doc) - 1
+        return part, doc - self.starts[part]
+
+    def live_docs(self):
+        if self._live_docs is None:
+            self._live_docs = [doc for start, reader, deleted in zip(self.starts, self.readers, self.deleted)
+                               for doc in (_live_docs(reader, deleted) + start).tolist()]
+        return self._live_docs
+
+    def _totals(self, field):
+        totals = self._field_totals.get(field)
+        if totals is None:
+            count = total = 0
+            for reader, stats in zip(self.readers, self.deleted_stats):
+                deleted_count, deleted_length = stats.get(field, (0, 0))
+                count += reader.doc_count(field) - deleted_count
+                total += _total_length(reader, field) - deleted_length
+            totals = self._field_totals[field] = (count, total)
+        return totals
+
+    def doc_count(self, field=None):
+        return len(self.id_to_doc) if field is None else self._totals(field)[0]
+
+    def avg_field_length(self, field):
+        count, total = self._totals(field)
+        return total / count if count else 0.0
+
+    def field_length(self, field, doc):
+        part, local_doc = self.locate(doc)
+        return self.readers[part].field_length(field, local_doc)
+
+    def _unit_postings(self, part, field, term):
+        postings = self.readers[part].term_postings(field, term)
+        start, deleted = self.starts[part], self.deleted[part]
+        if deleted is None:
+            return {start + doc: positions for doc, positions in postings.items()} if start else postings
+        return {start + doc: positions for doc, positions in postings.items() if not deleted[doc]}
+
+    def term_postings(self, field, term):
+        """
+        Returns {doc: positions} for a term, read from every unit concurrently.
+        """
+        if len(self.readers) == 1:
+            return self._unit_postings(0, field, term)
+        merged = {}
+        for postings in self.executor.map(lambda part: self._unit_postings(part, field, term), range(len(self.readers))):
+            merged.update(postings)
+        return merged
+
+# -------------------------------------------
+# Index
+# -------------------------------------------
+
+class LSMIndex:
+    """
+    An index in a directory of immutable segments plus an in-memory memtable, written to like a LocalIndex
+    (index, delete) and searched through searcher() snapshots. Opens the index already in directory, or creates
+    one called name with the index body when there is none.
+    """
+
+    def __init__(self, directory, name=None, body=None, buffer_docs=DEFAULT_BUFFER_DOCS, merge_factor=MERGE_FACTOR,
+                 floor_docs=FLOOR_SEGMENT_DOCS, merge_process=True):
+        manifest_path = os.path.join(directory, LSM_MANIFEST_FILE)
+        manifest = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") != LSM_FORMAT_VERSION:
+                raise ValueError(f"Unsupported index format {manifest.get('version')} in {directory}")
+            name, body = manifest["name"], manifest["body"]
+        elif name is None:
+            raise ValueError(f"No index in {directory}: a name is needed to create one")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = name
+        self.body = body or {}
+        self.mapping = LocalIndex(name, self.body)
+        self.buffer_docs = buffer_docs
+        self.merge_factor = merge_factor
+        self.floor_docs = floor_docs
+        self.memtable = LocalIndex(name, self.body)
+        self.units = []
+        # Where the live copy of every document is: (unit, ordinal), or (None, None) while in the memtable.
+        self.locations = {}
+        self.flushes = 0
+        self.merges = 0
+        self.merge_seconds = 0.0
+        self._pending = defaultdict(list)
+        self._next_segment = manifest["next_segment"] if manifest else 0
+        self._commit_generation = manifest["generation"] if manifest else 0
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._closed = False
+
+        for entry in manifest["segments"] if manifest else []:
+            reader = Segment(os.path.join(directory, entry["name"]))
+            deleted = np.load(os.path.join(directory, entry["deleted"])) if entry["deleted"] else None
+            unit = _Unit(reader, entry["name"], deleted)
+            unit.deleted_file = entry["deleted"]
+            self.units.append(unit)
+            for doc in _live_docs(reader, unit.deleted if unit.deleted_count else None).tolist():
+                self.locations[reader.ids[doc]] = (unit, doc)
+        self._remove_unreferenced()
+
+        self._searches = ThreadPoolExecutor(SEARCH_THREADS, thread_name_prefix=f"{name}-search")
+        self._merge_pool = (ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"))
+                            if merge_process else None)
+        self._snapshot = None
+        self._publish()
+        self._thread = threading.Thread(target=self._run, name=f"{name}-merges", daemon=True)
+        self._thread.start()
+
+    # The mapping and analysis API of LocalIndex, used by the indices client.
+
+    def field_mapping(self, field):
+        return self.mapping.field_mapping(field)
+
+    def analyzer_for(self, field):
+        return self.mapping.analyzer_for(field)
+
+    def analyzer(self, name):
+        return self.mapping.analyzer(name)
+
+    # -------------------------------------------
+    # Writes and snapshots
+    # -------------------------------------------
+
+    def _tombstone(self, doc_id):
+        location = self.locations.pop(doc_id, None)
+        if location is None:
+            return False
+        unit, doc = location
+        if unit is None:
+            self.memtable.delete(doc_id)
+        else:
+            self._pending[unit].append(doc)
+        return True
+
+    def index(self, doc_id, source):
+        """
+        Adds or replaces a document. Returns "created" or "updated" like the bulk API.
+        """
+        doc_id = str(doc_id)
+        with self._lock:
+            if self._closed:
+                raise ValueError(f"Index {self.name} is closed")
+            found = self._tombstone(doc_id)
+            self.memtable.index(doc_id, source)
+            self.locations[doc_id] = (None, None)
+            if len(self.memtable.ids) >= self.buffer_docs:
+                self._refresh()
+                self._wake.set()
+        return "updated" if found else "created"
+
+    def auto_id(self):
+        """
+        Returns the id of a document indexed without one.
+        """
+        return new_doc_id()
+
+    def delete(self, doc_id):
+        """
+        Deletes a document. Returns False if the id is unknown.
+        """
+        with self._lock:
+            if self._closed:
+                raise ValueError(f"Index {self.name} is closed")
+            return self._tombstone(str(doc_id))
+
+    def refresh(self):
+        """
+        Makes the writes made so far visible to searches.
+        """
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        changed = False
+        if self.memtable.ids:
+            unit = _Unit(self.memtable)
+            self.units.append(unit)
+            for doc_id, doc in self.memtable.id_to_doc.items():
+                self.locations[doc_id] = (unit, doc)
+            self.memtable = LocalIndex(self.name, self.body)
+            changed = True
+        if self._pending:
+            for unit, docs in self._pending.items():
+                unit.delete(docs)
+            self._pending.clear()
+            changed = True
+        if changed:
+            self._publish()
+
+    def _publish(self):
+        self._snapshot = _Snapshot(self.name, self.body, list(self.units), self._searches)
+        bump_generation(self.name)
+
+    def searcher(self):
+        """
+        Returns the snapshot of the index taken at the last refresh.
+        """
+        return self._snapshot
+
+    def refresh_interval(self):
+        settings = self.body.get("settings", {})
+        return parse_interval(settings.get("index", {}).get("refresh_interval", settings.get("refresh_interval")))
+
+    def stats(self):
+        """
+        Returns the live and deleted documents of every segment, plus the memtable and merge counters.
+        """
+        with self._lock:
+            return {
+                "segments": [(unit.name or "(memory)", unit.live_count(), unit.deleted_count) for unit in self.units],
+                "memtable": len(self.memtable.id_to_doc),
+                "pending_deletes": sum(len(docs) for docs in self._pending.values()),
+                "flushes": self.flushes,
+                "merges": self.merges,
+                "merge_seconds": round(self.merge_seconds, 3),
+            }
+
+    # -------------------------------------------
+    # Flushes and merges
+    # -------------------------------------------
+
+    def _run(self):
+        while True:
+            interval = self.refresh_interval()
+            self._wake.wait(DEFAULT_REFRESH_INTERVAL if interval is None else interval)
+            self._wake.clear()
+            if self._closed:
+                return
+            try:
+                if interval is not None:
+                    self.refresh()
+                # Flushes and merges alternate, so a steady stream of writes does not hold merges off.
+                while not self._closed:
+                    flushed = self._flush_next()
+                    merged = not self._closed and self._merge_next()
+                    if not flushed and not merged:
+                        break
+            except Exception as error:
+                print(f"Background maintenance of index '{self.name}' failed: {error}")
+
+    def _flush_next(self):
+        """
+        Writes the oldest frozen memtable to disk. Returns False when there is none.
+        """
+        with self._lock:
+            units = [unit for unit in self.units if unit.name is None and not unit.busy][:1]
+            parts = self._start_job(units)
+        if units:
+            self._run_job(units, parts)
+        return bool(units)
+
+    def _merge_next(self):
+        """
+        Runs the next merge of the tiered policy. Returns False when none is due.
+        """
+        with self._lock:
+            candidates = [unit for unit in self.units if unit.name is not None and not unit.busy]
+            chosen = select_merge([(unit.live_count(), unit.deleted_count) for unit in candidates],
+                                  self.merge_factor, self.floor_docs)
+            units = [candidates[position] for position in chosen or []]
+            parts = self._start_job(units)
+        if units:
+            self._run_job(units, parts)
+        return bool(units)
+
+    def _start_job(self, units):
+        """
+        Marks units as being rewritten and returns [(unit, ordinals of its live documents)].
+        """
+        parts = []
+        for unit in units:
+            unit.busy = True
+            deleted = unit.deleted.copy()
+            deleted[self._pending.get(unit, [])] = True
+            parts.append((unit, _live_docs(unit.reader, deleted)))
+        return parts
+
+    def _run_job(self, units, parts):
+        start = time.perf_counter()
+        try:
+            with self._lock:
+                name = f"{SEGMENT_PREFIX}{self._next_segment:06d}"
+                self._next_segment += 1
+            directory = os.path.join(self.directory, name)
+            doc_ids = [[unit.reader.ids[doc] for doc in docs.tolist()] for unit, docs in parts]
+            tasks = []
+            for (unit, docs), ids in zip(parts, doc_ids):
+                if unit.name is None:
+                    sources = [dict(unit.reader.get_source(doc)) for doc in docs.tolist()]
+                    tasks.append((list(zip(ids, sources)), None))
+                else:
+                    tasks.append((os.path.join(self.directory, unit.name), docs))
+            reader = None
+            if any(len(docs) for _, docs in parts):
+                if self._merge_pool is not None:
+                    self._merge_pool.submit(_write_segment, directory, self.name, self.body, tasks).result()
+                else:
+                    _write_segment(directory, self.name, self.body, tasks)
+                reader = Segment(directory)
+        except BaseException:
+            with self._lock:
+                for unit in units:
+                    unit.busy = False
+            raise
+        self._swap(units, parts, doc_ids, reader, name)
+        for unit in units:
+            if unit.name is not None:
+                shutil.rmtree(os.path.join(self.directory, unit.name), ignore_errors=True)
+        if all(unit.name is None for unit in units):
+            self.flushes += 1
+        else:
+            self.merges += 1
+            self.merge_seconds += time.perf_counter() - start
+
+    def _swap(self, units, parts, doc_ids, reader, name):
+        """
+        Replaces units with the segment written from their live documents. Documents deleted or replaced while the
+        segment was written are tombstoned in it. Locations are moved in batches so writers are not held up.
+        """
+        new_unit = _Unit(reader, name) if reader is not None else None
+        tombstones = []
+        new_doc = 0
+        for (unit, docs), ids in zip(parts, doc_ids):
+            docs = docs.tolist()
+            for batch in range(0, len(ids), SWAP_BATCH):
+                with self._lock:
+                    for doc_id, doc in zip(ids[batch:batch + SWAP_BATCH], docs[batch:batch + SWAP_BATCH]):
+                        location = self.locations.get(doc_id)
+                        if location is not None and location[0] is unit and location[1] == doc:
+                            self.locations[doc_id] = (new_unit, new_doc)
+                        else:
+                            tombstones.append(new_doc)
+                        new_doc += 1
+        with self._lock:
+            if new_unit is not None:
+                new_unit.delete(tombstones + self._pending.pop(new_unit, []))
+            position = min(self.units.index(unit) for unit in units)
+            self.units = [unit for unit in self.units if all(unit is not old for old in units)]
+            if new_unit is not None:
+                self.units.insert(position, new_unit)
+            for unit in units:
+                self._pending.pop(unit, None)
+            self._commit([unit.deleted_file for unit in units if unit.deleted_file])
+            self._publish()
+
+    def _commit(self, obsolete_files=()):
+        """
+        Writes the tombstones that changed and the manifest listing the on-disk segments.
+        """
+        self._commit_generation += 1
+        obsolete_files = list(obsolete_files)
+        entries = []
+        for unit in self.units:
+            if unit.name is None:
+                continue
+            if unit.deleted_count != unit.committed_deletes:
+                file_name = f"{unit.name}.deleted.{self._commit_generation}.npy"
+                np.save(os.path.join(self.directory, file_name), unit.deleted)
+                if unit.deleted_file:
+                    obsolete_files.append(unit.deleted_file)
+                unit.deleted_file = file_name
+                unit.committed_deletes = unit.deleted_count
+            entries.append({"name": unit.name, "deleted": unit.deleted_file})
+        manifest = {"version": LSM_FORMAT_VERSION, "name": self.name, "body": self.body,
+                    "next_segment": self._next_segment, "generation": self._commit_generation, "segments": entries}
+        tmp_file = os.path.join(self.directory, LSM_MANIFEST_FILE + ".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_file, os.path.join(self.directory, LSM_MANIFEST_FILE))
+        for file_name in obsolete_files:
+            if os.path.exists(os.path.join(self.directory, file_name)):
+                os.remove(os.path.join(self.directory, file_name))
+
+    def _remove_unreferenced(self):
+        """
+        Removes the segments and tombstone files a crash left behind (written but never committed).
+        """
+        referenced = {unit.name for unit in self.units} | {unit.deleted_file for unit in self.units}
+        for entry in os.listdir(self.directory):
+            if entry.startswith(SEGMENT_PREFIX) and entry not in referenced:
+                path = os.path.join(self.directory, entry)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+
+    def flush(self):
+        """
+        Refreshes, writes every frozen memtable to disk and commits the tombstones.
+        """
+        self.refresh()
+        while self._flush_next():
+            pass
+        with self._lock:
+            self._commit()
+
+    def force_merge(self, max_num_segments=None):
+        """
+        Flushes, then merges segments until at most max_num_segments are left (None runs the tiered policy).
+        """
+        self.flush()
+        if max_num_segments is None:
+            while self._merge_next():
+                pass
+            return
+        while True:
+            with self._lock:
+                segments = [unit for unit in self.units if unit.name is not None]
+                idle = [unit for unit in segments if not unit.busy]
+                excess = len(segments) - max(1, max_num_segments)
+                if excess <= 0:
+                    return
+                units = sorted(idle, key=lambda unit: unit.live_count())[:excess + 1] if len(idle) > 1 else []
+                parts = self._start_job(units) if units else None
+            if parts is None:
+                # The background thread is rewriting the other segments.
+                time.sleep(0.05)
+                continue
+            self._run_job(units, parts)
+
+    def close(self):
+        """
+        Stops the background thread and writes everything to disk.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        self._searches.shutdown()
+        if self._merge_pool is not None:
+            self._merge_pool.shutdown()
+
+    def drop(self):
+        """
+        Stops the background thread and removes the index directory.
+        """
+        with self._lock:
+            self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self._searches.shutdown()
+        if self._merge_pool is not None:
+            self._merge_pool.shutdown(cancel_futures=True)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+class LSMSearchEngine(LocalSearchEngine):
+    """
+    A LocalSearchEngine whose indices are LSMIndex directories under root. The indices already there are opened,
+    and indices.create makes a new, empty one (replacing any files left in its directory).
+    """
+
+    def __init__(self, root=DEFAULT_LSM_DIR, **options):
+        super().__init__()
+        self.root = root
+        self.options = options
+        os.makedirs(root, exist_ok=True)
+        for entry in sorted(os.listdir(root)):
+            if os.path.exists(os.path.join(root, entry, LSM_MANIFEST_FILE)):
+                local_index = LSMIndex(os.path.join(root, entry), **options)
+                self.indexes[local_index.name] = local_index
+
+    def index_class(self, name, body=None):
+        directory = os.path.join(self.root, name)
+        shutil.rmtree(directory, ignore_errors=True)
+        return LSMIndex(directory, name, body, **self.options)
+
+    def close(self):
+        for local_index in self.indexes.values():
+            local_index.close()
+
+def _query_latencies(es, index_name, query, stop, latencies):
+    while not stop.is_set():
+        start = time.perf_counter()
+        es.search(index=index_name, body={"query": query, "size": 10})
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.01)
+
+def _percentiles(latencies):
+    if not latencies:
+        return "no searches"
+    p50, p99 = np.percentile(np.array(latencies) * 1000, [50, 99])
+    return f"{len(latencies)} searches, p50 {p50:.1f} ms, p99 {p99:.1f} ms, max {max(latencies) * 1000:.1f} ms"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Append to and delete from an index of immutable segments "
+                                                 "while it is searched.")
+    parser.add_argument("--source", default="sample_data.csv", help="CSV file or Excel workbook to append")
+    parser.add_argument("--index", default="articles_pipeline", choices=list(INDEX_REGISTRY))
+    parser.add_argument("--directory", default=DEFAULT_LSM_DIR, help="directory holding the indices")
+    parser.add_argument("--limit", type=int, default=0, help="rows to append (0 appends every row)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per bulk chunk")
+    parser.add_argument("--buffer-docs", type=int, default=DEFAULT_BUFFER_DOCS,
+                        help="documents held in memory before a segment is written")
+    parser.add_argument("--delete", type=int, default=100, help="cases to delete after appending")
+    parser.add_argument("--recreate", action="store_true", help="start from an empty index")
+    args = parser.parse_args(argv)
+
+    es = LSMSearchEngine(args.directory, buffer_docs=args.buffer_docs)
+    if args.recreate or not es.indices.exists(index=args.index):
+        create_index(es, args.index, INDEX_REGISTRY[args.index]["settings"])
+    local_index = es.get_index(args.index)
+    print(f"Index '{args.index}' in {local_index.directory}: {local_index.searcher().doc_count()} documents, "
+          f"{len(local_index.units)} segments.")
+
+    # Searches run throughout, to show their latency while segments are written and merged.
+    query = {"match": {"content" if INDEX_REGISTRY[args.index]["documents"] == "content" else "City_residence":
+                       "Jakarta"}}
+    stop = threading.Event()
+    latencies = []
+    searcher = threading.Thread(target=_query_latencies, args=(es, args.index, query, stop, latencies), daemon=True)
+    searcher.start()
+
+    start = time.perf_counter()
+    index_documents(es, args.index, args.source, args.chunk_size, args.limit or None, id_columns=["case"])
+    print(f"Appended in {time.perf_counter() - start:.2f}s; searches meanwhile: {_percentiles(latencies)}")
+
+    es.indices.refresh(index=args.index)
+    snapshot = local_index.searcher()
+    cases = [snapshot.ids[doc] for doc in snapshot.id_to_doc.values()[:args.delete]]
+    es.bulk([{"delete": {"_index": args.index, "_id": case}} for case in cases])
+    es.indices.refresh(index=args.index)
+    print(f"Deleted {len(cases)} cases: {local_index.searcher().doc_count()} documents are left.")
+
+    latencies.clear()
+    start = time.perf_counter()
+    es.indices.forcemerge(index=args.index)
+    print(f"Merged in {time.perf_counter() - start:.2f}s; searches meanwhile: {_percentiles(latencies)}")
+    stop.set()
+    searcher.join()
+    res = es.search(index=args.index, body={"query": query, "size": 3})
+    print(f"{query}: {res['hits']['total']['value']} hits")
+    print(local_index.stats())
+    es.close()
+
+if __name__ == "__main__":
+    main()
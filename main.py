@@ -1,10 +1,8 @@
-import pandas as pd
+from data_cache import load_frame
 
-# Load the dataset CSV into a DataFrame
-df = pd.read_excel(
-    "/Users/jack/Desktop/project/cursor/ce306_python/mock survey data.xlsx",
-    engine='openpyxl'  # Explicitly specify engine if needed
-)
+# Load the dataset into a DataFrame. The workbook is converted once into a columnar cache
+# (see data_cache.py), so later runs read memory-mapped columns instead of parsing the XLSX again.
+df = load_frame("mock survey data.xlsx")
 # Select the first 1000 rows
 sample_df = df.head(1000)
 print("Number of documents in sample:", len(sample_df))
@@ -12,4 +10,4 @@ print("Number of documents in sample:", len(sample_df))
 # Save the sample DataFrame to a new CSV file
 sample_df.to_csv("sample_data.csv", index=False)
 
-print("Sample data saved to sample_data.csv")
\ No newline at end of file
+print("Sample data saved to sample_data.csv")
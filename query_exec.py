@@ -0,0 +1,455 @@
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+
+from es_pipeline import connect_es
+from local_engine import BM25_B, BM25_K1, DEFAULT_SIZE, filter_source
+from query_runner import latency_summary
+from segment import DEFAULT_SEGMENT_DIR, Segment, build_segment, open_segment
+
+# Fast evaluation of the project's core query shapes on a segment (see segment.py):
+# conjunctions ("bool.must" of single-term matches, or "match" with operator "and"), "match_phrase",
+# and "match" disjunctions. Conjunctions start from the shortest postings list and look the candidates
+# up in the longer lists through the skip entries, decoding only the blocks that can hold them; phrases
+# are verified from the positions of the candidate documents only; disjunctions keep the top k with
+# MaxScore, which stops reading the lists whose score bounds cannot change the top k.
+# Scores are the same BM25 scores as LocalSearchEngine's.
+
+# Like Elasticsearch, hits are counted exactly up to this many, then reported as a lower bound ("gte").
+DEFAULT_TRACK_TOTAL_HITS = 10000
+
+def _ranges(starts, lengths):
+    """
+    Returns the concatenation of range(start, start + length) for every start and length.
+    """
+    ends = np.cumsum(lengths)
+    return np.repeat(starts - (ends - lengths), lengths) + np.arange(ends[-1] if len(ends) else 0)
+
+def _sorted_unique(values):
+    """
+    np.unique for an array that is already sorted.
+    """
+    keep = np.ones(len(values), dtype=bool)
+    keep[1:] = values[1:] != values[:-1]
+    return values[keep]
+
+def _intersect_sorted(left, right):
+    """
+    Returns the values of the sorted array left that are in the sorted array right.
+    """
+    if not len(right):
+        return right
+    index = np.minimum(np.searchsorted(right, left), len(right) - 1)
+    return left[right[index] == left]
+
+class TermPostings:
+    """
+    The postings of one term in a segment field, read block by block through its skip entries.
+    """
+
+    def __init__(self, field_index, ordinal):
+        self.field_index = field_index
+        self.ordinal = ordinal
+        self.doc_freq = int(field_index.doc_freqs[ordinal])
+        self.max_impact = float(field_index.max_impacts[ordinal])
+        self.skips = field_index.blocks(ordinal)
+        self._blocks = {}
+        self._positions = {}
+
+    def all(self):
+        """
+        Decodes the whole postings list: document ordinals and term frequencies.
+        """
+        return self.field_index.docs(self.ordinal)
+
+    def _block(self, block):
+        if block not in self._blocks:
+            self._blocks[block] = self.field_index.block_docs(self.ordinal, block, self.skips)
+        return self._blocks[block]
+
+    def _block_positions(self, block):
+        if block not in self._positions:
+            _, freqs = self._block(block)
+            offsets = np.concatenate([[0], np.cumsum(freqs)])
+            self._positions[block] = (self.field_index.block_positions(self.ordinal, block, freqs, self.skips), offsets)
+        return self._positions[block]
+
+    def _by_block(self, docs):
+        """
+        Groups sorted document ordinals by the block that can hold them: a binary search over the last
+        document of every block (the skip entries), for all the documents at once.
+        Yields (block, start, end) for the slice docs[start:end] of each block.
+        """
+        blocks = np.searchsorted(self.skips[0], docs)
+        blocks_found, starts = np.unique(blocks, return_index=True)
+        ends = np.append(starts[1:], len(docs))
+        for block, start, end in zip(blocks_found.tolist(), starts.tolist(), ends.tolist()):
+            if block < len(self.skips[0]):
+                yield block, start, end
+
+    def seek(self, docs):
+        """
+        Looks up sorted document ordinals in the postings. Returns a mask of the documents found and their
+        term frequencies (0 where not found); only the blocks that can hold one of them are decoded,
+        or the whole list when most blocks are needed.
+        """
+        groups = list(self._by_block(docs))
+        if len(groups) > len(self.skips[0]) // 2:
+            groups = [(self.all(), 0, len(docs))]
+        else:
+            groups = [(self._block(block), start, end) for block, start, end in groups]
+        found = np.zeros(len(docs), dtype=bool)
+        freqs = np.zeros(len(docs), dtype=np.int64)
+        for (block_docs, block_freqs), start, end in groups:
+            wanted = docs[start:end]
+            index = np.minimum(np.searchsorted(block_docs, wanted), len(block_docs) - 1)
+            hit = block_docs[index] == wanted
+            found[start:end] = hit
+            freqs[start:end] = np.where(hit, block_freqs[index], 0)
+        return found, freqs
+
+    def positions(self, docs):
+        """
+        Returns the positions of the term in each of the sorted document ordinals, which must all be in
+        its postings, as two flat arrays: the document of every position, and the position (both sorted).
+        When most blocks are needed, the whole list is decoded at once instead of block by block.
+        """
+        groups = list(self._by_block(docs))
+        if len(groups) > len(self.skips[0]) // 2:
+            all_docs, freqs = self.all()
+            positions = self.field_index.flat_positions(self.ordinal, freqs)
+            offsets = np.cumsum(freqs) - freqs
+            index = np.searchsorted(all_docs, docs)
+            return np.repeat(docs, freqs[index]), positions[_ranges(offsets[index], freqs[index])]
+        doc_parts = []
+        position_parts = []
+        for block, start, end in groups:
+            block_docs, block_freqs = self._block(block)
+            block_positions, offsets = self._block_positions(block)
+            index = np.searchsorted(block_docs, docs[start:end])
+            counts = block_freqs[index]
+            doc_parts.append(np.repeat(docs[start:end], counts))
+            position_parts.append(block_positions[_ranges(offsets[index], counts)])
+        if not doc_parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(doc_parts), np.concatenate(position_parts)
+
+class QueryExecutor:
+    """
+    Runs searches with the supported query shapes on one Segment and returns Elasticsearch-shaped responses.
+    """
+
+    def __init__(self, segment):
+        self.segment = segment
+
+    # -------------------------------------------
+    # Query shapes
+    # -------------------------------------------
+
+    @staticmethod
+    def _field_query(params):
+        (field, value), = params.items()
+        if isinstance(value, dict):
+            return field, value["query"], value.get("operator", "or").lower()
+        return field, value, "or"
+
+    def _terms(self, field, text):
+        return [token for token, _, _, _ in self.segment.analyzer_for(field)(str(text))]
+
+    def plan(self, query):
+        """
+        Returns (kind, clauses) for a supported query, or None: kind is "and" with [(field, terms)],
+        "or" with [(field, terms)] or "phrase" with (field, text).
+        """
+        (query_type, params), = query.items()
+        if query_type in ("match", "match_phrase"):
+            value = next(iter(params.values()), None)
+            if isinstance(value, dict) and "analyzer" in value:
+                # A search-time analyzer: left to LocalSearchEngine.
+                return None
+        if query_type == "match_phrase":
+            field, text, _ = self._field_query(params)
+            return "phrase", (field, text)
+        if query_type == "match":
+            field, text, operator = self._field_query(params)
+            terms = self._terms(field, text)
+            return ("and" if operator == "and" or len(set(terms)) <= 1 else "or"), [(field, terms)]
+        if query_type == "bool" and set(params) == {"must"} and params["must"]:
+            must = params["must"] if isinstance(params["must"], list) else [params["must"]]
+            clauses = []
+            for clause in must:
+                plan = self.plan(clause) if set(clause) == {"match"} else None
+                if plan is None or plan[0] != "and":
+                    return None
+                clauses.extend(plan[1])
+            return "and", clauses
+        return None
+
+    def supports(self, body):
+        """
+        Returns True when a search body can be run by this executor.
+        """
+        unsupported = {"aggs", "aggregations", "sort", "search_after", "pit", "slice", "post_filter"}
+        return not unsupported & set(body) and self.plan(body.get("query") or {"match_all": {}}) is not None
+
+    # -------------------------------------------
+    # Scoring
+    # -------------------------------------------
+
+    def _postings(self, field, terms):
+        """
+        Returns {term: TermPostings} for the distinct terms, with None for the terms not in the field.
+        """
+        field_index = self.segment.postings.get(field)
+        postings = {}
+        for term in dict.fromkeys(terms):
+            ordinal = field_index.lookup(term) if field_index is not None else -1
+            postings[term] = TermPostings(field_index, ordinal) if ordinal >= 0 else None
+        return postings
+
+    def _idf(self, field, doc_freq):
+        doc_count = self.segment.doc_count(field)
+        return math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def _norms(self, field, docs):
+        average_length = self.segment.avg_field_length(field)
+        if not average_length:
+            return np.full(len(docs), BM25_K1)
+        lengths = self.segment.postings[field].lengths[docs]
+        return BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length)
+
+    def _bm25(self, field, idf, freqs, docs):
+        return idf * freqs / (freqs + self._norms(field, docs))
+
+    def _conjunction_docs(self, postings):
+        """
+        Intersects postings lists, shortest first. Returns the matching documents and, for every list,
+        the term frequencies in those documents.
+        """
+        order = sorted(range(len(postings)), key=lambda i: postings[i].doc_freq)
+        docs, freqs = postings[order[0]].all()
+        freqs_by_list = {order[0]: freqs}
+        for i in order[1:]:
+            if not len(docs):
+                break
+            found, freqs = postings[i].seek(docs)
+            docs = docs[found]
+            freqs_by_list = {j: values[found] for j, values in freqs_by_list.items()}
+            freqs_by_list[i] = freqs[found]
+        return docs, [freqs_by_list.get(i, np.zeros(0, dtype=np.int64)) for i in range(len(postings))]
+
+    def conjunction(self, clauses):
+        """
+        Returns the documents matching every term of [(field, terms)] and their summed BM25 scores.
+        """
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0)
+        lists = []
+        for field, terms in clauses:
+            postings = self._postings(field, terms)
+            if not terms or None in postings.values():
+                return empty
+            lists.extend((field, term_postings, terms.count(term)) for term, term_postings in postings.items())
+        docs, freqs = self._conjunction_docs([term_postings for _, term_postings, _ in lists])
+        scores = np.zeros(len(docs))
+        for (field, term_postings, weight), term_freqs in zip(lists, freqs):
+            scores += weight * self._bm25(field, self._idf(field, term_postings.doc_freq), term_freqs, docs)
+        return docs, scores
+
+    def phrase(self, field, text):
+        """
+        Returns the documents containing the phrase and their BM25 scores (the phrase frequency scored
+        with the summed idf of its terms, as LocalSearchEngine does).
+        """
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0)
+        tokens = self.segment.analyzer_for(field)(str(text))
+        if not tokens:
+            return empty
+        first_position = tokens[0][1]
+        phrase = [(token, position - first_position) for token, position, _, _ in tokens]
+        by_term = self._postings(field, [token for token, _ in phrase])
+        if None in by_term.values():
+            return empty
+        idf = sum(self._idf(field, by_term[token].doc_freq) for token, _ in phrase)
+
+        candidates, _ = self._conjunction_docs(list(by_term.values()))
+        # Phrase starts are (doc, position - offset) keys present for every token of the phrase.
+        starts = None
+        for token, offset in phrase:
+            if not len(candidates):
+                return empty
+            docs, positions = by_term[token].positions(candidates)
+            keep = positions >= offset
+            # Sorted by document then position, so the keys are sorted too.
+            keys = (docs[keep] << 32) | (positions[keep] - offset)
+            starts = _sorted_unique(keys) if starts is None else _intersect_sorted(starts, keys)
+            candidates = _sorted_unique(starts >> 32)
+        docs, phrase_freqs = np.unique(starts >> 32, return_counts=True)
+        return docs, self._bm25(field, idf, phrase_freqs, docs)
+
+    @staticmethod
+    def _kth_score(scores, k):
+        return np.partition(scores, len(scores) - k)[len(scores) - k] if len(scores) >= k else -math.inf
+
+    def disjunction(self, field, terms, k, track_total_hits=DEFAULT_TRACK_TOTAL_HITS):
+        """
+        Returns the documents matching any of the terms with their BM25 scores, for the top k, and the
+        total hit count and its relation. With MaxScore, lists are read in decreasing order of their
+        score bound (idf * the term's largest tf / (tf + norm)); once the bounds of the remaining lists
+        add up to less than the k-th best score so far, no document only in those lists can enter the
+        top k, so they are only probed for the current candidates, whose bounds are checked first.
+        That early termination is used once track_total_hits hits have been counted.
+        """
+        lists = []
+        for term, term_postings in self._postings(field, terms).items():
+            # Terms that are not in the field match nothing and add nothing.
+            if term_postings is None:
+                continue
+            weight = terms.count(term)
+            idf = self._idf(field, term_postings.doc_freq)
+            lists.append((term_postings, weight * idf, weight * idf * term_postings.max_impact))
+        lists.sort(key=lambda entry: -entry[2])
+        remaining = np.cumsum([bound for _, _, bound in lists][::-1])[::-1] if lists else []
+
+        docs = np.zeros(0, dtype=np.int64)
+        scores = np.zeros(0)
+        threshold = -math.inf
+        i = 0
+        while i < len(lists):
+            may_stop = track_total_hits is False or (track_total_hits is not True and len(docs) >= track_total_hits)
+            if may_stop and remaining[i] < threshold:
+                break
+            term_postings, weight, _ = lists[i]
+            list_docs, freqs = term_postings.all()
+            docs, inverse = np.unique(np.concatenate([docs, list_docs]), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate([scores, weight * self._bm25(field, 1.0, freqs, list_docs)]),
+                                 minlength=len(docs))
+            threshold = self._kth_score(scores, k)
+            i += 1
+        total, relation = len(docs), "eq"
+        for j in range(i, len(lists)):
+            relation = "gte"
+            alive = scores + remaining[j] >= threshold
+            docs, scores = docs[alive], scores[alive]
+            term_postings, weight, _ = lists[j]
+            found, freqs = term_postings.seek(docs)
+            scores[found] += weight * self._bm25(field, 1.0, freqs[found], docs[found])
+            threshold = self._kth_score(scores, k)
+        return docs, scores, total, relation
+
+    # -------------------------------------------
+    # Search
+    # -------------------------------------------
+
+    @staticmethod
+    def top_k(docs, scores, k):
+        """
+        Returns the positions of the k best (score descending, then document order) without sorting every hit.
+        """
+        if len(scores) > k:
+            candidates = np.flatnonzero(scores >= QueryExecutor._kth_score(scores, k))
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.lexsort((docs[candidates], -scores[candidates]))][:k]
+
+    def search(self, body):
+        """
+        Executes a search body (query, size, from, _source, track_total_hits) with a supported query.
+        """
+        start = time.perf_counter()
+        query = body.get("query") or {"match_all": {}}
+        size = body.get("size", DEFAULT_SIZE)
+        from_ = body.get("from", 0)
+        track_total_hits = body.get("track_total_hits", DEFAULT_TRACK_TOTAL_HITS)
+        plan = self.plan(query)
+        if plan is None:
+            raise ValueError(f"Unsupported query for the segment executor: {query}")
+        kind, clauses = plan
+        relation = "eq"
+        if kind == "and":
+            docs, scores = self.conjunction(clauses)
+            total = len(docs)
+        elif kind == "phrase":
+            docs, scores = self.phrase(*clauses)
+            total = len(docs)
+        else:
+            (field, terms), = clauses
+            docs, scores, total, relation = self.disjunction(field, terms, from_ + size, track_total_hits)
+
+        best = self.top_k(docs, scores, from_ + size)
+        hits = []
+        for i in best[from_:].tolist():
+            doc = int(docs[i])
+            hit = {"_index": self.segment.name, "_id": self.segment.ids[doc], "_score": float(scores[i])}
+            source = filter_source(self.segment.get_source(doc), body.get("_source"))
+            if source is not None:
+                hit["_source"] = source
+            hits.append(hit)
+        response = {
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {
+                "total": {"value": total, "relation": relation},
+                "max_score": float(scores[best[0]]) if len(best) else None,
+                "hits": hits,
+            },
+        }
+        if track_total_hits is False:
+            del response["hits"]["total"]
+        response["took"] = int((time.perf_counter() - start) * 1000)
+        return response
+
+def search(es, index_name, body):
+    """
+    Runs a search with QueryExecutor when index_name is a segment opened in an embedded engine
+    (see segment.open_segment) and the body is supported, otherwise with es.search.
+    """
+    local_index = es.get_index(index_name) if hasattr(es, "get_index") else None
+    if isinstance(local_index, Segment):
+        executor = QueryExecutor(local_index)
+        if executor.supports(body):
+            return executor.search(body)
+    return es.search(index=index_name, body=body)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the segment query executor with the generic local search.")
+    parser.add_argument("--source", default="sample_data.csv", help="data used to build the segment if it is missing")
+    parser.add_argument("--directory", default=os.path.join(DEFAULT_SEGMENT_DIR, "articles_pipeline"),
+                        help="segment directory of articles_pipeline")
+    parser.add_argument("--repeat", type=int, default=20, help="times each query is run")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(os.path.join(args.directory, "segment.json")):
+        build_segment(args.source, args.directory)
+    es = connect_es(embedded=True)
+    segment = open_segment(es, args.directory)
+    queries = [
+        {"bool": {"must": [{"match": {"content": "Indonesian"}}, {"match": {"content": "tourist"}}]}},
+        {"bool": {"must": [{"match": {"content": "jakarta"}}, {"match": {"content": "hotel"}}]}},
+        {"match_phrase": {"content": "Indonesian tourist"}},
+        {"match_phrase": {"content": "holiday rest relax"}},
+        {"match": {"content": "Singapore hotel business"}},
+    ]
+    for query in queries:
+        body = {"query": query, "size": 10}
+        fast = search(es, segment.name, body)
+        generic = es.search(index=segment.name, body=body)
+        same = ([(hit["_id"], round(hit["_score"], 6)) for hit in fast["hits"]["hits"]]
+                == [(hit["_id"], round(hit["_score"], 6)) for hit in generic["hits"]["hits"]])
+        timings = {}
+        for name, run in (("executor", lambda: search(es, segment.name, body)),
+                          ("generic", lambda: es.search(index=segment.name, body=body))):
+            latencies = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                run()
+                latencies.append(time.perf_counter() - start)
+            timings[name] = latency_summary(latencies)["p50_ms"]
+        total = fast["hits"]["total"]
+        print(f"{query}: {total['value']} hits ({total['relation']}), same top 10: {same}, "
+              f"p50 {timings['executor']:.2f} ms vs {timings['generic']:.2f} ms generic")
+
+if __name__ == "__main__":
+    main()
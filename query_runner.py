@@ -0,0 +1,177 @@
+import argparse
+import itertools
+import json
+import threading
+import time
+
+import numpy as np
+
+from es_pipeline import connect_es, create_index, index_documents
+from index_settings import INDEX_REGISTRY
+
+# Runs a file of query bodies in _msearch batches, either once (printing each result) or as a
+# closed-loop load test, and reports throughput and latency percentiles.
+# Each line of the queries file is a JSON object: {"index": ..., "description": ..., "body": {...}}.
+
+DEFAULT_QUERIES_FILE = "queries.ndjson"
+DEFAULT_BATCH_SIZE = 10
+
+def load_queries(queries_file, default_index=None):
+    """
+    Reads the queries file and returns a list of {"index", "description", "body"} dicts.
+    A line without "body" is taken to be the query body itself.
+    """
+    queries = []
+    with open(queries_file, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            body = entry.get("body", entry)
+            queries.append({
+                "index": entry.get("index", default_index),
+                "description": entry.get("description", f"Query {line_number}"),
+                "body": body,
+            })
+    return queries
+
+def msearch(es, batch):
+    """
+    Sends a batch of queries as one _msearch request and returns (responses, client latency in seconds).
+    """
+    searches = []
+    for query in batch:
+        searches.append({"index": query["index"]})
+        searches.append(query["body"])
+    start = time.perf_counter()
+    response = es.msearch(searches=searches)
+    return response["responses"], time.perf_counter() - start
+
+def latency_summary(latencies):
+    """
+    Returns count, mean and p50/p95/p99/max of a list of latencies in seconds, converted to milliseconds.
+    """
+    if not len(latencies):
+        return {"count": 0}
+    values = np.asarray(latencies, dtype=float) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": len(values), "mean_ms": float(values.mean()), "p50_ms": float(p50),
+            "p95_ms": float(p95), "p99_ms": float(p99), "max_ms": float(values.max())}
+
+def _batches(queries, batch_size):
+    return [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+
+def run_queries(es, queries, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Runs every query once in _msearch batches and prints the hit count and server time of each.
+    Returns the report of the run.
+    """
+    latencies = []
+    took = []
+    failed = 0
+    start = time.perf_counter()
+    for batch in _batches(queries, batch_size):
+        responses, latency = msearch(es, batch)
+        latencies.append(latency)
+        for query, response in zip(batch, responses):
+            if "error" in response:
+                failed += 1
+                print(f"{query['description']}: failed ({response['error']})")
+                continue
+            took.append(response["took"] / 1000)
+            print(f"{query['description']}: {response['hits']['total']['value']} hits in {response['took']} ms")
+    elapsed = time.perf_counter() - start
+    return _report(len(queries), failed, latencies, took, elapsed, batch_size, concurrency=1)
+
+def load_test(es, queries, concurrency=4, duration=30.0, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Closed-loop load generation: concurrency threads each send the next _msearch batch as soon as their
+    previous one returns, cycling through the queries, until duration seconds have passed.
+    Returns a report with throughput and request latency percentiles.
+    """
+    batches = itertools.cycle(_batches(queries, batch_size))
+    lock = threading.Lock()
+    latencies = []
+    took = []
+    counts = {"queries": 0, "failed": 0}
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            with lock:
+                batch = next(batches)
+            responses, latency = msearch(es, batch)
+            with lock:
+                latencies.append(latency)
+                counts["queries"] += len(batch)
+                for response in responses:
+                    if "error" in response:
+                        counts["failed"] += 1
+                    else:
+                        took.append(response["took"] / 1000)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return _report(counts["queries"], counts["failed"], latencies, took, elapsed, batch_size, concurrency)
+
+def _report(queries, failed, latencies, took, elapsed, batch_size, concurrency):
+    return {
+        "queries": queries,
+        "failed": failed,
+        "requests": len(latencies),
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        "queries_per_s": queries / elapsed if elapsed else 0.0,
+        "requests_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "request_latency": latency_summary(latencies),
+        "server_took": latency_summary(took),
+    }
+
+def print_report(report):
+    print(f"\n{report['queries']} queries ({report['failed']} failed) in {report['requests']} _msearch requests "
+          f"over {report['elapsed_s']:.2f}s with {report['concurrency']} client(s).")
+    print(f"Throughput: {report['queries_per_s']:.1f} queries/s, {report['requests_per_s']:.1f} requests/s")
+    for name in ("request_latency", "server_took"):
+        summary = report[name]
+        if summary["count"]:
+            print(f"{name}: p50 {summary['p50_ms']:.2f} ms, p95 {summary['p95_ms']:.2f} ms, "
+                  f"p99 {summary['p99_ms']:.2f} ms, max {summary['max_ms']:.2f} ms")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run query bodies in _msearch batches or as a load test.")
+    parser.add_argument("--queries", default=DEFAULT_QUERIES_FILE, help="NDJSON file of queries")
+    parser.add_argument("--index", default="articles", help="index for queries that do not name one")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="queries per _msearch request")
+    parser.add_argument("--load", action="store_true", help="run a closed-loop load test instead of a single pass")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent clients in load mode")
+    parser.add_argument("--duration", type=float, default=30.0, help="load test duration in seconds")
+    parser.add_argument("--report", default=None, help="write the report as JSON to this file")
+    parser.add_argument("--embedded", action="store_true",
+                        help="load sample_data.csv into the in-process search engine and query it")
+    args = parser.parse_args(argv)
+
+    queries = load_queries(args.queries, args.index)
+    es = connect_es(embedded=args.embedded)
+    if args.embedded:
+        for index_name in sorted({query["index"] for query in queries}):
+            entry = INDEX_REGISTRY.get(index_name, {"settings": {}})
+            create_index(es, index_name, entry["settings"])
+            index_documents(es, index_name, "sample_data.csv", limit=1000)
+
+    if args.load:
+        report = load_test(es, queries, args.concurrency, args.duration, args.batch_size)
+    else:
+        report = run_queries(es, queries, args.batch_size)
+    print_report(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from es_pipeline import connect_es, create_index, index_documents, index_generation, search_documents
+from index_settings import PIPELINE_SETTINGS
+
+# A client-side cache of search responses, for dashboards that send the same queries over and over.
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL = 60.0
+
+def canonical_query(query):
+    """
+    Returns a query body as a canonical string, so bodies that differ only in key order share a cache entry.
+    """
+    return json.dumps(query, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+class SearchCache:
+    """
+    Caches search responses keyed by (index, canonical query body, index generation).
+    The generation comes from es_pipeline: create_index, index_documents, the alias switch of
+    reindex_with_alias, build_indices and delta_sync bump it (writers once the index is refreshed),
+    so a changed index is never answered from results cached before the change. Entries also expire ttl seconds after they were stored
+    (which covers writes made by other processes), and the least recently used entry is evicted
+    beyond max_entries. Cached responses are shared between callers and must not be modified.
+    """
+
+    def __init__(self, es, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, clock=time.monotonic):
+        self.es = es
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def search(self, index_name, query):
+        """
+        Returns the response to a search, from the cache when possible.
+        """
+        key = (index_name, canonical_query(query), index_generation(index_name))
+        now = self.clock()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                expires_at, response = entry
+                if expires_at > now:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return response
+                del self._cache[key]
+                self.expirations += 1
+            self.misses += 1
+
+        response = self.es.search(index=index_name, body=query)
+        # Partial results are not worth keeping.
+        if not response.get("timed_out") and not response.get("_shards", {}).get("failed"):
+            with self._lock:
+                self._cache[key] = (self.clock() + self.ttl, response)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+                    self.evictions += 1
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def cache_info(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "expirations": self.expirations, "size": len(self._cache), "max_entries": self.max_entries,
+                    "ttl": self.ttl}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show the search result cache on the example queries.")
+    parser.add_argument("--repeat", type=int, default=1000, help="times each query is sent")
+    parser.add_argument("--ttl", type=float, default=DEFAULT_TTL, help="seconds a cached response stays valid")
+    parser.add_argument("--embedded", action="store_true", help="use the in-process search engine")
+    args = parser.parse_args(argv)
+
+    es = connect_es(embedded=args.embedded)
+    index_name = "articles_pipeline"
+    create_index(es, index_name, PIPELINE_SETTINGS)
+    index_documents(es, index_name, "sample_data.csv", limit=1000)
+
+    cache = SearchCache(es, ttl=args.ttl)
+    queries = [
+        {"query": {"match": {"content": "Singapore"}}},
+        {"query": {"bool": {"must": [{"match": {"content": "Indonesian"}}, {"match": {"content": "tourist"}}]}}},
+        {"query": {"match_phrase": {"content": "Indonesian tourist"}}},
+    ]
+    for query in queries:
+        start = time.perf_counter()
+        cache.search(index_name, query)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            cache.search(index_name, query)
+        cached = (time.perf_counter() - start) / args.repeat
+        print(f"{canonical_query(query)}: {first * 1e6:.0f} us uncached, {cached * 1e6:.1f} us cached")
+
+    # Writing to the index bumps its generation (after refreshing it), so the next search goes to the cluster again.
+    index_documents(es, index_name, "sample_data.csv", limit=10)
+    search_documents(es, index_name, queries[0], "Query 1 after re-indexing", cache=cache)
+    print(cache.cache_info())
+
+if __name__ == "__main__":
+    main()
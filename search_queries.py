@@ -80,21 +80,21 @@
 
 
 
-from elasticsearch import Elasticsearch
+import argparse
+
+from es_pipeline import DEFAULT_ES_HOST, connect_es, index_documents
+
+parser = argparse.ArgumentParser(description="Run three example queries against the articles index.")
+parser.add_argument("--host", default=None, help=f"Elasticsearch server (default: $ES_HOST or {DEFAULT_ES_HOST})")
+parser.add_argument("--embedded", action="store_true",
+                    help="run the queries against the in-process search engine instead of a cluster")
+args = parser.parse_args()
+embedded = args.embedded
 
 # -------------------------------------------
 # Step 1: Connect to Elasticsearch using HTTPS
 # -------------------------------------------
-es = Elasticsearch(
-    "https://localhost:9200",
-    basic_auth=("elastic", "password"),
-    verify_certs=False
-)
-
-if not es.ping():
-    raise ValueError("Connection failed: Ensure Elasticsearch is running on https://localhost:9200")
-else:
-    print("Connected to Elasticsearch.")
+es = connect_es(embedded=embedded, host=args.host)
 
 # -------------------------------------------
 # Step 2: Specify the index name
@@ -102,6 +102,11 @@ else:
 # This should be the index where your 1000 documents were indexed.
 index_name = "articles"
 
+# The embedded engine starts empty, so load the same 1000 documents into it first.
+if embedded:
+    es.indices.create(index=index_name)
+    index_documents(es, index_name, "sample_data.csv", limit=1000)
+
 # -------------------------------------------
 # Step 3: Define three example queries that should produce positive hits
 # -------------------------------------------
@@ -0,0 +1,557 @@
+import argparse
+import bisect
+import json
+import os
+import time
+from array import array
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+from documents import build_content_documents, build_ids, build_sources
+from es_pipeline import DEFAULT_CHUNK_SIZE, bump_generation, connect_es, iter_source_chunks
+from index_settings import INDEX_REGISTRY
+from local_engine import BM25_B, BM25_K1, LocalIndex
+
+# An immutable on-disk segment of a local index, opened memory-mapped.
+# A segment is a directory with a manifest (segment.json, written last) and, per indexed field,
+# a term dictionary sorted by UTF-8 bytes, postings and positions as varints in flat byte files
+# with one offset per term, the field lengths and, for query_exec, skip entries and score bounds.
+# Postings are written in blocks of SKIP_INTERVAL documents (the block's doc id deltas, then its
+# term frequencies); terms with more than one block have one skip entry per block (last doc id,
+# postings and positions byte offsets), so a reader can jump to the block holding a document.
+# Positions are deltas within each document. Stored fields are JSON documents in one byte file.
+# Opening a segment reads only the manifest; the operating system pages the files in on use
+# and shares the pages between processes that open the same segment.
+
+MANIFEST_FILE = "segment.json"
+SEGMENT_FORMAT_VERSION = 2
+SKIP_INTERVAL = 128
+# dtypes of the arrays of a field with one entry per term (offsets have one more), per skip entry
+# and per document.
+TERM_ARRAY_DTYPES = {"terms.offsets": np.int64, "postings.offsets": np.int64, "positions.offsets": np.int64,
+                     "skip_starts": np.int64, "doc_freqs": np.int32, "max_impacts": np.float64}
+SKIP_ARRAY_DTYPES = {"skip_docs": np.int64, "skip_postings": np.int64, "skip_positions": np.int64}
+LENGTHS_DTYPE = np.int32
+DEFAULT_SEGMENT_DIR = "segments"
+# Tokens encoded per batch when a segment is written, which bounds the writer's temporary arrays.
+TERM_BATCH_TOKENS = 1000000
+
+# -------------------------------------------
+# Varints
+# -------------------------------------------
+
+def encode_varints(values):
+    """
+    Encodes non-negative integers as LEB128 varints (7 bits per byte, high bit set on all but the last byte).
+    Returns the bytes and the encoded size of each value.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.uint8)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        sizes += rest > 0
+        rest >>= np.uint64(7)
+    ends = np.cumsum(sizes, dtype=np.int64)
+    starts = ends - sizes
+    encoded = np.empty(int(ends[-1]) if len(values) else 0, dtype=np.uint8)
+    for k in range(int(sizes.max()) if len(values) else 0):
+        selected = sizes > k
+        low_bits = (values[selected] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (sizes[selected] > k + 1).astype(np.uint64) << np.uint64(7)
+        encoded[starts[selected] + k] = low_bits | more
+    return encoded.tobytes(), sizes
+
+def decode_varints(data):
+    """
+    Decodes a buffer of LEB128 varints (bytes or a uint8 array) into an int64 array.
+    """
+    data = np.frombuffer(data, dtype=np.uint8) if isinstance(data, (bytes, bytearray, memoryview)) else data
+    if not len(data):
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty(len(ends), dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shifts = (np.arange(len(data)) - np.repeat(starts, ends - starts + 1)) * 7
+    parts = (data & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.add.reduceat(parts, starts).astype(np.int64)
+
+def _map_bytes(path):
+    """
+    Memory-maps a byte file read-only (an empty file gives an empty array, which mmap does not allow).
+    """
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+def _block_layout(doc_freq, skip_interval):
+    """
+    Returns the indices of the doc id deltas and of the frequencies in the decoded postings of a term
+    with doc_freq documents (each block holds its deltas, then its frequencies).
+    """
+    i = np.arange(doc_freq)
+    block_start = i - i % skip_interval
+    block_size = np.minimum(skip_interval, doc_freq - block_start)
+    doc_indices = block_start + i
+    return doc_indices, doc_indices + block_size
+
+def _absolute_positions(deltas, freqs):
+    """
+    Turns position deltas, which restart in every document, into positions (freqs tokens per document).
+    """
+    if not len(deltas):
+        return deltas
+    totals = np.cumsum(deltas)
+    starts = np.cumsum(freqs) - freqs
+    before = totals[starts] - deltas[starts]
+    return totals - np.repeat(before, freqs)
+
+# -------------------------------------------
+# Reading
+# -------------------------------------------
+
+class _StringTable(Sequence):
+    """
+    A read-only sequence of byte strings stored back to back, with n + 1 offsets.
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+class _Strings(_StringTable):
+    def __getitem__(self, i):
+        return super().__getitem__(i).decode("utf-8")
+
+class _StoredFields(_StringTable):
+    def __getitem__(self, i):
+        return json.loads(super().__getitem__(i))
+
+class _DocIds(Mapping):
+    """
+    Maps document ids to ordinals. The id -> ordinal dict is only built on the first lookup by id;
+    iterating over the ordinals (values(), as match_all and range queries do) does not need it.
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+        self._lookup = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __getitem__(self, doc_id):
+        if self._lookup is None:
+            self._lookup = {value: doc for doc, value in enumerate(self.ids)}
+        return self._lookup[doc_id]
+
+    def values(self):
+        return range(len(self.ids))
+
+class FieldIndex:
+    """
+    The memory-mapped inverted index of one field of a segment.
+    """
+
+    def __init__(self, directory, entry):
+        def path(suffix):
+            return os.path.join(directory, f"{entry['file']}.{suffix}")
+
+        self.doc_count = entry["doc_count"]
+        self.skip_interval = entry["skip_interval"]
+        self.total_length = entry["total_length"]
+        self.terms = _StringTable(_map_bytes(path("terms")), np.load(path("terms.offsets.npy"), mmap_mode="r"))
+        self.doc_freqs = np.load(path("doc_freqs.npy"), mmap_mode="r")
+        self.postings = _map_bytes(path("postings"))
+        self.postings_offsets = np.load(path("postings.offsets.npy"), mmap_mode="r")
+        self.positions = _map_bytes(path("positions"))
+        self.positions_offsets = np.load(path("positions.offsets.npy"), mmap_mode="r")
+        self.lengths = np.load(path("lengths.npy"), mmap_mode="r")
+        self.max_impacts = np.load(path("max_impacts.npy"), mmap_mode="r")
+        self.skip_starts = np.load(path("skip_starts.npy"), mmap_mode="r")
+        self.skip_docs = np.load(path("skip_docs.npy"), mmap_mode="r")
+        self.skip_postings = np.load(path("skip_postings.npy"), mmap_mode="r")
+        self.skip_positions = np.load(path("skip_positions.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return self.lookup(term) >= 0
+
+    def lookup(self, term):
+        """
+        Returns the ordinal of a term in the dictionary (binary search), or -1.
+        """
+        key = term.encode("utf-8")
+        ordinal = bisect.bisect_left(self.terms, key)
+        return ordinal if ordinal < len(self.terms) and self.terms[ordinal] == key else -1
+
+    def docs(self, ordinal):
+        """
+        Returns the document ordinals of a term and the term's frequency in each, as int64 arrays.
+        """
+        values = decode_varints(self.postings[self.postings_offsets[ordinal]:self.postings_offsets[ordinal + 1]])
+        doc_indices, freq_indices = _block_layout(int(self.doc_freqs[ordinal]), self.skip_interval)
+        # The first delta of a block is relative to the last document of the previous block.
+        return np.cumsum(values[doc_indices]), values[freq_indices]
+
+    def blocks(self, ordinal):
+        """
+        Returns the skip entries of a term: the last document of each block and the byte offsets of
+        each block in the postings and positions files. A single-block term has no stored entries;
+        its block ends past the last document of the segment.
+        """
+        start, end = self.skip_starts[ordinal], self.skip_starts[ordinal + 1]
+        if start == end:
+            return (np.array([len(self.lengths)]), self.postings_offsets[ordinal:ordinal + 1],
+                    self.positions_offsets[ordinal:ordinal + 1])
+        return self.skip_docs[start:end], self.skip_postings[start:end], self.skip_positions[start:end]
+
+    def block_docs(self, ordinal, block, skips=None):
+        """
+        Decodes one block of a term's postings: its document ordinals and term frequencies.
+        """
+        last_docs, postings_starts, _ = skips or self.blocks(ordinal)
+        end = postings_starts[block + 1] if block + 1 < len(postings_starts) else self.postings_offsets[ordinal + 1]
+        values = decode_varints(self.postings[postings_starts[block]:end])
+        count = len(values) // 2
+        base = last_docs[block - 1] if block else 0
+        return base + np.cumsum(values[:count]), values[count:]
+
+    def block_positions(self, ordinal, block, freqs, skips=None):
+        """
+        Decodes the positions of one block of a term's postings, given the block's term frequencies:
+        returns every position, in document order, as one flat array.
+        """
+        _, _, positions_starts = skips or self.blocks(ordinal)
+        end = (positions_starts[block + 1] if block + 1 < len(positions_starts)
+               else self.positions_offsets[ordinal + 1])
+        return _absolute_positions(decode_varints(self.positions[positions_starts[block]:end]), freqs)
+
+    def flat_positions(self, ordinal, freqs):
+        """
+        Returns the positions of a term in every document of its postings (given their term frequencies),
+        in document order, as one flat array.
+        """
+        deltas = decode_varints(self.positions[self.positions_offsets[ordinal]:self.positions_offsets[ordinal + 1]])
+        return _absolute_positions(deltas, freqs)
+
+    def positions_of(self, ordinal, freqs):
+        """
+        Returns the positions of a term in every document of its postings, one array per document.
+        """
+        return np.split(self.flat_positions(ordinal, freqs), np.cumsum(freqs)[:-1])
+
+class Segment(LocalIndex):
+    """
+    A read-only, memory-mapped LocalIndex. It has the reader interface used by LocalSearchEngine
+    (doc_count, avg_field_length, field_length, term_postings, get_source, doc_value, analyzer_for),
+    so it can be searched like an index built in memory (see open_segment).
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != SEGMENT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported segment format {manifest.get('version')} in {directory}")
+        super().__init__(manifest["name"], manifest["body"])
+        self.directory = directory
+        self.manifest = manifest
+        self.ids = _Strings(_map_bytes(os.path.join(directory, "ids")),
+                            np.load(os.path.join(directory, "ids.offsets.npy"), mmap_mode="r"))
+        self.id_to_doc = _DocIds(self.ids)
+        self.sources = _StoredFields(_map_bytes(os.path.join(directory, "stored")),
+                                     np.load(os.path.join(directory, "stored.offsets.npy"), mmap_mode="r"))
+        self.postings = {field: FieldIndex(directory, entry) for field, entry in manifest["fields"].items()}
+
+    def index(self, doc_id, source):
+        raise ValueError(f"Segment {self.name} is read-only")
+
+    def delete(self, doc_id):
+        raise ValueError(f"Segment {self.name} is read-only")
+
+    def doc_count(self, field=None):
+        if field is None:
+            return len(self.ids)
+        return self.postings[field].doc_count if field in self.postings else 0
+
+    def avg_field_length(self, field):
+        count = self.doc_count(field)
+        return self.postings[field].total_length / count if count else 0.0
+
+    def field_length(self, field, doc):
+        return int(self.postings[field].lengths[doc])
+
+    def term_postings(self, field, term):
+        """
+        Returns {doc: positions} for a term, or an empty dict.
+        """
+        field_index = self.postings.get(field)
+        ordinal = field_index.lookup(term) if field_index is not None else -1
+        if ordinal < 0:
+            return {}
+        docs, freqs = field_index.docs(ordinal)
+        positions = field_index.positions_of(ordinal, freqs)
+        return dict(zip(docs.tolist(), (doc_positions.tolist() for doc_positions in positions)))
+
+def open_segment(es, directory):
+    """
+    Opens a segment and registers it in an embedded engine (LocalSearchEngine) under its index name.
+    """
+    segment = Segment(directory)
+    es.indexes[segment.name] = segment
+    bump_generation(segment.name)
+    return segment
+
+# -------------------------------------------
+# Writing
+# -------------------------------------------
+
+class _FieldBuffer:
+    """
+    The tokens of one field collected by SegmentWriter: parallel arrays of term number, document and position.
+    """
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.terms = array("I")
+        self.docs = array("I")
+        self.positions = array("I")
+        self.length_docs = array("I")
+        self.lengths = array("I")
+
+class SegmentWriter:
+    """
+    Writes a segment from (doc_id, source) pairs, analyzing the fields with the index's settings as
+    LocalIndex does. Tokens are buffered as compact arrays (12 bytes each) and the postings are sorted
+    and encoded with NumPy in close().
+    """
+
+    def __init__(self, directory, name, body=None):
+        self.directory = directory
+        self.mapping = LocalIndex(name, body)
+        self.fields = {}
+        self.doc_ids = set()
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        # An overwritten segment is invalid until its new manifest is written.
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        self._ids = open(os.path.join(directory, "ids"), "wb")
+        self._id_offsets = array("q", [0])
+        self._stored = open(os.path.join(directory, "stored"), "wb")
+        self._stored_offsets = array("q", [0])
+
+    def add(self, doc_id, source):
+        doc_id = str(doc_id)
+        if doc_id in self.doc_ids:
+            raise ValueError(f"Duplicate document id in segment: {doc_id}")
+        self.doc_ids.add(doc_id)
+        doc = len(self._id_offsets) - 1
+        encoded_id = doc_id.encode("utf-8")
+        self._ids.write(encoded_id)
+        self._id_offsets.append(self._id_offsets[-1] + len(encoded_id))
+        stored = json.dumps(source, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self._stored.write(stored)
+        self._stored_offsets.append(self._stored_offsets[-1] + len(stored))
+
+        for field, text in self.mapping._text_fields(source):
+            tokens = self.mapping.analyzer_for(field)(text)
+            buffer = self.fields.setdefault(field, _FieldBuffer())
+            vocabulary = buffer.vocabulary
+            for token, position, _, _ in tokens:
+                buffer.terms.append(vocabulary.setdefault(token, len(vocabulary)))
+                buffer.docs.append(doc)
+                buffer.positions.append(position)
+            buffer.length_docs.append(doc)
+            buffer.lengths.append(len(tokens))
+
+    def _write_field(self, number, buffer, doc_count):
+        """
+        Sorts and encodes the postings of one field and returns its manifest entry.
+        The tokens are sorted once, then encoded and written TERM_BATCH_TOKENS at a time.
+        """
+        prefix = os.path.join(self.directory, str(number))
+        terms = sorted(term.encode("utf-8") for term in buffer.vocabulary)
+        rank = np.empty(len(terms), dtype=np.int64)
+        rank[[buffer.vocabulary[term.decode("utf-8")] for term in terms]] = np.arange(len(terms))
+        stride = max(doc_count, 1)
+
+        # Tokens were added document by document in position order, so a stable sort on (term, doc)
+        # also orders the positions within each posting.
+        key = rank[np.frombuffer(buffer.terms, dtype=np.uint32)] * stride
+        key += np.frombuffer(buffer.docs, dtype=np.uint32)
+        order = np.argsort(key, kind="stable")
+        key = key[order]
+        position = np.frombuffer(buffer.positions, dtype=np.uint32)[order]
+        del order
+        term_starts = np.searchsorted(key, np.arange(len(terms) + 1) * stride)
+
+        lengths = np.full(doc_count, -1, dtype=LENGTHS_DTYPE)
+        lengths[np.frombuffer(buffer.length_docs, dtype=np.uint32)] = np.frombuffer(buffer.lengths, dtype=np.uint32)
+        total_length = int(np.frombuffer(buffer.lengths, dtype=np.uint32).sum())
+        average_length = total_length / len(buffer.length_docs) if len(buffer.length_docs) else 0.0
+
+        doc_freqs = np.zeros(len(terms), dtype=TERM_ARRAY_DTYPES["doc_freqs"])
+        max_impacts = np.zeros(len(terms), dtype=TERM_ARRAY_DTYPES["max_impacts"])
+        postings_offsets = np.zeros(len(terms) + 1, dtype=TERM_ARRAY_DTYPES["postings.offsets"])
+        positions_offsets = np.zeros(len(terms) + 1, dtype=TERM_ARRAY_DTYPES["positions.offsets"])
+        skip_counts = np.zeros(len(terms), dtype=np.int64)
+        skips = []
+        with open(f"{prefix}.postings", "wb") as postings_file, open(f"{prefix}.positions", "wb") as positions_file:
+            first = 0
+            while first < len(terms):
+                last = int(np.searchsorted(term_starts, term_starts[first] + TERM_BATCH_TOKENS, side="right")) - 1
+                last = min(max(last, first + 1), len(terms))
+                start, end = term_starts[first], term_starts[last]
+                batch_key, batch_position = key[start:end], position[start:end]
+
+                # One posting per (term, doc) pair; its frequency is the number of tokens in the pair.
+                new_pair = np.ones(len(batch_key), dtype=bool)
+                new_pair[1:] = batch_key[1:] != batch_key[:-1]
+                pair_starts = np.flatnonzero(new_pair)
+                freqs = np.diff(np.append(pair_starts, len(batch_key)))
+                pair_term = batch_key[pair_starts] // stride - first
+                pair_doc = batch_key[pair_starts] - (pair_term + first) * stride
+                term_pairs = np.bincount(pair_term, minlength=last - first)
+                term_first_pair = np.cumsum(term_pairs) - term_pairs
+                rank_in_term = np.arange(len(pair_term)) - term_first_pair[pair_term]
+                doc_deltas = np.where(rank_in_term == 0, pair_doc, pair_doc - np.roll(pair_doc, 1))
+                position_deltas = np.where(new_pair, batch_position, batch_position - np.roll(batch_position, 1))
+
+                # Postings of a term, block by block: the block's doc id deltas, then its frequencies.
+                block_start = rank_in_term - rank_in_term % SKIP_INTERVAL
+                block_size = np.minimum(SKIP_INTERVAL, term_pairs[pair_term] - block_start)
+                doc_slots = 2 * term_first_pair[pair_term] + block_start + rank_in_term
+                values = np.empty(2 * len(pair_term), dtype=np.int64)
+                values[doc_slots] = doc_deltas
+                values[doc_slots + block_size] = freqs
+                encoded, sizes = encode_varints(values)
+                postings_file.write(encoded)
+                value_offsets = postings_offsets[first] + np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)])
+                postings_offsets[first + 1:last + 1] = value_offsets[2 * (term_first_pair + term_pairs)]
+
+                encoded, sizes = encode_varints(position_deltas)
+                positions_file.write(encoded)
+                pair_bytes = np.bincount(np.cumsum(new_pair) - 1, weights=sizes, minlength=len(pair_term))
+                pair_offsets = positions_offsets[first] + np.concatenate([[0], np.cumsum(pair_bytes).astype(np.int64)])
+                positions_offsets[first + 1:last + 1] = pair_offsets[term_first_pair + term_pairs]
+
+                # Skip entries for the blocks of terms with more than one block.
+                block_ends = (rank_in_term % SKIP_INTERVAL == SKIP_INTERVAL - 1) | (rank_in_term == term_pairs[pair_term] - 1)
+                block_firsts = np.flatnonzero((rank_in_term % SKIP_INTERVAL == 0) & (term_pairs[pair_term] > SKIP_INTERVAL))
+                skip_counts[first:last] = np.bincount(pair_term[block_firsts], minlength=last - first)
+                skips.append((pair_doc[block_ends & (term_pairs[pair_term] > SKIP_INTERVAL)],
+                              value_offsets[doc_slots[block_firsts]], pair_offsets[block_firsts]))
+
+                # Upper bound of tf / (tf + norm) per term, for MaxScore (see query_exec).
+                if average_length:
+                    norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths[pair_doc] / average_length)
+                else:
+                    norms = np.full(len(pair_doc), BM25_K1)
+                max_impacts[first:last] = np.maximum.reduceat(freqs / (freqs + norms), term_first_pair)
+                doc_freqs[first:last] = term_pairs
+                first = last
+
+        term_offsets = np.zeros(len(terms) + 1, dtype=TERM_ARRAY_DTYPES["terms.offsets"])
+        term_offsets[1:] = np.cumsum([len(t) for t in terms])
+        skip_starts = np.zeros(len(terms) + 1, dtype=TERM_ARRAY_DTYPES["skip_starts"])
+        skip_starts[1:] = np.cumsum(skip_counts)
+
+        with open(f"{prefix}.terms", "wb") as f:
+            f.write(b"".join(terms))
+        np.save(f"{prefix}.terms.offsets.npy", term_offsets)
+        np.save(f"{prefix}.doc_freqs.npy", doc_freqs)
+        np.save(f"{prefix}.postings.offsets.npy", postings_offsets)
+        np.save(f"{prefix}.positions.offsets.npy", positions_offsets)
+        np.save(f"{prefix}.lengths.npy", lengths)
+        np.save(f"{prefix}.max_impacts.npy", max_impacts)
+        np.save(f"{prefix}.skip_starts.npy", skip_starts)
+        for part, (name, dtype) in enumerate(SKIP_ARRAY_DTYPES.items()):
+            parts = [entry[part] for entry in skips]
+            np.save(f"{prefix}.{name}.npy", np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype))
+        return {"file": str(number), "terms": len(terms), "doc_count": len(buffer.length_docs),
+                "total_length": total_length, "skip_interval": SKIP_INTERVAL}
+
+    def close(self):
+        """
+        Writes the postings and the manifest, and returns the manifest.
+        """
+        self._ids.close()
+        self._stored.close()
+        doc_count = len(self._id_offsets) - 1
+        np.save(os.path.join(self.directory, "ids.offsets.npy"), np.frombuffer(self._id_offsets, dtype=np.int64))
+        np.save(os.path.join(self.directory, "stored.offsets.npy"),
+                np.frombuffer(self._stored_offsets, dtype=np.int64))
+        fields = {field: self._write_field(number, buffer, doc_count)
+                  for number, (field, buffer) in enumerate(self.fields.items())}
+        manifest = {"version": SEGMENT_FORMAT_VERSION, "name": self.mapping.name, "body": self.mapping.body,
+                    "doc_count": doc_count, "fields": fields}
+        tmp_file = os.path.join(self.directory, MANIFEST_FILE + ".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_file, os.path.join(self.directory, MANIFEST_FILE))
+        return manifest
+
+def build_segment(source_file, directory, index_name="articles_pipeline", chunk_size=DEFAULT_CHUNK_SIZE,
+                  limit=None):
+    """
+    Writes the documents of a registered index (see INDEX_REGISTRY) built from a source file as a segment,
+    with the same ids and documents as es_pipeline.index_documents.
+    """
+    entry = INDEX_REGISTRY[index_name]
+    start = time.perf_counter()
+    writer = SegmentWriter(directory, index_name, entry["settings"])
+    for chunk in iter_source_chunks(source_file, chunk_size, limit):
+        documents = build_sources(chunk) if entry["documents"] == "source" else build_content_documents(chunk)
+        for doc_id, source in zip(build_ids(chunk), documents):
+            writer.add(doc_id, source)
+    manifest = writer.close()
+    size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    print(f"Wrote segment '{index_name}' with {manifest['doc_count']} documents to {directory} "
+          f"({size / 1e6:.1f} MB) in {time.perf_counter() - start:.2f}s.")
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build an on-disk segment of an index and search it.")
+    parser.add_argument("--source", default="sample_data.csv", help="CSV file or Excel workbook to index")
+    parser.add_argument("--index", default="articles_pipeline", choices=list(INDEX_REGISTRY))
+    parser.add_argument("--directory", default=None, help=f"segment directory (default: {DEFAULT_SEGMENT_DIR}/<index>)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--limit", type=int, default=0, help="maximum rows to index (0 indexes every row)")
+    parser.add_argument("--open-only", action="store_true", help="search an existing segment without rebuilding it")
+    args = parser.parse_args(argv)
+
+    directory = args.directory or os.path.join(DEFAULT_SEGMENT_DIR, args.index)
+    if not args.open_only:
+        build_segment(args.source, directory, args.index, args.chunk_size, args.limit or None)
+
+    es = connect_es(embedded=True)
+    start = time.perf_counter()
+    segment = open_segment(es, directory)
+    print(f"Opened segment '{segment.name}' ({segment.doc_count()} documents) in "
+          f"{(time.perf_counter() - start) * 1000:.1f} ms.")
+    for query in ({"match": {"content": "Singapore"}},
+                  {"bool": {"must": [{"match": {"content": "Indonesian"}}, {"match": {"content": "tourist"}}]}},
+                  {"match_phrase": {"content": "Indonesian tourist"}}):
+        response = es.search(index=segment.name, body={"query": query, "size": 3})
+        ids = [hit["_id"] for hit in response["hits"]["hits"]]
+        print(f"{json.dumps(query)}: {response['hits']['total']['value']} hits, top {ids}")
+
+if __name__ == "__main__":
+    main()
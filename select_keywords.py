@@ -1,19 +1,16 @@
+import argparse
 import json
-from elasticsearch import Elasticsearch
+
+from es_pipeline import DEFAULT_ES_HOST, connect_es
+from index_settings import KEYWORDS_SETTINGS
 
 # -------------------------------------------
 # Step 1: Connect to Elasticsearch using HTTPS
 # -------------------------------------------
-es = Elasticsearch(
-    "https://localhost:9200",
-    basic_auth=("elastic", "password"),
-    verify_certs=False
-)
-
-if not es.ping():
-    raise ValueError("Connection failed: Ensure Elasticsearch is running on https://localhost:9200")
-else:
-    print("Connected to Elasticsearch.")
+parser = argparse.ArgumentParser(description="Index documents with the keyword selection analyzer and print their keywords.")
+parser.add_argument("--host", default=None, help=f"Elasticsearch server (default: $ES_HOST or {DEFAULT_ES_HOST})")
+args = parser.parse_args()
+es = connect_es(host=args.host)
 
 # -------------------------------------------
 # Step 2: Create an index with a custom analyzer for keyword selection
@@ -25,39 +22,7 @@ else:
 # - Apply a shingle filter to generate bigrams and trigrams (while outputting unigrams as well)
 # We remove the similarity configuration so the default BM25 (a TF-IDF variant) is used.
 index_name = "articles_keywords"
-settings = {
-    "settings": {
-        "analysis": {
-            "analyzer": {
-                "keyword_selector": {
-                    "type": "custom",
-                    "tokenizer": "standard",
-                    "filter": [
-                        "lowercase",
-                        "stop",       # removes common English stopwords
-                        "my_shingle"  # custom shingle filter for n-grams
-                    ]
-                }
-            },
-            "filter": {
-                "my_shingle": {
-                    "type": "shingle",
-                    "min_shingle_size": 2,
-                    "max_shingle_size": 3,
-                    "output_unigrams": True  # include original tokens too
-                }
-            }
-        }
-    },
-    "mappings": {
-        "properties": {
-            "content": {
-                "type": "text",
-                "analyzer": "keyword_selector"
-            }
-        }
-    }
-}
+settings = KEYWORDS_SETTINGS  # defined in index_settings.py
 
 # Delete the index if it exists for a clean start
 if es.indices.exists(index=index_name):
@@ -0,0 +1,289 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from es_pipeline import DEFAULT_CHUNK_SIZE, iter_source_chunks
+from index_settings import SURVEY_SPEND_FIELDS
+
+# "Respondents like case X": similarity search over the spend profile of every respondent (the shop_$*
+# and tot*_$ amounts), on CPU with NumPy.
+# - Each respondent is a float32 vector of log(1 + amount) per spend column, standardized per column
+#   (optionally with the Weights_QTR survey weights, so the statistics are those of the visitor population
+#   rather than of the sample) and scaled to unit length, so a dot product is the cosine similarity.
+# - SimilarityIndex answers exact top-k queries for a batch of respondents with one matrix product per
+#   block of rows.
+# - IVFIndex is the approximate index: rows are clustered with spherical k-means around nlist centroids and
+#   a query only scores the rows of its nprobe closest clusters, so the work per query grows with n / nlist
+#   rather than n.
+
+FEATURE_COLUMNS = SURVEY_SPEND_FIELDS
+WEIGHT_COLUMN = "Weights_QTR"
+ID_COLUMN = "case"
+DEFAULT_K = 10
+# Scores computed per matrix product (queries x rows of the block): 4M float32 scores, 16 MB.
+SCORE_BLOCK_SIZE = 1 << 22
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 10
+# Rows per centroid in the k-means training sample.
+KMEANS_SAMPLE_PER_LIST = 64
+DEFAULT_SEED = 42
+
+# -------------------------------------------
+# Features
+# -------------------------------------------
+
+def load_features(source_file, columns=FEATURE_COLUMNS, chunk_size=DEFAULT_CHUNK_SIZE, limit=None):
+    """
+    Reads the case numbers, spend amounts and survey weights of every row, one chunk at a time.
+    Returns (ids as int64, amounts as a float32 matrix with 0 for missing values, weights as float32).
+    """
+    ids, amounts, weights = [], [], []
+    for chunk in iter_source_chunks(source_file, chunk_size, limit):
+        missing = [column for column in [ID_COLUMN, WEIGHT_COLUMN, *columns] if column not in chunk.columns]
+        if missing:
+            raise ValueError(f"Columns not found in {source_file}: {missing}")
+        ids.append(pd.to_numeric(chunk[ID_COLUMN]).to_numpy(dtype=np.int64))
+        amounts.append(chunk[list(columns)].apply(pd.to_numeric, errors="coerce").fillna(0.0).to_numpy(dtype=np.float32))
+        weights.append(pd.to_numeric(chunk[WEIGHT_COLUMN], errors="coerce").fillna(0.0).to_numpy(dtype=np.float32))
+    if not ids:
+        raise ValueError(f"No rows read from {source_file}")
+    return np.concatenate(ids), np.concatenate(amounts), np.concatenate(weights)
+
+def normalize_features(amounts, weights=None):
+    """
+    Turns spend amounts into unit-length float32 feature vectors: log(1 + amount) (spend is heavily skewed),
+    then standardized per column, with the weighted mean and standard deviation when weights are given,
+    then divided by the row's norm. Columns that never vary get 0; rows that are then all 0 stay 0.
+    """
+    features = np.log1p(np.maximum(amounts, 0, dtype=np.float32))
+    if weights is not None and weights.sum() > 0:
+        mean = np.average(features, axis=0, weights=weights)
+        std = np.sqrt(np.average((features - mean) ** 2, axis=0, weights=weights))
+    else:
+        mean = features.mean(axis=0)
+        std = features.std(axis=0)
+    features -= mean.astype(np.float32)
+    features /= np.where(std > 0, std, 1).astype(np.float32)
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    features /= np.where(norms > 0, norms, 1)
+    return features
+
+def _merge_top_k(best_scores, best_rows, scores, rows, k):
+    """
+    Merges a block of (queries x candidates) scores into the best k scores and rows found so far.
+    """
+    scores = np.concatenate([best_scores, scores], axis=1)
+    rows = np.concatenate([best_rows, rows], axis=1)
+    if scores.shape[1] > k:
+        keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, keep, axis=1)
+        rows = np.take_along_axis(rows, keep, axis=1)
+    return scores, rows
+
+def _sorted_results(scores, rows):
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(rows, order, axis=1)
+
+# -------------------------------------------
+# Exact search
+# -------------------------------------------
+
+class SimilarityIndex:
+    """
+    Unit-length feature vectors of the respondents (one row each) and their case numbers, for exact
+    cosine top-k queries.
+    """
+
+    def __init__(self, ids, features):
+        if len(ids) != len(features):
+            raise ValueError("ids and features must have the same number of rows")
+        self.ids = ids
+        self.features = np.ascontiguousarray(features, dtype=np.float32)
+        # Case numbers are looked up by binary search rather than through a dict of every row.
+        self._id_order = np.argsort(ids, kind="stable")
+        self._sorted_ids = ids[self._id_order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows_of(self, cases):
+        """
+        Returns the rows of the given case numbers (the first one when a case number repeats).
+        """
+        cases = np.asarray(cases, dtype=np.int64)
+        positions = np.searchsorted(self._sorted_ids, cases)
+        found = (positions < len(self._sorted_ids)) & (self._sorted_ids[np.minimum(positions, len(self) - 1)] == cases)
+        if not found.all():
+            raise ValueError(f"Unknown case numbers: {cases[~found].tolist()}")
+        return self._id_order[positions]
+
+    def top_k(self, queries, k=DEFAULT_K, exclude_rows=None):
+        """
+        Returns (scores, rows), each (len(queries), k) with the best first, of the k rows most similar to
+        each query vector. exclude_rows gives one row per query to leave out (the query's own row), or None.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(self) - (exclude_rows is not None))
+        block_rows = max(k + 1, SCORE_BLOCK_SIZE // len(queries))
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(self), block_rows):
+            block = self.features[start:start + block_rows]
+            scores = queries @ block.T
+            if exclude_rows is not None:
+                inside = (exclude_rows >= start) & (exclude_rows < start + len(block))
+                scores[np.flatnonzero(inside), exclude_rows[inside] - start] = -np.inf
+            rows = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+            if len(block) > k:
+                keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                rows = np.take_along_axis(rows, keep, axis=1)
+            best_scores, best_rows = _merge_top_k(best_scores, best_rows, scores, rows, k)
+        return _sorted_results(best_scores, best_rows)
+
+    def similar(self, cases, k=DEFAULT_K):
+        """
+        Returns, for each case number, the [(case, cosine similarity)] of the k most similar other respondents.
+        """
+        rows = self.rows_of(cases)
+        scores, found = self.top_k(self.features[rows], k, rows)
+        return _results(self.ids, scores, found)
+
+def _results(ids, scores, rows):
+    return [[(int(ids[row]), float(score)) for score, row in zip(query_scores, query_rows) if row >= 0]
+            for query_scores, query_rows in zip(scores, rows)]
+
+# -------------------------------------------
+# Approximate search
+# -------------------------------------------
+
+def _closest(vectors, centroids):
+    """
+    Returns the index of the most similar centroid of every vector.
+    """
+    block_rows = max(1, SCORE_BLOCK_SIZE // len(centroids))
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_rows):
+        assignment[start:start + block_rows] = np.argmax(vectors[start:start + block_rows] @ centroids.T, axis=1)
+    return assignment
+
+class IVFIndex:
+    """
+    An inverted file over a SimilarityIndex: nlist clusters found by spherical k-means on a sample of the rows,
+    with each cluster's rows stored contiguously (a reordered copy of the features), so probing a cluster reads
+    one slice. Queries score the rows of their nprobe closest clusters only.
+    """
+
+    def __init__(self, index, nlist=None, seed=DEFAULT_SEED, iterations=KMEANS_ITERATIONS):
+        self.index = index
+        features = index.features
+        nlist = max(1, min(nlist or int(np.sqrt(len(features))), len(features)))
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(features), nlist * KMEANS_SAMPLE_PER_LIST)
+        sample = features[np.sort(rng.choice(len(features), sample_size, replace=False))]
+
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = _closest(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=nlist)
+            # Empty clusters restart from random sample rows.
+            empty = np.flatnonzero(counts == 0)
+            sums[empty] = sample[rng.choice(len(sample), len(empty))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.where(norms > 0, norms, 1)
+        self.centroids = centroids.astype(np.float32)
+
+        assignment = _closest(features, self.centroids)
+        self.order = np.argsort(assignment, kind="stable")
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))])
+        self.vectors = features[self.order]
+
+    def __len__(self):
+        return len(self.centroids)
+
+    def top_k(self, queries, k=DEFAULT_K, nprobe=DEFAULT_NPROBE, exclude_rows=None):
+        """
+        Returns (scores, rows) like SimilarityIndex.top_k, from the rows of the nprobe clusters closest to each
+        query. Rows are -1 (with score -inf) when the probed clusters hold fewer than k rows.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        nprobe = min(nprobe, len(self))
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, query in enumerate(queries):
+            slices = [slice(self.offsets[cluster], self.offsets[cluster + 1]) for cluster in probes[i]]
+            candidates = np.concatenate([self.order[part] for part in slices])
+            candidate_scores = np.concatenate([self.vectors[part] @ query for part in slices])
+            if exclude_rows is not None:
+                candidate_scores[candidates == exclude_rows[i]] = -np.inf
+            found = min(k, len(candidates))
+            keep = np.argpartition(-candidate_scores, found - 1)[:found] if found < len(candidates) else np.arange(found)
+            scores[i, :found] = candidate_scores[keep]
+            rows[i, :found] = candidates[keep]
+        rows[np.isneginf(scores)] = -1
+        return _sorted_results(scores, rows)
+
+    def similar(self, cases, k=DEFAULT_K, nprobe=DEFAULT_NPROBE):
+        """
+        Returns, for each case number, the approximate [(case, cosine similarity)] of the k most similar respondents.
+        """
+        rows = self.index.rows_of(cases)
+        scores, found = self.top_k(self.index.features[rows], k, nprobe, rows)
+        return _results(self.index.ids, scores, found)
+
+def recall(exact_scores, approximate_scores, tolerance=1e-5):
+    """
+    Returns the share of the approximate results that are as similar as the exact k-th best result.
+    Many respondents have identical profiles, so results are compared by score rather than by row.
+    """
+    threshold = exact_scores[:, -1:] - tolerance
+    return float(np.mean(approximate_scores >= threshold))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the respondents with the most similar spend profiles.")
+    parser.add_argument("cases", nargs="*", type=int, help="case numbers to look up (default: the first row)")
+    parser.add_argument("--source", default="sample_data.csv", help="CSV file of survey rows")
+    parser.add_argument("--limit", type=int, default=0, help="rows to load (0 loads every row)")
+    parser.add_argument("--k", type=int, default=DEFAULT_K, help="similar respondents per case")
+    parser.add_argument("--unweighted", action="store_true", help="standardize without the Weights_QTR weights")
+    parser.add_argument("--nlist", type=int, default=None, help="clusters of the approximate index (default sqrt(rows))")
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="clusters scored per query")
+    parser.add_argument("--queries", type=int, default=1000, help="random respondents used to time both searches")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    ids, amounts, weights = load_features(args.source, limit=args.limit or None)
+    features = normalize_features(amounts, None if args.unweighted else weights)
+    index = SimilarityIndex(ids, features)
+    print(f"Loaded {len(index)} respondents x {features.shape[1]} features in {time.perf_counter() - start:.2f}s "
+          f"({features.nbytes / 1e6:.1f} MB)")
+    start = time.perf_counter()
+    ivf = IVFIndex(index, args.nlist)
+    print(f"Built the approximate index ({len(ivf)} clusters) in {time.perf_counter() - start:.2f}s")
+
+    cases = args.cases or [int(ids[0])]
+    for case, exact, approximate in zip(cases, index.similar(cases, args.k), ivf.similar(cases, args.k, args.nprobe)):
+        print(f"\nRespondents like case {case}:")
+        print("exact:       " + ", ".join(f"{other} ({score:.3f})" for other, score in exact))
+        print("approximate: " + ", ".join(f"{other} ({score:.3f})" for other, score in approximate))
+
+    rng = np.random.default_rng(DEFAULT_SEED)
+    rows = rng.choice(len(index), min(args.queries, len(index)), replace=False)
+    queries = index.features[rows]
+    start = time.perf_counter()
+    exact_scores, _ = index.top_k(queries, args.k, rows)
+    exact_time = time.perf_counter() - start
+    start = time.perf_counter()
+    approximate_scores, _ = ivf.top_k(queries, args.k, args.nprobe, rows)
+    approximate_time = time.perf_counter() - start
+    print(f"\n{len(rows)} queries, top {args.k}: exact {exact_time / len(rows) * 1e3:.3f} ms/query, "
+          f"approximate {approximate_time / len(rows) * 1e3:.3f} ms/query (nprobe={args.nprobe}), "
+          f"recall {recall(exact_scores, approximate_scores):.3f}")
+
+if __name__ == "__main__":
+    main()
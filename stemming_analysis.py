@@ -1,19 +1,16 @@
+import argparse
 import json
-from elasticsearch import Elasticsearch
+
+from es_pipeline import DEFAULT_ES_HOST, connect_es
+from index_settings import STEMMING_SETTINGS
 
 # -------------------------------------------
 # Step 1: Connect to Elasticsearch using HTTPS
 # -------------------------------------------
-es = Elasticsearch(
-    "https://localhost:9200",
-    basic_auth=("elastic", "password"),
-    verify_certs=False
-)
-
-if not es.ping():
-    raise ValueError("Connection failed: Ensure Elasticsearch is running on https://localhost:9200")
-else:
-    print("Connected to Elasticsearch.")
+parser = argparse.ArgumentParser(description="Index documents with the stemming analyzer and compare stemmed tokens.")
+parser.add_argument("--host", default=None, help=f"Elasticsearch server (default: $ES_HOST or {DEFAULT_ES_HOST})")
+args = parser.parse_args()
+es = connect_es(host=args.host)
 
 # -------------------------------------------
 # Step 2: Create an index with a custom stemming analyzer
@@ -23,27 +20,7 @@ else:
 #   - "lowercase" filter: converts tokens to lower case.
 #   - "porter_stem" filter: reduces tokens to their word stem.
 index_name = "articles_stemming"
-settings = {
-    "settings": {
-        "analysis": {
-            "analyzer": {
-                "stem_analyzer": {
-                    "type": "custom",
-                    "tokenizer": "standard",
-                    "filter": ["lowercase", "porter_stem"]
-                }
-            }
-        }
-    },
-    "mappings": {
-        "properties": {
-            "content": {
-                "type": "text",
-                "analyzer": "stem_analyzer"
-            }
-        }
-    }
-}
+settings = STEMMING_SETTINGS  # defined in index_settings.py
 
 # Delete the index if it exists for a clean start
 if es.indices.exists(index=index_name):
@@ -0,0 +1,118 @@
+import argparse
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_cache import load_frame
+
+# Generates survey data with the schema of sample_data.csv at any size (10k to 10M rows and beyond),
+# for benchmarks. Values are drawn from the empirical distribution of a reference file: columns that
+# depend on each other (city and country, purpose group and purpose, the spend columns and their totals,
+# ...) are sampled together from the same reference row, the rest independently, so value frequencies,
+# missing-value rates and the shape of the text are those of the real data.
+
+DEFAULT_REFERENCE = "sample_data.csv"
+DEFAULT_CHUNK_SIZE = 100000
+DEFAULT_SEED = 42
+
+# Spread of the per-row factor applied to the spend columns, so the synthetic data has many more
+# distinct amounts than the reference while each row's totals stay consistent.
+SPEND_JITTER = 0.3
+
+# Columns sampled together from one reference row.
+COLUMN_GROUPS = [
+    ["Year", "R.mth", "date", "Weights_QTR"],
+    ["Country_residence", "City_residence"],
+    ["Purpose_grp", "Purpose"],
+    ["Air_Terminal", "Sea_Terminal", "Land_Terminal"],
+    ["f3_occupation", "f4_industry", "f5_designation", "f5_designation.oth"],
+    ["MainAccomm", "MainHotel"],
+    ["travel_companion.1", "travel_companion.2", "travel_companion.3",
+     "travel_companion.4", "travel_companion.5"],
+]
+
+def parse_rows(text):
+    """
+    Parses a row count such as 10000, 10k or 1M.
+    """
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([kKmM]?)", str(text).strip())
+    if not match:
+        raise ValueError(f"Invalid row count: {text}")
+    number, suffix = match.groups()
+    return int(float(number) * {"": 1, "k": 1000, "m": 1000000}[suffix.lower()])
+
+def spend_columns(columns):
+    return [column for column in columns if "$" in column]
+
+def column_groups(columns):
+    """
+    Splits the columns of the reference into groups sampled together.
+    "case" is not sampled; it is numbered sequentially so it stays a unique id.
+    """
+    available = set(columns)
+    groups = [[column for column in group if column in available] for group in COLUMN_GROUPS]
+    groups = [group for group in groups if group]
+    spend = spend_columns(columns)
+    if spend:
+        groups.append(spend)
+    grouped = {column for group in groups for column in group} | {"case"}
+    groups.extend([column] for column in columns if column not in grouped)
+    return groups
+
+def iter_synthetic_chunks(reference, rows, chunk_size=DEFAULT_CHUNK_SIZE, seed=DEFAULT_SEED):
+    """
+    Yields DataFrames with the columns of the reference DataFrame, rows rows in total, chunk_size at a time.
+    The same seed always produces the same data.
+    """
+    rng = np.random.default_rng(seed)
+    groups = column_groups(list(reference.columns))
+    spend = set(spend_columns(reference.columns))
+    values = {column: reference[column].to_numpy(dtype=float if column in spend else object)
+              for group in groups for column in group}
+
+    for start in range(0, rows, chunk_size):
+        size = min(chunk_size, rows - start)
+        data = {}
+        for group in groups:
+            sampled_rows = rng.integers(0, len(reference), size)
+            for column in group:
+                data[column] = values[column][sampled_rows]
+            if group[0] in spend:
+                factors = rng.lognormal(0.0, SPEND_JITTER, size)
+                for column in group:
+                    data[column] = np.round(data[column] * factors, 6)
+        if "case" in reference.columns:
+            data["case"] = np.arange(start + 1, start + size + 1)
+        yield pd.DataFrame(data, columns=reference.columns, index=pd.RangeIndex(start, start + size))
+
+def write_synthetic(output_file, rows, reference_file=DEFAULT_REFERENCE, chunk_size=DEFAULT_CHUNK_SIZE,
+                    seed=DEFAULT_SEED):
+    """
+    Writes rows synthetic survey rows to a CSV file, one chunk at a time.
+    """
+    reference = load_frame(reference_file, mmap=False)
+    tmp_file = f"{output_file}.tmp"
+    start = time.perf_counter()
+    for chunk in iter_synthetic_chunks(reference, rows, chunk_size, seed):
+        chunk.to_csv(tmp_file, mode="w" if chunk.index[0] == 0 else "a", header=chunk.index[0] == 0, index=False)
+    os.replace(tmp_file, output_file)
+    print(f"Wrote {rows} synthetic rows to {output_file} in {time.perf_counter() - start:.2f}s.")
+    return output_file
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic survey data with realistic value distributions.")
+    parser.add_argument("--rows", type=parse_rows, default=parse_rows("10k"), help="number of rows, e.g. 100k or 1M")
+    parser.add_argument("--output", default=None, help="CSV file to write (default: synthetic_<rows>.csv)")
+    parser.add_argument("--reference", default=DEFAULT_REFERENCE,
+                        help="CSV file or workbook whose value distributions are reproduced")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows generated per chunk")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    args = parser.parse_args(argv)
+    write_synthetic(args.output or f"synthetic_{args.rows}.csv", args.rows, args.reference, args.chunk_size,
+                    args.seed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import json
+import os
+
+from analysis import PARITY_INDICES, PARITY_TEXTS, check_parity
+from conftest import ROOT
+
+FIXTURE = os.path.join(ROOT, "analysis_parity.json")
+
+def test_fixture_covers_every_analyzer_and_text():
+    with open(FIXTURE, encoding="utf-8") as f:
+        cases = json.load(f)["cases"]
+    covered = {(case["index"], case["text"]) for case in cases}
+    assert covered >= {(index, text) for index in PARITY_INDICES for text in PARITY_TEXTS}
+
+def test_local_analyzers_match_fixture():
+    assert check_parity(FIXTURE) == []
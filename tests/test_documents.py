@@ -0,0 +1,15 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from documents import build_ids
+
+def test_ids_do_not_depend_on_the_column_dtype():
+    assert build_ids(pd.DataFrame({"case": [1, 2, 4]}), ["case"]) == ["1", "2", "4"]
+    assert build_ids(pd.DataFrame({"case": [1.0, 2.0, 4.0]}), ["case"]) == ["1", "2", "4"]
+    df = pd.DataFrame({"Year": [2015.0, 2016.0], "case": [7, 7]})
+    assert build_ids(df, ["Year", "case"]) == ["2015-7", "2016-7"]
+
+def test_missing_ids_are_rejected():
+    with pytest.raises(ValueError, match="missing"):
+        build_ids(pd.DataFrame({"case": [1, 2, np.nan, 4]}), ["case"])
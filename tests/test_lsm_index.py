@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+from index_settings import PIPELINE_SETTINGS
+from local_engine import LocalSearchEngine
+from lsm_index import LSMSearchEngine
+from test_segment import WORDS, random_documents
+
+INDEX = "articles_pipeline"
+
+def search_all(es, query):
+    response = es.search(index=INDEX, body={"query": query, "size": 10000})
+    return response["hits"]["total"]["value"], {hit["_id"]: hit["_score"] for hit in response["hits"]["hits"]}
+
+def assert_same_results(lsm, reference, rng):
+    queries = [{"match_all": {}}] + [{"match": {"content": " ".join(rng.sample(WORDS, rng.randint(1, 3)))}}
+                                     for _ in range(5)]
+    queries.append({"match_phrase": {"content": " ".join(rng.sample(WORDS, 2))}})
+    for query in queries:
+        expected_total, expected = search_all(reference, query)
+        total, actual = search_all(lsm, query)
+        assert total == expected_total, query
+        assert actual.keys() == expected.keys(), query
+        for doc_id, score in actual.items():
+            assert score == pytest.approx(expected[doc_id], rel=1e-6), (query, doc_id)
+
+def random_operations(rng, count, next_id):
+    """
+    Returns bulk operations that add new documents, replace existing ones and delete some (including ids that
+    do not exist), and the next unused document number.
+    """
+    operations = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.6 or not next_id:
+            doc_id, next_id = f"doc{next_id}", next_id + 1
+        else:
+            doc_id = f"doc{rng.randrange(next_id + 5)}"
+        if kind < 0.85:
+            operations.append({"index": {"_index": INDEX, "_id": doc_id}})
+            operations.append(random_documents(rng, 1)[0][1])
+        else:
+            operations.append({"delete": {"_index": INDEX, "_id": doc_id}})
+    return operations, next_id
+
+def test_lsm_index_matches_local_engine(tmp_path):
+    rng = random.Random(29)
+    root = str(tmp_path / "lsm")
+    options = {"buffer_docs": 40, "merge_factor": 3, "floor_docs": 20, "merge_process": False}
+    lsm = LSMSearchEngine(root, **options)
+    reference = LocalSearchEngine()
+    for es in (lsm, reference):
+        es.indices.create(index=INDEX, body=PIPELINE_SETTINGS)
+
+    next_id = 0
+    try:
+        for step in range(24):
+            operations, next_id = random_operations(rng, rng.randint(1, 60), next_id)
+            for es in (lsm, reference):
+                es.bulk(operations=operations)
+            lsm.indices.refresh(index=INDEX)
+            if step % 6 == 2:
+                lsm.get_index(INDEX).flush()
+            elif step % 6 == 4:
+                lsm.indices.forcemerge(index=INDEX, max_num_segments=1 if step % 12 == 4 else None)
+            elif step % 6 == 5:
+                lsm.close()
+                lsm = LSMSearchEngine(root, **options)
+            assert_same_results(lsm, reference, rng)
+        # Tombstones in committed segments were carried across the last reopen.
+        assert any(deleted for _, _, deleted in lsm.get_index(INDEX).stats()["segments"])
+    finally:
+        lsm.close()
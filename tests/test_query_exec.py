@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+from index_settings import PIPELINE_SETTINGS
+from local_engine import LocalSearchEngine
+from query_exec import QueryExecutor
+from test_segment import WORDS, random_documents, write_segment
+
+INDEX = "articles_pipeline"
+
+@pytest.fixture(scope="module")
+def engines(tmp_path_factory):
+    """
+    The same random documents as a segment run by QueryExecutor and as a LocalIndex of the embedded engine.
+    """
+    documents = random_documents(random.Random(3), 700)
+    executor = QueryExecutor(write_segment(tmp_path_factory.mktemp("segment"), documents))
+    es = LocalSearchEngine()
+    es.indices.create(index=INDEX, body=PIPELINE_SETTINGS)
+    for doc_id, source in documents:
+        es.get_index(INDEX).index(doc_id, source)
+    return executor, es, documents
+
+def random_queries(rng, documents, count):
+    """
+    Yields match (or / and), match_phrase and bool must queries; phrases are taken from the documents so
+    that most of them match.
+    """
+    for _ in range(count):
+        shape = rng.choice(["or", "and", "phrase", "must"])
+        words = " ".join(rng.sample(WORDS, rng.randint(1, 3)))
+        if shape == "or":
+            yield {"match": {"content": words}}
+        elif shape == "and":
+            yield {"match": {"content": {"query": words, "operator": "and"}}}
+        elif shape == "must":
+            yield {"bool": {"must": [{"match": {"content": {"query": word, "operator": "and"}}}
+                                     for word in words.split()]}}
+        else:
+            text = rng.choice(documents)[1]["content"].split()
+            start = rng.randint(0, max(0, len(text) - 2))
+            yield {"match_phrase": {"content": " ".join(text[start:start + rng.randint(2, 3)]) or words}}
+
+def hit_scores(response):
+    return {hit["_id"]: hit["_score"] for hit in response["hits"]["hits"]}
+
+def test_every_hit_and_score_matches_the_engine(engines):
+    executor, es, documents = engines
+    for query in random_queries(random.Random(17), documents, 200):
+        body = {"query": query, "size": len(documents)}
+        assert executor.supports(body)
+        expected = es.search(index=INDEX, body=body)
+        actual = executor.search(body)
+        assert actual["hits"]["total"] == expected["hits"]["total"], query
+        expected_scores = hit_scores(expected)
+        actual_scores = hit_scores(actual)
+        assert actual_scores.keys() == expected_scores.keys(), query
+        for doc_id, score in actual_scores.items():
+            assert score == pytest.approx(expected_scores[doc_id], rel=1e-6), (query, doc_id)
+
+def test_top_hits_match_the_engine(engines):
+    executor, es, documents = engines
+    for query in random_queries(random.Random(23), documents, 200):
+        size = random.Random(str(query)).randint(1, 15)
+        expected = es.search(index=INDEX, body={"query": query, "size": len(documents)})
+        actual = executor.search({"query": query, "size": size})
+        expected_scores = hit_scores(expected)
+        ranked = sorted(expected_scores.values(), reverse=True)[:size]
+        assert [hit["_score"] for hit in actual["hits"]["hits"]] == pytest.approx(ranked, rel=1e-6), query
+        # With ties at the cut-off, either engine may return any of the tied documents.
+        for doc_id, score in hit_scores(actual).items():
+            assert score == pytest.approx(expected_scores[doc_id], rel=1e-6), (query, doc_id)
@@ -0,0 +1,80 @@
+import random
+
+import numpy as np
+
+from index_settings import PIPELINE_SETTINGS
+from local_engine import LocalIndex
+from segment import SKIP_INTERVAL, Segment, SegmentWriter, decode_varints, encode_varints
+
+WORDS = ["singapore", "hotel", "tourist", "jakarta", "indonesian", "budget", "shopping", "airport", "family",
+         "business", "leisure", "terminal", "student", "holiday", "friends", "orchard", "marina", "food"]
+
+def random_documents(rng, count):
+    """
+    Returns (id, source) pairs whose words follow a skewed distribution, so the common terms span several
+    skip blocks and the rare ones a single, short block.
+    """
+    weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+    return [(f"doc{number}", {"content": " ".join(rng.choices(WORDS, weights, k=rng.randint(0, 12)))})
+            for number in range(count)]
+
+def write_segment(directory, documents):
+    writer = SegmentWriter(str(directory), "articles_pipeline", PIPELINE_SETTINGS)
+    for doc_id, source in documents:
+        writer.add(doc_id, source)
+    writer.close()
+    return Segment(str(directory))
+
+def test_varints_round_trip():
+    rng = np.random.default_rng(7)
+    edges = [0, 1, 127, 128, 255, 16383, 16384, 2 ** 31 - 1, 2 ** 32, 2 ** 62]
+    for bits in (7, 14, 21, 35, 62):
+        values = np.concatenate([edges, rng.integers(0, 2 ** bits, size=1000)]).astype(np.int64)
+        encoded, sizes = encode_varints(values)
+        assert len(encoded) == int(sizes.sum())
+        assert np.array_equal(decode_varints(encoded), values)
+        assert np.array_equal(decode_varints(np.frombuffer(encoded, dtype=np.uint8)), values)
+
+def test_varints_empty():
+    encoded, sizes = encode_varints([])
+    assert encoded == b"" and len(sizes) == 0
+    assert len(decode_varints(b"")) == 0
+
+def test_segment_postings_match_local_index(tmp_path):
+    documents = random_documents(random.Random(11), 3 * SKIP_INTERVAL + 17)
+    segment = write_segment(tmp_path / "segment", documents)
+    local_index = LocalIndex("articles_pipeline", PIPELINE_SETTINGS)
+    for doc_id, source in documents:
+        local_index.index(doc_id, source)
+
+    assert segment.doc_count() == local_index.doc_count()
+    assert segment.avg_field_length("content") == local_index.avg_field_length("content")
+    field_index = segment.postings["content"]
+    expected_terms = {term for term, docs in local_index.postings["content"].items() if docs}
+    assert set(field_index.terms) == {term.encode("utf-8") for term in expected_terms}
+    assert any(doc_freq > SKIP_INTERVAL for doc_freq in field_index.doc_freqs)
+    for term in expected_terms:
+        assert segment.term_postings("content", term) == local_index.term_postings("content", term)
+    for doc in range(len(documents)):
+        assert segment.get_source(doc) == local_index.get_source(doc)
+
+def test_skip_blocks_decode_to_the_full_postings(tmp_path):
+    segment = write_segment(tmp_path / "segment", random_documents(random.Random(5), 4 * SKIP_INTERVAL + 3))
+    field_index = segment.postings["content"]
+    for ordinal in range(len(field_index)):
+        docs, freqs = field_index.docs(ordinal)
+        positions = field_index.flat_positions(ordinal, freqs)
+        skips = field_index.blocks(ordinal)
+        last_docs = skips[0]
+        assert len(last_docs) == -(-len(docs) // SKIP_INTERVAL)
+        block_docs, block_freqs, block_positions = [], [], []
+        for block in range(len(last_docs)):
+            block_doc_ids, block_doc_freqs = field_index.block_docs(ordinal, block, skips)
+            block_docs.append(block_doc_ids)
+            block_freqs.append(block_doc_freqs)
+            block_positions.append(field_index.block_positions(ordinal, block, block_doc_freqs, skips))
+            if len(last_docs) > 1:
+                assert block_doc_ids[-1] == last_docs[block]
+        assert np.array_equal(np.concatenate(block_docs), docs)
+        assert np.array_equal(np.concatenate(block_freqs), freqs)
+        assert np.array_equal(np.concatenate(block_positions), positions)
@@ -1,19 +1,16 @@
+import argparse
 import json
-from elasticsearch import Elasticsearch
+
+from es_pipeline import DEFAULT_ES_HOST, connect_es
+from index_settings import TOKEN_SETTINGS
 
 # -------------------------------------------
 # Step 1: Connect to Elasticsearch using HTTPS
 # -------------------------------------------
-es = Elasticsearch(
-    "https://localhost:9200",
-    basic_auth=("elastic", "password"),
-    verify_certs=False
-)
-
-if not es.ping():
-    raise ValueError("Connection failed: Ensure Elasticsearch is running on https://localhost:9200")
-else:
-    print("Connected to Elasticsearch.")
+parser = argparse.ArgumentParser(description="Index documents with the tokenization and case folding analyzer.")
+parser.add_argument("--host", default=None, help=f"Elasticsearch server (default: $ES_HOST or {DEFAULT_ES_HOST})")
+args = parser.parse_args()
+es = connect_es(host=args.host)
 
 # -------------------------------------------
 # Step 2: Create an index with a custom analyzer for tokenization and case folding
@@ -22,27 +19,7 @@ else:
 #   - "standard" tokenizer: splits text based on language-independent rules.
 #   - "lowercase" filter: performs case folding (converts tokens to lower case).
 index_name = "articles_token"
-settings = {
-    "settings": {
-        "analysis": {
-            "analyzer": {
-                "my_lowercase_analyzer": {
-                    "type": "custom",
-                    "tokenizer": "standard",
-                    "filter": ["lowercase"]
-                }
-            }
-        }
-    },
-    "mappings": {
-        "properties": {
-            "content": {
-                "type": "text",
-                "analyzer": "my_lowercase_analyzer"
-            }
-        }
-    }
-}
+settings = TOKEN_SETTINGS  # defined in index_settings.py
 
 # Delete index if it already exists (for a clean start)
 if es.indices.exists(index=index_name):